@@ -0,0 +1,613 @@
+"""
+In-memory multicast occupancy index for the address map.
+アドレスマップ用のマルチキャスト使用状況インデックス（メモリ上）
+
+One bit per IPv4 address, allocated lazily per /8 of 224.0.0.0/4 (2 MiB
+each, only for the /8s that actually hold flows), plus the sorted list of
+reserved child bucket ranges. Non-multicast values (typos, unicast) are kept
+in a small dict so they never allocate a bitmap. Counting used addresses in any range is a
+popcount over a byte slice and listing them skips empty bytes in C, so a /8
+map no longer walks 16M addresses in Python.
+
+The index is built from PostgreSQL on startup. Every flow write re-counts the
+addresses it touched from the database and publishes them with NOTIFY, so the
+other worker processes re-count the same addresses (see bucket_cache for the
+LISTEN side). Re-counting instead of applying deltas keeps the result exact
+whatever order writes and notifications arrive in. ``ADDRESS_INDEX_MAX_AGE``
+seconds after a build the index is rebuilt as a safety net (0 disables it).
+"""
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from ipaddress import IPv4Address
+
+from app.config import env_float
+from app.db import db_connection
+
+logger = logging.getLogger("mmam.address_occupancy")
+
+
+ADDRESS_INDEX_MAX_AGE = env_float("ADDRESS_INDEX_MAX_AGE", 300.0)
+
+NOTIFY_CHANNEL = "mmam_flow_addresses"
+# Addresses per NOTIFY payload (PostgreSQL caps payloads below 8000 bytes)
+NOTIFY_BATCH = 500
+# Larger changes ask the other workers for a full rebuild instead
+NOTIFY_REBUILD_THRESHOLD = 5000
+# Identifies this process's own notifications
+_ORIGIN = uuid.uuid4().hex
+
+OCTET_BITS = 24
+OCTET_SIZE = 1 << OCTET_BITS
+OCTET_BYTES = OCTET_SIZE // 8
+CHUNK_BITS = 12
+CHUNK_COUNT = OCTET_SIZE >> CHUNK_BITS
+# Only 224.0.0.0/4 gets bitmaps; anything else a flow holds (typos, unicast)
+# is kept in a small dict instead of costing a 2 MiB bitmap per /8
+BITMAP_OCTETS = range(224, 240)
+
+# Flow columns that occupy an address on the map (A and B legs).
+OCCUPYING_COLUMNS = ("multicast_addr_a", "multicast_addr_b")
+
+_NONZERO_RE = re.compile(rb"[^\x00]+")
+# Bit positions (MSB first) set in each byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if value & (0x80 >> bit)) for value in range(256)]
+
+
+def address_to_int(value) -> int | None:
+    """
+    Python twin of the mmam_ipv4_int() SQL helper: plain IPv4 text -> int, else None.
+    SQL の mmam_ipv4_int() と同じ規則で IPv4 文字列を整数に変換する。
+    """
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return int(IPv4Address(text))
+    except ValueError:
+        return None
+
+
+def _popcount(bits: bytearray, lo: int, hi: int) -> int:
+    """Count set bits for offsets lo..hi (inclusive) inside one bitmap."""
+    first_byte = lo >> 3
+    last_byte = hi >> 3
+    value = int.from_bytes(bits[first_byte:last_byte + 1], "big")
+    width = (last_byte - first_byte + 1) * 8
+    value &= (1 << (width - (lo & 7))) - 1
+    value >>= 7 - (hi & 7)
+    return value.bit_count()
+
+
+def merge_ranges(ranges) -> list[tuple[int, int]]:
+    """Merge (start, end, ...) ranges into sorted, disjoint inclusive (start, end) pairs."""
+    merged: list[list[int]] = []
+    for item in sorted(ranges):
+        start, end = item[0], item[1]
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def iter_free_runs(start_int: int, end_int: int, used: list[int], blocked):
+    """
+    Yield maximal free (start, end) runs in [start_int, end_int].
+    空き連続範囲を順に返す。
+
+    ``used`` is a sorted list of used addresses and ``blocked`` any
+    (start, end, ...) ranges; the work follows the number of obstacles,
+    not the size of the range.
+    """
+    blocked = merge_ranges(blocked)
+    cursor = start_int
+    blocked_pos = 0
+    used_pos = 0
+    while blocked_pos < len(blocked) or used_pos < len(used):
+        if used_pos < len(used) and (blocked_pos >= len(blocked) or used[used_pos] < blocked[blocked_pos][0]):
+            obstacle_start = obstacle_end = used[used_pos]
+            used_pos += 1
+        else:
+            obstacle_start, obstacle_end = blocked[blocked_pos]
+            blocked_pos += 1
+        if obstacle_end < cursor:
+            continue
+        if obstacle_start > cursor:
+            yield cursor, min(obstacle_start - 1, end_int)
+        cursor = obstacle_end + 1
+        if cursor > end_int:
+            return
+    yield cursor, end_int
+
+
+def fit_blocks(runs, size: int, align: int = 1, count: int = 1) -> list[int]:
+    """Start addresses of the first ``count`` blocks of ``size`` aligned to ``align`` inside ``runs``."""
+    step = -(-size // align) * align
+    starts: list[int] = []
+    for run_start, run_end in runs:
+        candidate = -(-run_start // align) * align
+        while candidate + size - 1 <= run_end:
+            starts.append(candidate)
+            if len(starts) >= count:
+                return starts
+            candidate += step
+    return starts
+
+
+class _OctetBitmap:
+    """
+    One /8: a 2 MiB bitmap plus a used-count per 4096-address chunk.
+    /8 単位のビットマップと 4096 アドレスごとの使用数。
+
+    The chunk counts (8 KiB) let range counts skip full chunks and listings
+    skip empty chunks, so sparse /8s cost little more than their used bits.
+    """
+
+    __slots__ = ("bits", "chunks")
+
+    def __init__(self):
+        self.bits = bytearray(OCTET_BYTES)
+        self.chunks = array("H", bytes(2 * CHUNK_COUNT))
+
+    def set(self, offset: int) -> bool:
+        mask = 0x80 >> (offset & 7)
+        if self.bits[offset >> 3] & mask:
+            return False
+        self.bits[offset >> 3] |= mask
+        self.chunks[offset >> CHUNK_BITS] += 1
+        return True
+
+    def clear(self, offset: int) -> None:
+        mask = 0x80 >> (offset & 7)
+        if self.bits[offset >> 3] & mask:
+            self.bits[offset >> 3] &= ~mask & 0xFF
+            self.chunks[offset >> CHUNK_BITS] -= 1
+
+    def count(self, lo: int, hi: int) -> int:
+        first_chunk = lo >> CHUNK_BITS
+        last_chunk = hi >> CHUNK_BITS
+        if first_chunk == last_chunk:
+            return _popcount(self.bits, lo, hi) if self.chunks[first_chunk] else 0
+        total = sum(self.chunks[first_chunk + 1:last_chunk])
+        if self.chunks[first_chunk]:
+            total += _popcount(self.bits, lo, ((first_chunk + 1) << CHUNK_BITS) - 1)
+        if self.chunks[last_chunk]:
+            total += _popcount(self.bits, last_chunk << CHUNK_BITS, hi)
+        return total
+
+    def collect(self, base: int, lo: int, hi: int, out: list) -> None:
+        bits = self.bits
+        chunks = self.chunks
+        for chunk in range(lo >> CHUNK_BITS, (hi >> CHUNK_BITS) + 1):
+            if not chunks[chunk]:
+                continue
+            first_byte = max(lo, chunk << CHUNK_BITS) >> 3
+            last_byte = min(hi, ((chunk + 1) << CHUNK_BITS) - 1) >> 3
+            for match in _NONZERO_RE.finditer(bits, first_byte, last_byte + 1):
+                for byte_index in range(match.start(), match.end()):
+                    first = base + (byte_index << 3)
+                    out.extend(first + bit for bit in _BYTE_BITS[bits[byte_index]])
+
+
+class OccupancyIndex:
+    """
+    Used-address bitmaps per /8 plus reserved child ranges.
+    /8 ごとの使用ビットマップと予約済み子バケット範囲。
+
+    Several flows may share one address; the bitmap keeps a single bit and
+    ``_extra`` counts the additional references so removals stay exact.
+    Addresses outside 224.0.0.0/4 are counted in ``_stray`` (address ->
+    references) with a sorted key list for range queries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._octets: dict[int, _OctetBitmap] = {}
+        self._extra: dict[int, int] = {}
+        self._stray: dict[int, int] = {}
+        self._stray_sorted: list[int] = []
+        self._reserved: list[tuple[int, int, int]] = []
+        self._reserved_starts: list[int] = []
+        self._built_at: float | None = None
+
+    @staticmethod
+    def _add(octets: dict, extra: dict, addr: int) -> None:
+        octet = octets.get(addr >> OCTET_BITS)
+        if octet is None:
+            octet = octets[addr >> OCTET_BITS] = _OctetBitmap()
+        if not octet.set(addr & (OCTET_SIZE - 1)):
+            extra[addr] = extra.get(addr, 0) + 1
+
+    def _set_stray(self, addr: int, count: int) -> None:
+        if count > 0:
+            if addr not in self._stray:
+                insort(self._stray_sorted, addr)
+            self._stray[addr] = count
+        elif self._stray.pop(addr, None) is not None:
+            del self._stray_sorted[bisect_left(self._stray_sorted, addr)]
+
+    def _stray_between(self, start_int: int, end_int: int) -> list[int]:
+        keys = self._stray_sorted
+        return keys[bisect_left(keys, start_int):bisect_right(keys, end_int)]
+
+    # ---- building / 構築 ----
+    def load(self, addresses, reserved) -> None:
+        octets: dict[int, _OctetBitmap] = {}
+        extra: dict[int, int] = {}
+        stray: dict[int, int] = {}
+        for addr in addresses:
+            if addr >> OCTET_BITS in BITMAP_OCTETS:
+                self._add(octets, extra, addr)
+            else:
+                stray[addr] = stray.get(addr, 0) + 1
+        ranges = sorted(reserved)
+        with self._lock:
+            self._octets = octets
+            self._extra = extra
+            self._stray = stray
+            self._stray_sorted = sorted(stray)
+            self._reserved = ranges
+            self._reserved_starts = [item[0] for item in ranges]
+            self._built_at = time.monotonic()
+
+    def set_reserved(self, reserved) -> None:
+        ranges = sorted(reserved)
+        with self._lock:
+            self._reserved = ranges
+            self._reserved_starts = [item[0] for item in ranges]
+
+    def is_stale(self, max_age: float) -> bool:
+        if self._built_at is None:
+            return True
+        return max_age > 0 and time.monotonic() - self._built_at > max_age
+
+    def invalidate(self) -> None:
+        """Force a rebuild on the next get_index()."""
+        with self._lock:
+            self._built_at = None
+
+    # ---- incremental updates / 差分更新 ----
+    def add(self, addr: int) -> None:
+        with self._lock:
+            if addr >> OCTET_BITS in BITMAP_OCTETS:
+                self._add(self._octets, self._extra, addr)
+            else:
+                self._set_stray(addr, self._stray.get(addr, 0) + 1)
+
+    def remove(self, addr: int) -> None:
+        with self._lock:
+            if addr >> OCTET_BITS not in BITMAP_OCTETS:
+                self._set_stray(addr, self._stray.get(addr, 0) - 1)
+                return
+            extra = self._extra.get(addr)
+            if extra:
+                if extra == 1:
+                    del self._extra[addr]
+                else:
+                    self._extra[addr] = extra - 1
+                return
+            octet = self._octets.get(addr >> OCTET_BITS)
+            if octet is not None:
+                octet.clear(addr & (OCTET_SIZE - 1))
+
+    def set_count(self, addr: int, count: int) -> None:
+        """Set the number of flows using ``addr`` (as re-counted from the database)."""
+        with self._lock:
+            if addr >> OCTET_BITS not in BITMAP_OCTETS:
+                self._set_stray(addr, count)
+                return
+            octet = self._octets.get(addr >> OCTET_BITS)
+            if count <= 0:
+                self._extra.pop(addr, None)
+                if octet is not None:
+                    octet.clear(addr & (OCTET_SIZE - 1))
+                return
+            if octet is None:
+                octet = self._octets[addr >> OCTET_BITS] = _OctetBitmap()
+            octet.set(addr & (OCTET_SIZE - 1))
+            if count > 1:
+                self._extra[addr] = count - 1
+            else:
+                self._extra.pop(addr, None)
+
+    # ---- queries / 参照 ----
+    def _octet_slices(self, start_int: int, end_int: int):
+        for number in range(start_int >> OCTET_BITS, (end_int >> OCTET_BITS) + 1):
+            octet = self._octets.get(number)
+            if octet is None:
+                continue
+            base = number << OCTET_BITS
+            lo = max(start_int, base) - base
+            hi = min(end_int, base + OCTET_SIZE - 1) - base
+            yield base, octet, lo, hi
+
+    def count_used(self, start_int: int, end_int: int) -> int:
+        """Number of distinct used addresses in [start_int, end_int]."""
+        if end_int < start_int:
+            return 0
+        with self._lock:
+            used = sum(octet.count(lo, hi) for _, octet, lo, hi in self._octet_slices(start_int, end_int))
+            return used + len(self._stray_between(start_int, end_int))
+
+    def used_addresses(self, start_int: int, end_int: int) -> list[int]:
+        """Sorted distinct used addresses in [start_int, end_int]."""
+        result: list[int] = []
+        if end_int < start_int:
+            return result
+        with self._lock:
+            for base, octet, lo, hi in self._octet_slices(start_int, end_int):
+                octet.collect(base, lo, hi, result)
+            stray = self._stray_between(start_int, end_int)
+        # Only the edge bytes can carry bits outside the range
+        if result and (result[0] < start_int or result[-1] > end_int):
+            result = [addr for addr in result if start_int <= addr <= end_int]
+        if stray:
+            result = sorted(result + stray)
+        return result
+
+    def reserved_between(self, start_int: int, end_int: int) -> list[tuple[int, int, int]]:
+        """Reserved (start_int, end_int, bucket_id) ranges overlapping [start_int, end_int]."""
+        with self._lock:
+            stop = bisect_right(self._reserved_starts, end_int)
+            return [item for item in self._reserved[:stop] if item[1] >= start_int]
+
+    def histogram(self, start_int: int, cell_size: int, cells: int) -> list[tuple[int, int]]:
+        """
+        (used, reserved) per cell for ``cells`` consecutive cells of ``cell_size`` addresses.
+        連続するセルごとの（使用数, 予約数）を返す。
+
+        As on the address map, a used address inside a reserved range counts as used.
+        """
+        end_int = start_int + cell_size * cells - 1
+        reserved = merge_ranges(self.reserved_between(start_int, end_int))
+        result = []
+        pointer = 0
+        for cell in range(cells):
+            lo = start_int + cell * cell_size
+            hi = lo + cell_size - 1
+            while pointer < len(reserved) and reserved[pointer][1] < lo:
+                pointer += 1
+            reserved_free = 0
+            position = pointer
+            while position < len(reserved) and reserved[position][0] <= hi:
+                overlap_start = max(lo, reserved[position][0])
+                overlap_end = min(hi, reserved[position][1])
+                reserved_free += overlap_end - overlap_start + 1 - self.count_used(overlap_start, overlap_end)
+                position += 1
+            result.append((self.count_used(lo, hi), reserved_free))
+        return result
+
+    def free_runs(self, start_int: int, end_int: int, ignore_reserved=()):
+        """
+        Yield maximal (start, end) runs in [start_int, end_int] with no used or reserved address.
+        使用・予約のない連続範囲を順に返す。
+
+        ``ignore_reserved`` lists bucket ids whose reservation does not block.
+        """
+        blocked = [item for item in self.reserved_between(start_int, end_int) if item[2] not in ignore_reserved]
+        return iter_free_runs(start_int, end_int, self.used_addresses(start_int, end_int), blocked)
+
+    def free_blocks(self, start_int: int, end_int: int, size: int, align: int = 1, count: int = 1,
+                    ignore_reserved=()) -> list[int]:
+        """
+        Start addresses of the first ``count`` free blocks of ``size`` addresses aligned to ``align``.
+        空きブロック（size 個・align 境界）の先頭アドレスを最大 count 件返す。
+        """
+        return fit_blocks(self.free_runs(start_int, end_int, ignore_reserved), size, align, count)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self._built_at is not None,
+                "age_seconds": round(time.monotonic() - self._built_at, 3) if self._built_at else None,
+                "octets": sorted(self._octets),
+                "bitmap_bytes": len(self._octets) * (OCTET_BYTES + 2 * CHUNK_COUNT),
+                "shared_addresses": len(self._extra),
+                "stray_addresses": len(self._stray),
+                "reserved_ranges": len(self._reserved)
+            }
+
+
+_index = OccupancyIndex()
+_build_lock = threading.Lock()
+
+
+def _fetch_reserved(cur) -> list[tuple[int, int, int]]:
+    cur.execute("""
+        SELECT start_int, end_int, id
+        FROM address_buckets
+        WHERE kind = 'child' AND is_reserved
+        ORDER BY start_int;
+    """)
+    return [(row[0], row[1], row[2]) for row in cur.fetchall()]
+
+
+def _rebuild_locked() -> OccupancyIndex:
+    started = time.monotonic()
+    columns = [f"{column}_int" for column in OCCUPYING_COLUMNS]
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            " UNION ALL ".join(f"SELECT {column} FROM flows WHERE {column} IS NOT NULL" for column in columns) + ";"
+        )
+        addresses = [row[0] for row in cur.fetchall()]
+        reserved = _fetch_reserved(cur)
+    _index.load(addresses, reserved)
+    logger.info(
+        "Address occupancy index built: %s addresses, %s reserved ranges in %.1f ms",
+        len(addresses), len(reserved), (time.monotonic() - started) * 1000
+    )
+    return _index
+
+
+def rebuild() -> OccupancyIndex:
+    """
+    Reload the whole index from PostgreSQL.
+    PostgreSQL からインデックス全体を再構築する。
+    """
+    with _build_lock:
+        return _rebuild_locked()
+
+
+def index_stats() -> dict:
+    return _index.stats()
+
+
+def get_index() -> OccupancyIndex:
+    if _index.is_stale(ADDRESS_INDEX_MAX_AGE):
+        with _build_lock:
+            # Requests that queued behind another rebuild reuse its result
+            if _index.is_stale(ADDRESS_INDEX_MAX_AGE):
+                _rebuild_locked()
+    return _index
+
+
+# One branch per leg so each is an index scan on its *_int column
+_RECOUNT_SQL = " UNION ALL ".join(
+    f"SELECT {column}_int AS addr FROM flows WHERE {column}_int = ANY(%(addresses)s)"
+    for column in OCCUPYING_COLUMNS
+)
+RECOUNT_SQL = f"SELECT addr, count(*) FROM ({_RECOUNT_SQL}) used GROUP BY addr;"
+
+
+def resync(addresses) -> None:
+    """
+    Re-count the given addresses from PostgreSQL and store the exact counts.
+    指定アドレスの使用数を PostgreSQL から数え直す。
+
+    Runs under the build lock, so a recount never interleaves with a full
+    rebuild and the latest recount always reflects the latest commit.
+    """
+    addresses = sorted(set(addresses))
+    if not addresses or _index.is_stale(0):
+        return
+    with _build_lock:
+        if _index.is_stale(0):
+            return
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(RECOUNT_SQL, {"addresses": addresses})
+            counts = dict(cur.fetchall())
+        for addr in addresses:
+            _index.set_count(addr, counts.get(addr, 0))
+
+
+_BLOCK_USED_SQL = " UNION ALL ".join(
+    f"SELECT {column}_int FROM flows, unnest(%(starts)s::BIGINT[]) AS block(start) "
+    f"WHERE {column}_int BETWEEN block.start AND block.start + %(last)s"
+    for column in OCCUPYING_COLUMNS
+)
+
+
+def confirm_free_blocks(starts: list[int], size: int) -> list[int]:
+    """
+    Re-check index-proposed blocks against the flows table.
+    インデックスが提案したブロックを flows テーブルで再確認する。
+
+    Returns the starts that are still free. Addresses found in use (e.g.
+    assigned by another worker whose notification has not arrived yet) are
+    re-counted into the index so the next search skips them.
+    """
+    if not starts:
+        return []
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(_BLOCK_USED_SQL + ";", {"starts": list(starts), "last": size - 1})
+        used = {row[0] for row in cur.fetchall()}
+    if not used:
+        return list(starts)
+    resync(used)
+    return [start for start in starts if not any(start <= addr < start + size for addr in used)]
+
+
+def _touched_addresses(changes) -> set[int]:
+    touched = set()
+    for before, after in changes:
+        for column in OCCUPYING_COLUMNS:
+            for record in (before, after):
+                addr = address_to_int((record or {}).get(column))
+                if addr is not None:
+                    touched.add(addr)
+    return touched
+
+
+def _publish(addresses: set[int]) -> None:
+    if len(addresses) > NOTIFY_REBUILD_THRESHOLD:
+        payloads = [json.dumps({"origin": _ORIGIN, "rebuild": True})]
+    else:
+        ordered = sorted(addresses)
+        payloads = [
+            json.dumps({"origin": _ORIGIN, "addresses": ordered[start:start + NOTIFY_BATCH]}, separators=(",", ":"))
+            for start in range(0, len(ordered), NOTIFY_BATCH)
+        ]
+    try:
+        with db_connection() as conn, conn.cursor() as cur:
+            for payload in payloads:
+                cur.execute("SELECT pg_notify(%s, %s);", (NOTIFY_CHANNEL, payload))
+            conn.commit()
+    except Exception:
+        # The other workers fall back to their periodic rebuild
+        logger.exception("Failed to publish flow address changes")
+
+
+def apply_flow_changes(changes) -> None:
+    """
+    Update the index for committed flow writes and tell the other workers.
+    コミット済みのフロー更新をインデックスに反映し、他ワーカーへ通知する。
+
+    ``changes`` is an iterable of (before, after) records, either may be None.
+    """
+    touched = _touched_addresses(changes)
+    if not touched:
+        return
+    if len(touched) > NOTIFY_REBUILD_THRESHOLD:
+        _index.invalidate()
+    else:
+        resync(touched)
+    _publish(touched)
+
+
+def apply_flow_change(before: dict | None, after: dict | None) -> None:
+    """
+    Move a flow's occupancy from its old record to its new one (either may be None).
+    フロー更新前後のレコードから使用状況を更新する。
+    """
+    apply_flow_changes([(before, after)])
+
+
+def on_notify(payload: str | None) -> None:
+    """
+    LISTEN callback: re-count addresses changed by another worker.
+    ``None`` means notifications may have been missed (listener reconnect).
+    """
+    if payload is None:
+        _index.invalidate()
+        return
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logger.warning("Ignoring malformed flow address notification")
+        return
+    if message.get("origin") == _ORIGIN:
+        return
+    if message.get("rebuild"):
+        _index.invalidate()
+        return
+    resync(message.get("addresses") or [])
+
+
+def refresh_reserved() -> None:
+    """
+    Reload reserved child ranges after a bucket write.
+    バケット更新後に予約範囲を再読込する。
+    """
+    if _index.is_stale(0):
+        return
+    with db_connection() as conn, conn.cursor() as cur:
+        reserved = _fetch_reserved(cur)
+    _index.set_reserved(reserved)
@@ -0,0 +1,273 @@
+"""
+Process-level snapshot of address_buckets for the address map.
+アドレスマップ用の address_buckets スナップショット（プロセス単位キャッシュ）
+
+The table changes rarely but is read on every map request, so the map
+endpoints read from this snapshot instead of PostgreSQL. Bucket writes call
+``notify_change(cur)`` inside their transaction and ``invalidate()`` after
+commit; a LISTEN thread invalidates the snapshot in every other worker when
+the NOTIFY is delivered.
+
+Window lookups use a nested containment list (each bucket lists the buckets
+it contains; siblings are sorted with increasing ends), so finding the
+buckets that intersect a window is O(log n + k) per nesting level.
+"""
+import logging
+import select
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+from app import db
+from app.config import env_flag
+from app.db import db_connection
+
+logger = logging.getLogger("mmam.bucket_cache")
+
+NOTIFY_CHANNEL = "mmam_address_buckets"
+
+
+BUCKET_CACHE_LISTEN = env_flag("BUCKET_CACHE_LISTEN", True)
+
+BUCKET_COLUMNS = (
+    "id", "kind", "privilege_id", "parent_id", "start_ip", "end_ip", "start_int", "end_int",
+    "size", "description", "memo", "color", "cidr", "is_reserved"
+)
+
+
+class _Level:
+    """Buckets not contained in one another: starts and ends both increase."""
+
+    __slots__ = ("ends", "nodes")
+
+    def __init__(self):
+        self.ends: List[int] = []
+        self.nodes: List[tuple] = []
+
+
+def _build_levels(blocks: List[Dict]) -> _Level:
+    root = _Level()
+    stack: List[tuple] = []
+    for block in sorted(blocks, key=lambda item: (item["start_int"], -item["end_int"], item["id"])):
+        node = (block, _Level())
+        while stack and stack[-1][0]["end_int"] < block["end_int"]:
+            stack.pop()
+        level = stack[-1][1] if stack else root
+        level.ends.append(block["end_int"])
+        level.nodes.append(node)
+        stack.append(node)
+    return root
+
+
+def _collect(level: _Level, start_int: int, end_int: int, out: List[Dict]):
+    position = bisect_left(level.ends, start_int)
+    while position < len(level.nodes):
+        block, children = level.nodes[position]
+        if block["start_int"] > end_int:
+            break
+        out.append(block)
+        if children.nodes:
+            _collect(children, start_int, end_int, out)
+        position += 1
+
+
+class BucketSnapshot:
+    def __init__(self, blocks: List[Dict]):
+        self.blocks = blocks
+        self.by_id = {block["id"]: block for block in blocks}
+        self._root = _build_levels(blocks)
+        self.loaded_at = time.time()
+
+    def intersecting(self, start_int: int, end_int: int) -> List[Dict]:
+        found: List[Dict] = []
+        _collect(self._root, start_int, end_int, found)
+        found.sort(key=lambda block: block["start_int"])
+        return found
+
+
+_snapshot: Optional[BucketSnapshot] = None
+_generation = 0
+# Serialises loads (held across the query)
+_lock = threading.Lock()
+# Short critical sections only: counters, generation and publishing a snapshot
+_state_lock = threading.Lock()
+_stats = {"loads": 0, "hits": 0, "invalidations": 0, "notifications": 0}
+
+
+def _count(key: str):
+    with _state_lock:
+        _stats[key] += 1
+
+
+def _load() -> List[Dict]:
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, start_int, end_int, size, description, memo, color, cidr, is_reserved
+            FROM address_buckets
+            ORDER BY start_int ASC;
+        """)
+        rows = cur.fetchall()
+    return [dict(zip(BUCKET_COLUMNS, row)) for row in rows]
+
+
+def snapshot() -> BucketSnapshot:
+    """
+    Current snapshot, loading it when missing or invalidated.
+    現在のスナップショットを返す（未読込・無効化後は再読込）。
+    """
+    global _snapshot
+    current = _snapshot
+    if current is not None:
+        _count("hits")
+        return current
+    with _lock:
+        with _state_lock:
+            generation = _generation
+        blocks = _load()
+        loaded = BucketSnapshot(blocks)
+        with _state_lock:
+            _stats["loads"] += 1
+            # An invalidation that raced with the load keeps the snapshot unset
+            if generation == _generation:
+                _snapshot = loaded
+    return loaded
+
+
+def blocks(window: Optional[Dict] = None) -> List[Dict]:
+    current = snapshot()
+    if window is None:
+        return list(current.blocks)
+    return current.intersecting(window["start_int"], window["end_int"])
+
+
+def invalidate():
+    global _snapshot, _generation
+    with _state_lock:
+        _generation += 1
+        _snapshot = None
+        _stats["invalidations"] += 1
+
+
+def notify_change(cur):
+    """
+    Queue a NOTIFY in the caller's transaction; it is delivered on commit.
+    呼び出し元トランザクション内で NOTIFY を発行する（コミット時に配信）。
+    """
+    cur.execute(f"NOTIFY {NOTIFY_CHANNEL};")
+
+
+def stats() -> dict:
+    current = _snapshot
+    with _state_lock:
+        counters = dict(_stats)
+    return {
+        **counters,
+        "cached": current is not None,
+        "buckets": len(current.blocks) if current else None,
+        "listening": _listener is not None and _listener.is_alive()
+    }
+
+
+# --------------------------------------------------------
+# Cross-worker invalidation (LISTEN/NOTIFY)
+# ワーカー間の無効化通知
+# --------------------------------------------------------
+_listener: Optional[threading.Thread] = None
+_stop = threading.Event()
+_callbacks: List = []
+_subscribers: Dict[str, List] = {}
+
+
+def on_change(callback):
+    """Register a callback run (in the listener thread) for every bucket change notification."""
+    _callbacks.append(callback)
+
+
+def subscribe(channel: str, callback):
+    """
+    Share the listener connection with another channel.
+    リスナー接続を他のチャンネルと共有する。
+
+    ``callback(payload)`` runs in the listener thread for each notification on
+    ``channel``, and with ``None`` whenever the listener (re)connects, since
+    notifications may have been missed while it was disconnected.
+    Register before start_listener().
+    """
+    _subscribers.setdefault(channel, []).append(callback)
+
+
+def _run_subscribers(channel: str, payload):
+    for callback in list(_subscribers.get(channel, ())):
+        try:
+            callback(payload)
+        except Exception:
+            logger.exception("Notification callback for %s failed", channel)
+
+
+def _listen_loop():
+    backoff = 1.0
+    while not _stop.is_set():
+        conn = None
+        try:
+            conn = db.connect_dedicated()
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                for channel in _subscribers:
+                    cur.execute(f"LISTEN {channel};")
+            # Anything may have changed while we were not listening
+            invalidate()
+            for channel in list(_subscribers):
+                _run_subscribers(channel, None)
+            backoff = 1.0
+            while not _stop.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                if not conn.notifies:
+                    continue
+                notifies = list(conn.notifies)
+                conn.notifies.clear()
+                if any(n.channel == NOTIFY_CHANNEL for n in notifies):
+                    _count("notifications")
+                    invalidate()
+                    for callback in list(_callbacks):
+                        try:
+                            callback()
+                        except Exception:
+                            logger.exception("Bucket change callback failed")
+                for n in notifies:
+                    if n.channel != NOTIFY_CHANNEL:
+                        _run_subscribers(n.channel, n.payload)
+        except psycopg2.Error as e:
+            logger.warning("Bucket cache listener disconnected: %s (retry in %.0fs)", e, backoff)
+            invalidate()
+            _stop.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def start_listener():
+    global _listener
+    if not BUCKET_CACHE_LISTEN or (_listener is not None and _listener.is_alive()):
+        return
+    _stop.clear()
+    _listener = threading.Thread(target=_listen_loop, name="bucket-cache-listener", daemon=True)
+    _listener.start()
+
+
+def stop_listener():
+    global _listener
+    _stop.set()
+    if _listener is not None:
+        _listener.join(timeout=5)
+    _listener = None
@@ -1,5 +1,13 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions, pool as pg_pool
+
+from app.config import env_float, env_int
 
 # --------------------------------------------------------
 # Database connection settings
@@ -11,13 +19,241 @@ DB_USER = os.getenv("POSTGRES_USER", "mmam")
 DB_PASS = os.getenv("POSTGRES_PASSWORD", "secret")
 DB_NAME = os.getenv("POSTGRES_DB", "mmam")
 
-def get_db_connection():
-    """
-    Create and return a new PostgreSQL connection.
-    新しいPostgreSQL接続を作成して返す。
-    """
+
+# --------------------------------------------------------
+# Connection pool settings
+# コネクションプール設定
+# --------------------------------------------------------
+DB_POOL_MIN = max(0, env_int("DB_POOL_MIN", 1))
+DB_POOL_MAX = max(1, env_int("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = env_float("DB_POOL_TIMEOUT", 30.0)
+DB_POOL_HEALTHCHECK_IDLE = env_float("DB_POOL_HEALTHCHECK_IDLE", 30.0)
+DB_CONNECT_TIMEOUT = env_int("DB_CONNECT_TIMEOUT", 10)
+
+
+class PoolTimeoutError(pg_pool.PoolError):
+    """Raised when no pooled connection becomes available within the timeout."""
+
+
+def _connect():
     return psycopg2.connect(
         host=DB_HOST, port=DB_PORT,
         user=DB_USER, password=DB_PASS,
-        dbname=DB_NAME
+        dbname=DB_NAME,
+        connect_timeout=DB_CONNECT_TIMEOUT
     )
+
+
+def connect_dedicated():
+    """
+    Open a connection outside the pool for long-lived use (e.g. LISTEN); the caller closes it.
+    プール外の専用接続を開く（LISTEN など長時間用途、呼び出し側で close する）。
+    """
+    return _connect()
+
+
+class ConnectionPool:
+    """
+    Thread-safe, blocking PostgreSQL connection pool.
+    スレッドセーフなPostgreSQLコネクションプール（空きが出るまで待機）。
+
+    Connections idle for longer than ``healthcheck_idle`` seconds are probed
+    with ``SELECT 1`` on checkout and transparently replaced when broken.
+    Returned connections are rolled back so no transaction leaks between users.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, healthcheck_idle: float, connect=_connect):
+        self.minconn = min(minconn, maxconn)
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle: deque = deque()
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._healthcheck_failures = 0
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise pg_pool.PoolError("connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"no database connection available within {self.timeout:.1f}s (max={self.maxconn})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            wait = time.monotonic() - started
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+        try:
+            if conn is None:
+                return self._connect()
+            if self._is_healthy(conn, last_used):
+                return conn
+            with self._cond:
+                self._healthcheck_failures += 1
+            self._close_quietly(conn)
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard:
+            discard = not self._reset(conn)
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard or self._closed:
+            self._close_quietly(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+                "healthcheck_failures": self._healthcheck_failures
+            }
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _reset(conn) -> bool:
+        if conn.closed:
+            return False
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def init_pool() -> ConnectionPool:
+    """
+    Create the process-wide connection pool (idempotent).
+    プロセス共通のコネクションプールを作成する（冪等）。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+
+
+def pool_stats() -> dict:
+    current = _pool
+    if current is None:
+        return {"initialized": False}
+    return {"initialized": True, **current.stats()}
+
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a pooled PostgreSQL connection.
+    プールからPostgreSQL接続を借りる。
+
+    Commit explicitly; anything left uncommitted is rolled back when the
+    connection goes back to the pool, and an exception discards the
+    transaction before re-raising.
+    """
+    current = _pool or init_pool()
+    conn = current.getconn()
+    discard = False
+    try:
+        yield conn
+    except BaseException:
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            discard = True
+        raise
+    finally:
+        current.putconn(conn, discard=discard)
@@ -0,0 +1,293 @@
+"""
+Type-aware WHERE-clause compiler for GET /api/flows.
+GET /api/flows 用の型認識フィルタコンパイラ
+
+Filter values are parsed into native types first (UUID, IPv4 address/CIDR,
+integer ranges) and each one is compiled into a predicate that PostgreSQL can
+answer from an index. The SQL text depends only on the *shape* of a request
+(which fields, which predicate kinds), never on the values, so shapes are
+cached and repeated dashboard queries skip string building entirely.
+
+Address filters are matched through the generated BIGINT shadow columns. A
+full address (``multicast_addr_a=239.1.1.1``) is an exact match and a CIDR
+(``239.1.1.0/24``) is a range match; before, both were substring matches, so
+``239.1.1.1`` also returned ``239.1.1.10``. Values that do not parse as an
+address or CIDR (``239.1.1``) keep the substring match.
+"""
+import re
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from ipaddress import IPv4Address, ip_address, ip_network
+from typing import Iterable
+
+from fastapi import HTTPException
+
+from app.flow_search import (
+    TEXT_FILTER_FIELDS,
+    KEYWORD_SEARCH_EXPR,
+    UUID_LIKE_FIELDS,
+    ADDRESS_INT_COLUMNS,
+    search_expression_for,
+    sanitize_pattern
+)
+
+INT_FILTER_FIELDS = {
+    "source_port_a", "group_port_a",
+    "source_port_b", "group_port_b",
+    "nmos_is04_port", "nmos_is05_port"
+}
+
+ADDRESS_FILTER_FIELDS = set(ADDRESS_INT_COLUMNS)
+
+# ?multicast_cidr= / ?source_range= etc. match either leg (A or B) of the pair.
+ADDRESS_GROUPS = {
+    "multicast": ("multicast_addr_a", "multicast_addr_b"),
+    "source": ("source_addr_a", "source_addr_b"),
+}
+ADDRESS_GROUP_PARAMS = {
+    f"{group}_{suffix}": group
+    for group in ADDRESS_GROUPS
+    for suffix in ("cidr", "range")
+}
+
+FILTER_FIELDS = TEXT_FILTER_FIELDS | INT_FILTER_FIELDS
+
+# Predicate kinds
+P_FALSE = "false"
+P_UUID_EQ = "uuid_eq"
+P_UUID_PREFIX = "uuid_prefix"
+P_INET_EQ = "inet_eq"
+P_INET_CIDR = "inet_cidr"
+P_INET_GROUP = "inet_group"
+P_TEXT_LIKE = "text_like"
+P_INT_EQ = "int_eq"
+P_INT_RANGE = "int_range"
+P_INT_MIN = "int_min"
+P_INT_MAX = "int_max"
+P_TS_MIN = "ts_min"
+P_TS_MAX = "ts_max"
+
+TIMESTAMP_FIELDS = {"updated_at", "created_at"}
+
+_HEX_RE = re.compile(r"^[0-9a-f]+$")
+_INT_RANGE_RE = re.compile(r"^\s*(-?\d+)\s*(?:-|\.\.)\s*(-?\d+)\s*$")
+
+
+def _parse_uuid_value(value: str):
+    raw = value.strip().lower()
+    try:
+        return P_UUID_EQ, [str(uuid.UUID(raw))]
+    except ValueError:
+        pass
+    hex_digits = raw.replace("-", "")
+    if not hex_digits or len(hex_digits) >= 32 or not _HEX_RE.match(hex_digits):
+        return P_FALSE, []
+    low = hex_digits.ljust(32, "0")
+    high = hex_digits.ljust(32, "f")
+    return P_UUID_PREFIX, [str(uuid.UUID(low)), str(uuid.UUID(high))]
+
+
+def _parse_address_value(value: str):
+    raw = value.strip()
+    if "/" in raw:
+        try:
+            network = ip_network(raw, strict=False)
+        except ValueError:
+            network = None
+        if network is not None and network.version == 4:
+            return P_INET_CIDR, [int(network.network_address), int(network.broadcast_address)]
+    else:
+        try:
+            addr = ip_address(raw)
+        except ValueError:
+            addr = None
+        if addr is not None and addr.version == 4:
+            return P_INET_EQ, [int(addr)]
+    return _text_like(raw)
+
+
+def _parse_address_bounds(key: str, value: str) -> tuple[int, int]:
+    """
+    Parse a CIDR (``239.1.0.0/16``) or range (``239.1.0.1-239.1.0.99``) into integer bounds.
+    CIDR または範囲指定を整数の上下限に変換する。
+    """
+    raw = value.strip()
+    try:
+        if "/" in raw:
+            network = ip_network(raw, strict=False)
+            if network.version == 4:
+                return int(network.network_address), int(network.broadcast_address)
+        else:
+            low_text, sep, high_text = raw.partition("-")
+            low = IPv4Address(low_text.strip())
+            high = IPv4Address(high_text.strip()) if sep else low
+            return min(int(low), int(high)), max(int(low), int(high))
+    except ValueError:
+        pass
+    raise HTTPException(status_code=400, detail=f"Invalid IPv4 CIDR or range for {key}")
+
+
+def _text_like(value: str):
+    pattern = f"%{sanitize_pattern(value)}%"
+    return P_TEXT_LIKE, [pattern, pattern]
+
+
+def _parse_int_value(key: str, value: str):
+    match = _INT_RANGE_RE.match(value)
+    if match:
+        low, high = int(match.group(1)), int(match.group(2))
+        if low > high:
+            low, high = high, low
+        return P_INT_RANGE, [low, high]
+    try:
+        return P_INT_EQ, [int(value)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid integer for {key}")
+
+
+def parse_filter_value(key: str, value: str):
+    """
+    Parse one ?field=value pair into (predicate kind, params).
+    1つのフィルタ値を（述語種別, パラメータ）に変換する。
+    """
+    if key in INT_FILTER_FIELDS:
+        return _parse_int_value(key, value)
+    if key in UUID_LIKE_FIELDS:
+        return _parse_uuid_value(value)
+    if key in ADDRESS_FILTER_FIELDS:
+        return _parse_address_value(value)
+    return _text_like(value)
+
+
+@lru_cache(maxsize=256)
+def _predicate_sql(field: str, kind: str) -> str:
+    if kind == P_FALSE:
+        return "FALSE"
+    if kind == P_UUID_EQ:
+        return f"{field} = %s::uuid"
+    if kind == P_UUID_PREFIX:
+        return f"{field} BETWEEN %s::uuid AND %s::uuid"
+    if kind == P_INET_EQ:
+        return f"{ADDRESS_INT_COLUMNS[field]} = %s"
+    if kind == P_INET_CIDR:
+        return f"{ADDRESS_INT_COLUMNS[field]} BETWEEN %s AND %s"
+    if kind == P_INET_GROUP:
+        # One btree range scan per leg; the planner combines them with a BitmapOr
+        legs = [f"{ADDRESS_INT_COLUMNS[column]} BETWEEN %s AND %s" for column in ADDRESS_GROUPS[field]]
+        return "(" + " OR ".join(legs) + ")"
+    if kind == P_TEXT_LIKE:
+        # Trigram-indexed concatenation narrows rows, the column ILIKE keeps it exact
+        return f"({search_expression_for(field)} ILIKE %s AND {field} ILIKE %s)"
+    if kind == P_INT_EQ:
+        return f"{field} = %s"
+    if kind == P_INT_RANGE:
+        return f"{field} BETWEEN %s AND %s"
+    if kind in (P_INT_MIN, P_TS_MIN):
+        return f"{field} >= %s"
+    if kind in (P_INT_MAX, P_TS_MAX):
+        return f"{field} <= %s"
+    raise ValueError(f"Unknown predicate kind: {kind}")
+
+
+@lru_cache(maxsize=512)
+def compile_shape(shape: tuple) -> tuple:
+    """
+    Compile a request shape into its tuple of SQL conditions.
+    リクエストの形状をSQL条件のタプルにコンパイルする（キャッシュ付き）。
+
+    ``shape`` entries are ``("active",)``, ``("keyword",)`` or
+    ``(field, (kind, ...))``; several kinds on one field are OR'ed.
+    """
+    conditions = []
+    for entry in shape:
+        if entry[0] == "active":
+            conditions.append("flow_status = 'active'")
+        elif entry[0] == "keyword":
+            # One trigram-indexed expression instead of OR-ing ILIKE over every field
+            conditions.append(f"{KEYWORD_SEARCH_EXPR} ILIKE %s")
+        else:
+            field, kinds = entry
+            clauses = [_predicate_sql(field, kind) for kind in kinds]
+            if len(clauses) == 1:
+                conditions.append(clauses[0])
+            else:
+                conditions.append("(" + " OR ".join(clauses) + ")")
+    return tuple(conditions)
+
+
+def compile_flow_filters(
+    params: Iterable[tuple[str, str]],
+    *,
+    include_unused: bool = False,
+    q: str | None = None,
+    timestamp_ranges: dict[str, tuple[datetime | None, datetime | None]] | None = None
+):
+    """
+    Build (conditions, values) for list_flows from raw query parameters.
+    クエリパラメータから list_flows 用の (条件, 値) を組み立てる。
+
+    Recognises ?<field>=value (repeatable, OR'ed) for FILTER_FIELDS,
+    ?<int field>_min / _max bounds and ?multicast_cidr / ?multicast_range /
+    ?source_cidr / ?source_range (repeatable, OR'ed, either leg matches);
+    other keys are ignored.
+    """
+    shape = []
+    values = []
+    if not include_unused:
+        shape.append(("active",))
+
+    grouped: dict[str, list[str]] = {}
+    bounds: dict[str, str] = {}
+    address_ranges: dict[str, list[tuple[int, int]]] = {}
+    for key, value in params:
+        if value == "":
+            continue
+        if key in FILTER_FIELDS:
+            grouped.setdefault(key, []).append(value)
+        elif key in ADDRESS_GROUP_PARAMS:
+            address_ranges.setdefault(ADDRESS_GROUP_PARAMS[key], []).append(_parse_address_bounds(key, value))
+        elif key.endswith(("_min", "_max")) and key[:-4] in INT_FILTER_FIELDS:
+            bounds.setdefault(key, value)
+
+    for key in sorted(grouped):
+        kinds = []
+        for value in grouped[key]:
+            kind, kind_values = parse_filter_value(key, value)
+            kinds.append(kind)
+            values.extend(kind_values)
+        shape.append((key, tuple(kinds)))
+
+    for group in sorted(address_ranges):
+        legs = len(ADDRESS_GROUPS[group])
+        for low, high in address_ranges[group]:
+            values.extend([low, high] * legs)
+        shape.append((group, (P_INET_GROUP,) * len(address_ranges[group])))
+
+    for field, (low, high) in sorted((timestamp_ranges or {}).items()):
+        if field not in TIMESTAMP_FIELDS:
+            continue
+        if low is not None:
+            shape.append((field, (P_TS_MIN,)))
+            values.append(low)
+        if high is not None:
+            shape.append((field, (P_TS_MAX,)))
+            values.append(high)
+
+    for key in sorted(bounds):
+        try:
+            values.append(int(bounds[key]))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid integer for {key}")
+        shape.append((key[:-4], (P_INT_MIN if key.endswith("_min") else P_INT_MAX,)))
+
+    if q:
+        shape.append(("keyword",))
+        values.append(f"%{sanitize_pattern(q)}%")
+
+    return list(compile_shape(tuple(shape))), values
+
+
+def cache_info() -> dict:
+    shapes = compile_shape.cache_info()
+    return {"hits": shapes.hits, "misses": shapes.misses, "size": shapes.currsize, "max_size": shapes.maxsize}
@@ -0,0 +1,124 @@
+"""
+Searchable flow columns and the SQL expressions backing their indexes.
+フロー検索対象カラムと、インデックスに対応するSQL式の定義
+
+db_init builds the trigram indexes from these expressions and list_flows
+emits predicates over the very same text, so PostgreSQL can match the
+expression indexes. Change both sides here, never separately.
+"""
+
+TEXT_FILTER_FIELDS = {
+    "flow_id", "display_name",
+    "source_addr_a", "multicast_addr_a",
+    "source_addr_b", "multicast_addr_b",
+    "transport_protocol",
+    "nmos_node_id",
+    "nmos_flow_id", "nmos_sender_id", "nmos_device_id",
+    "nmos_is04_host", "nmos_is05_host",
+    "sdp_url", "sdp_cache",
+    "nmos_label", "nmos_description", "management_url",
+    "media_type", "st2110_format", "redundancy_group",
+    "alias1", "alias2", "alias3", "alias4",
+    "alias5", "alias6", "alias7", "alias8",
+    "flow_status", "availability", "data_source",
+    "rds_address", "rds_api_url",
+    "user_field1", "user_field2", "user_field3", "user_field4",
+    "user_field5", "user_field6", "user_field7", "user_field8",
+    "note",
+    "nmos_is04_version", "nmos_is05_version",
+    "nmos_is04_base_url", "nmos_is05_base_url"
+}
+
+KEYWORD_SEARCH_FIELDS = [
+    "flow_id", "nmos_node_id", "nmos_flow_id", "nmos_sender_id", "nmos_device_id",
+    "display_name",
+    "source_addr_a", "source_addr_b",
+    "multicast_addr_a", "multicast_addr_b",
+    "transport_protocol",
+    "nmos_label", "nmos_description",
+    "alias1", "alias2", "alias3", "alias4",
+    "alias5", "alias6", "alias7", "alias8",
+    "management_url", "note",
+    "media_type", "redundancy_group"
+]
+
+UUID_LIKE_FIELDS = {"flow_id", "nmos_node_id", "nmos_flow_id", "nmos_sender_id", "nmos_device_id"}
+
+# Text filter columns outside the keyword set, covered by a second expression.
+EXTRA_FILTER_FIELDS = sorted(TEXT_FILTER_FIELDS - set(KEYWORD_SEARCH_FIELDS) - UUID_LIKE_FIELDS)
+
+# Newline separator: ILIKE patterns cannot match across two columns unless
+# the search text itself contains a newline (stripped by the caller).
+SEARCH_SEPARATOR = "E'\\n'"
+
+
+def _concat_expression(fields) -> str:
+    parts = [f"coalesce({field}::text, '')" for field in fields]
+    return "(" + f" || {SEARCH_SEPARATOR} || ".join(parts) + ")"
+
+
+KEYWORD_SEARCH_EXPR = _concat_expression(KEYWORD_SEARCH_FIELDS)
+EXTRA_FILTER_EXPR = _concat_expression(EXTRA_FILTER_FIELDS)
+
+TRIGRAM_INDEXES = {
+    "flows_keyword_trgm_idx": KEYWORD_SEARCH_EXPR,
+    "flows_extra_filter_trgm_idx": EXTRA_FILTER_EXPR,
+}
+
+
+def search_expression_for(field: str) -> str:
+    """
+    Return the indexed concatenation that contains ``field``.
+    指定カラムを含む連結検索式を返す。
+    """
+    if field in KEYWORD_SEARCH_FIELDS:
+        return KEYWORD_SEARCH_EXPR
+    return EXTRA_FILTER_EXPR
+
+
+def sanitize_pattern(value: str) -> str:
+    return value.replace("\n", " ").replace("\r", " ")
+
+
+# --------------------------------------------------------
+# Full-text search (stored generated tsvector column)
+# 全文検索（生成列 tsvector）
+# --------------------------------------------------------
+FTS_CONFIG = "simple"
+SEARCH_VECTOR_COLUMN = "search_vector"
+
+# Weight A ranks highest; ts_rank's default weights are {D, C, B, A} = {0.1, 0.2, 0.4, 1.0}.
+FTS_WEIGHTED_FIELDS = [
+    ("A", ["display_name", "nmos_label"]),
+    ("B", ["alias1", "alias2", "alias3", "alias4", "alias5", "alias6", "alias7", "alias8"]),
+    ("C", ["nmos_node_label", "nmos_node_description"]),
+    ("D", ["note"]),
+]
+
+FTS_SNIPPET_FIELDS = [field for _, fields in FTS_WEIGHTED_FIELDS for field in fields]
+
+
+def _weighted_vector(weight: str, fields) -> str:
+    text = " || ' ' || ".join(f"coalesce({field}, '')" for field in fields)
+    return f"setweight(to_tsvector('{FTS_CONFIG}'::regconfig, {text}), '{weight}')"
+
+
+SEARCH_VECTOR_EXPR = " || ".join(_weighted_vector(weight, fields) for weight, fields in FTS_WEIGHTED_FIELDS)
+SEARCH_SNIPPET_DOCUMENT = "concat_ws(' | ', " + ", ".join(FTS_SNIPPET_FIELDS) + ")"
+
+
+# --------------------------------------------------------
+# IPv4 shadow columns (generated BIGINT per address column)
+# IPv4 シャドウ列（アドレス列ごとの生成 BIGINT 列）
+# --------------------------------------------------------
+IPV4_INT_FUNCTION = "mmam_ipv4_int"
+
+ADDRESS_INT_COLUMNS = {
+    "multicast_addr_a": "multicast_addr_a_int",
+    "multicast_addr_b": "multicast_addr_b_int",
+    "source_addr_a": "source_addr_a_int",
+    "source_addr_b": "source_addr_b_int",
+}
+
+# Internal columns that never leave the API (SELECT * results are filtered).
+HIDDEN_FLOW_COLUMNS = {SEARCH_VECTOR_COLUMN, *ADDRESS_INT_COLUMNS.values()}
@@ -1,5 +1,5 @@
 import logging
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.logging_config import setup_logging
 
@@ -13,6 +13,11 @@ from app.routers import logs as logs_router  # noqa: E402
 from app.routers import automation as automation_router  # noqa: E402
 from app import mqtt_client  # noqa: E402
 from app import scheduler  # noqa: E402
+from app import db  # noqa: E402
+from app import address_occupancy  # noqa: E402
+from app import bucket_cache  # noqa: E402
+from app import nmos_client  # noqa: E402
+from app.auth import require_roles  # noqa: E402
 from db_init import init_db  # noqa: E402
 
 logger = logging.getLogger("mmam.app")
@@ -39,6 +44,16 @@ def startup_event():
     except Exception as e:
         logger.exception("Startup failed during database initialization: %s", e)
         raise
+    db.init_pool()
+    logger.info("Database connection pool ready (min=%s, max=%s)", db.DB_POOL_MIN, db.DB_POOL_MAX)
+    try:
+        address_occupancy.rebuild()
+    except Exception as e:
+        # The address map rebuilds the index lazily on first use
+        logger.exception("Address occupancy index build failed: %s", e)
+    bucket_cache.on_change(address_occupancy.refresh_reserved)
+    bucket_cache.subscribe(address_occupancy.NOTIFY_CHANNEL, address_occupancy.on_notify)
+    bucket_cache.start_listener()
     mqtt_client.ensure_client()
     logger.info("MQTT client ready")
 
@@ -52,6 +67,12 @@ def startup_event():
         # Continue even if scheduler fails (fallback)
 
 
+@app.on_event("shutdown")
+async def close_nmos_clients():
+    # The async NMOS client must be closed on the event loop that owns it
+    await nmos_client.shutdown()
+
+
 @app.on_event("shutdown")
 def shutdown_event():
     # Stop scheduler
@@ -62,6 +83,8 @@ def shutdown_event():
         logger.exception("Scheduler shutdown failed: %s", e)
 
     mqtt_client.shutdown()
+    bucket_cache.stop_listener()
+    db.close_pool()
     logger.info("Shutdown complete")
 
 # --------------------------------------------------------
@@ -83,3 +106,14 @@ app.include_router(automation_router.router, prefix="/api")
 @app.get("/api/health")
 def health():
     return {"status": "ok", "service": "MMAM"}
+
+
+@app.get("/api/health/db")
+def health_db(user=Depends(require_roles("admin"))):
+    """Pool, address index and bucket cache internals (admin only; /api/health is the public probe)."""
+    return {
+        "status": "ok",
+        "pool": db.pool_stats(),
+        "address_index": address_occupancy.index_stats(),
+        "bucket_cache": bucket_cache.stats()
+    }
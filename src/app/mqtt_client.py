@@ -3,36 +3,21 @@ import os
 import threading
 from typing import Any, Dict, Optional
 
+from app.config import env_flag, env_int
+
 try:
     from paho.mqtt import client as mqtt  # type: ignore
 except ImportError:  # pragma: no cover
     mqtt = None
 
 
-def _env_flag(name: str, default: bool = False) -> bool:
-    raw = os.getenv(name)
-    if raw is None:
-        return default
-    return raw.lower() in {"1", "true", "yes", "on"}
-
-
-def _env_int(name: str, default: int) -> int:
-    raw = os.getenv(name)
-    if raw is None:
-        return default
-    try:
-        return int(raw)
-    except ValueError:
-        return default
-
-
-MQTT_ENABLED = _env_flag("MQTT_ENABLED", False)
+MQTT_ENABLED = env_flag("MQTT_ENABLED", False)
 MQTT_HOST = os.getenv("MQTT_HOST", "mqtt")
-MQTT_PORT = _env_int("MQTT_PORT", 1883)
+MQTT_PORT = env_int("MQTT_PORT", 1883)
 MQTT_USERNAME = os.getenv("MQTT_USERNAME") or None
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD") or None
 MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "mmam-api")
-MQTT_KEEPALIVE = _env_int("MQTT_KEEPALIVE", 60)
+MQTT_KEEPALIVE = env_int("MQTT_KEEPALIVE", 60)
 MQTT_TOPIC_FLOW_UPDATES = os.getenv("MQTT_TOPIC_FLOW_UPDATES", "mmam/flows/events")
 
 MQTT_WS_URL = os.getenv("MQTT_WS_URL", "")
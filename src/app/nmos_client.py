@@ -1,11 +1,75 @@
+import asyncio
+import threading
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urljoin, urlparse
 from fastapi import HTTPException
 
+from app.config import env_float, env_int
+
 DEFAULT_IS04_VERSION = "v1.3"
 DEFAULT_IS05_VERSION = "v1.1"
 
 
+# --------------------------------------------------------
+# Shared HTTP session (keep-alive, per-host pools, retries)
+# 共有HTTPセッション（キープアライブ・ホスト単位プール・リトライ）
+# --------------------------------------------------------
+NMOS_HTTP_POOL_HOSTS = max(1, env_int("NMOS_HTTP_POOL_HOSTS", 64))
+NMOS_HTTP_POOL_SIZE = max(1, env_int("NMOS_HTTP_POOL_SIZE", 8))
+NMOS_HTTP_RETRIES = max(0, env_int("NMOS_HTTP_RETRIES", 1))
+NMOS_HTTP_BACKOFF = max(0.0, env_float("NMOS_HTTP_BACKOFF", 0.2))
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=NMOS_HTTP_RETRIES,
+        connect=NMOS_HTTP_RETRIES,
+        # A read timeout already cost the full timeout; do not repeat it
+        read=0,
+        status=NMOS_HTTP_RETRIES,
+        backoff_factor=NMOS_HTTP_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False
+    )
+    # urllib3 keeps one pool per host; pool_maxsize bounds idle keep-alive connections per host
+    adapter = HTTPAdapter(pool_connections=NMOS_HTTP_POOL_HOSTS, pool_maxsize=NMOS_HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide session shared by every NMOS call (connection pools are thread-safe).
+    全NMOS呼び出しで共有するセッションを返す。
+    """
+    global _session
+    session = _session
+    if session is not None:
+        return session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
 def normalize_base_url(url: str) -> str:
     url = url.strip()
     if not url.endswith("/"):
@@ -15,7 +79,7 @@ def normalize_base_url(url: str) -> str:
 
 def fetch_json(url: str, timeout: int):
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = get_session().get(url, timeout=timeout)
         resp.raise_for_status()
         return resp.json()
     except requests.exceptions.RequestException as exc:
@@ -26,7 +90,7 @@ def fetch_text(url: str | None, timeout: int) -> str | None:
     if not url:
         return None
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = get_session().get(url, timeout=timeout)
         resp.raise_for_status()
         return resp.text
     except requests.exceptions.RequestException:
@@ -104,6 +168,10 @@ def fetch_connection_params(base: str, version: str, sender_id: str, timeout: in
             break
         except HTTPException:
             continue
+    return _transport_params(data, version, sender_id)
+
+
+def _transport_params(data, version: str, sender_id: str) -> list:
     if data is None:
         raise HTTPException(
             status_code=400,
@@ -182,6 +250,66 @@ def _compose_flow_entry(flow: dict, node_info: dict, sender: dict | None, parsed
     }
 
 
+def fetch_node_documents(is04_base_url: str, timeout: int, is04_version: str = DEFAULT_IS04_VERSION) -> dict:
+    """
+    Fetch a node's self, flows and senders once, indexed by id.
+    ノードの self / flows / senders を1回ずつ取得し、ID で索引化する。
+
+    Pass the result as ``node`` to fetch_flow_snapshot for every flow of the
+    node, so per-flow work is only the SDP and IS-05 lookups.
+
+    Only ``self`` is required (its HTTPException propagates). A flows or
+    senders list the node does not serve is stored as None, and snapshots
+    then use the per-flow requests for it.
+    """
+    base04 = normalize_base_url(is04_base_url)
+    node_prefix = f"node/{is04_version}/"
+    node_info = fetch_json(urljoin(base04, node_prefix + "self"), timeout)
+    flows = _fetch_optional_json(urljoin(base04, node_prefix + "flows"), timeout)
+    senders = _fetch_optional_json(urljoin(base04, node_prefix + "senders"), timeout)
+    return _index_node_documents(base04, is04_version, node_info, flows, senders)
+
+
+def _fetch_optional_json(url: str, timeout: int):
+    try:
+        return fetch_json(url, timeout)
+    except HTTPException:
+        return None
+
+
+def _index_node_documents(base04: str, is04_version: str, node_info, flows, senders) -> dict:
+    senders_by_id = None
+    senders_by_flow = None
+    if isinstance(senders, list):
+        senders_by_id = {}
+        senders_by_flow = {}
+        for entry in senders:
+            if not isinstance(entry, dict):
+                continue
+            if entry.get("id"):
+                senders_by_id[entry["id"]] = entry
+            if entry.get("flow_id"):
+                senders_by_flow.setdefault(entry["flow_id"], entry)
+    return {
+        "base": base04,
+        "version": is04_version,
+        "self": node_info,
+        "flows": {
+            entry["id"]: entry
+            for entry in flows
+            if isinstance(entry, dict) and entry.get("id")
+        } if isinstance(flows, list) else None,
+        "senders_by_id": senders_by_id,
+        "senders_by_flow": senders_by_flow
+    }
+
+
+def _cached_sender(node: dict, flow_id: str, sender_id: str | None) -> dict | None:
+    if node["senders_by_id"] is None:
+        return None
+    return (node["senders_by_id"].get(sender_id) if sender_id else None) or node["senders_by_flow"].get(flow_id)
+
+
 def fetch_flow_snapshot(
     *,
     flow_id: str,
@@ -190,39 +318,60 @@ def fetch_flow_snapshot(
     sender_id: str | None = None,
     timeout: int = 5,
     is04_version: str = DEFAULT_IS04_VERSION,
-    is05_version: str = DEFAULT_IS05_VERSION
+    is05_version: str = DEFAULT_IS05_VERSION,
+    node: dict | None = None
 ) -> dict:
     base04 = normalize_base_url(is04_base_url)
-    base05 = normalize_base_url(is05_base_url)
     node_prefix = f"node/{is04_version}/"
     flow_endpoint = urljoin(base04, node_prefix + f"flows/{flow_id}")
-    node_endpoint = urljoin(base04, node_prefix + "self")
 
-    flow_data = fetch_json(flow_endpoint, timeout)
-    node_info = fetch_json(node_endpoint, timeout)
+    if node is not None:
+        # Node documents fetched once by fetch_node_documents; a list it could
+        # not get (None) or that lacks this flow falls back to per-flow requests
+        flow_data = (node["flows"] or {}).get(flow_id) or fetch_json(flow_endpoint, timeout)
+        node_info = node["self"]
+        sender = _cached_sender(node, flow_id, sender_id)
+        senders_listed = node["senders_by_flow"] is not None
+    else:
+        flow_data = fetch_json(flow_endpoint, timeout)
+        node_info = fetch_json(urljoin(base04, node_prefix + "self"), timeout)
+        sender = None
+        senders_listed = False
 
-    sender = None
-    if sender_id:
+    if not sender and sender_id:
         sender_endpoint = urljoin(base04, node_prefix + f"senders/{sender_id}")
         try:
             sender = fetch_json(sender_endpoint, timeout)
         except HTTPException:
             sender = None
-    if not sender:
+    if not sender and not senders_listed:
         senders_endpoint = urljoin(base04, node_prefix + "senders")
         senders = fetch_json(senders_endpoint, timeout)
         for entry in senders or []:
             if entry.get("flow_id") == flow_id:
                 sender = entry
                 break
+            senders_endpoint = urljoin(base04, node_prefix + "senders")
+            senders = fetch_json(senders_endpoint, timeout)
+            for entry in senders or []:
+                if entry.get("flow_id") == flow_id:
+                    sender = entry
+                    break
 
     manifest_href = sender.get("manifest_href") if sender else None
     sdp_cache = fetch_text(manifest_href, timeout) if manifest_href else None
-    parsed = parse_sdp_details(sdp_cache) if sdp_cache else {}
     connection_params = []
     if sender and sender.get("id"):
         connection_params = fetch_connection_params(is05_base_url, is05_version, sender["id"], timeout)
+    return _snapshot_entry(
+        flow_data, node_info, sender, sdp_cache, connection_params,
+        is04_base_url, is05_base_url, is04_version, is05_version
+    )
+
 
+def _snapshot_entry(flow_data, node_info, sender: dict | None, sdp_cache: str | None, connection_params: list,
+                    is04_base_url: str, is05_base_url: str, is04_version: str, is05_version: str) -> dict:
+    parsed = parse_sdp_details(sdp_cache) if sdp_cache else {}
     is04_host, is04_port = parse_host_port(is04_base_url)
     is05_host, is05_port = parse_host_port(is05_base_url)
     entry = _compose_flow_entry(
@@ -239,9 +388,211 @@ def fetch_flow_snapshot(
     )
     entry["nmos_is04_version"] = is04_version
     entry["nmos_is05_version"] = is05_version
-    entry["nmos_is04_base_url"] = base04
-    entry["nmos_is05_base_url"] = base05
+    entry["nmos_is04_base_url"] = normalize_base_url(is04_base_url)
+    entry["nmos_is05_base_url"] = normalize_base_url(is05_base_url)
     entry["raw_flow"] = flow_data
     entry["raw_sender"] = sender
     entry["node"] = node_info
     return entry
+
+
+# --------------------------------------------------------
+# Async API (httpx)
+# 非同期API（httpx）
+# --------------------------------------------------------
+# Async endpoints await NMOS requests on the event loop itself; in-flight
+# requests are bounded by the client's connection limit, and a request that
+# finds every connection busy waits for one instead of timing out.
+NMOS_HTTP_MAX_CONNECTIONS = max(1, env_int("NMOS_HTTP_MAX_CONNECTIONS", 64))
+
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+# httpx clients are bound to the event loop that created them
+_async_client: httpx.AsyncClient | None = None
+_async_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _build_async_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=NMOS_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=NMOS_HTTP_MAX_CONNECTIONS
+    )
+    # Transport retries cover connection failures; status retries are in _get_async
+    transport = httpx.AsyncHTTPTransport(limits=limits, retries=NMOS_HTTP_RETRIES)
+    return httpx.AsyncClient(transport=transport, follow_redirects=True)
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Process-wide async client for the running event loop.
+    実行中のイベントループ用の共有非同期クライアントを返す。
+    """
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop or _async_client.is_closed:
+        _async_client = _build_async_client()
+        _async_client_loop = loop
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client, _async_client_loop
+    client = _async_client
+    _async_client = None
+    _async_client_loop = None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+async def _get_async(url: str, timeout: int) -> httpx.Response:
+    client = get_async_client()
+    # Waiting for a free pooled connection does not count against the timeout
+    request_timeout = httpx.Timeout(timeout, pool=None)
+    for attempt in range(NMOS_HTTP_RETRIES + 1):
+        resp = await client.get(url, timeout=request_timeout)
+        if resp.status_code not in _RETRY_STATUSES or attempt == NMOS_HTTP_RETRIES:
+            break
+        await resp.aclose()
+        await asyncio.sleep(NMOS_HTTP_BACKOFF * (2 ** attempt))
+    resp.raise_for_status()
+    return resp
+
+
+async def fetch_json_async(url: str, timeout: int):
+    try:
+        resp = await _get_async(url, timeout)
+        return resp.json()
+    except (httpx.HTTPError, ValueError) as exc:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch {url}: {exc}") from exc
+
+
+async def fetch_text_async(url: str | None, timeout: int) -> str | None:
+    if not url:
+        return None
+    try:
+        resp = await _get_async(url, timeout)
+        return resp.text
+    except httpx.HTTPError:
+        return None
+
+
+# IS-05 APIs (base, version) whose senders have answered on /active
+_is05_active_ok: set[tuple[str, str]] = set()
+
+
+async def fetch_connection_params_async(base: str, version: str, sender_id: str, timeout: int):
+    """
+    Async fetch_connection_params with the same result (active wins over staged).
+    fetch_connection_params の非同期版（active を優先する点は同じ）。
+
+    Until an API is known to serve /active, active and staged are requested
+    together so a missing /active costs no extra round trip; afterwards only
+    active is requested, with staged as the fallback.
+    """
+    base = normalize_base_url(base)
+    prefix = f"connection/{version}/single/senders/{sender_id}/"
+    active_url = urljoin(base, prefix + "active/")
+    staged_url = urljoin(base, prefix + "staged/")
+
+    async def attempt(url: str):
+        try:
+            return await fetch_json_async(url, timeout)
+        except HTTPException:
+            return None
+
+    key = (base, version)
+    if key in _is05_active_ok:
+        data = await attempt(active_url)
+        if data is None:
+            data = await attempt(staged_url)
+        return _transport_params(data, version, sender_id)
+
+    staged_task = asyncio.ensure_future(attempt(staged_url))
+    data = await attempt(active_url)
+    if data is not None:
+        _is05_active_ok.add(key)
+        staged_task.cancel()
+    else:
+        data = await staged_task
+    return _transport_params(data, version, sender_id)
+
+
+async def _fetch_optional_json_async(url: str, timeout: int):
+    try:
+        return await fetch_json_async(url, timeout)
+    except HTTPException:
+        return None
+
+
+async def fetch_node_documents_async(is04_base_url: str, timeout: int, is04_version: str = DEFAULT_IS04_VERSION) -> dict:
+    base04 = normalize_base_url(is04_base_url)
+    node_prefix = f"node/{is04_version}/"
+    node_info, flows, senders = await asyncio.gather(
+        fetch_json_async(urljoin(base04, node_prefix + "self"), timeout),
+        _fetch_optional_json_async(urljoin(base04, node_prefix + "flows"), timeout),
+        _fetch_optional_json_async(urljoin(base04, node_prefix + "senders"), timeout)
+    )
+    return _index_node_documents(base04, is04_version, node_info, flows, senders)
+
+
+async def fetch_flow_snapshot_async(
+    *,
+    flow_id: str,
+    is04_base_url: str,
+    is05_base_url: str,
+    sender_id: str | None = None,
+    timeout: int = 5,
+    is04_version: str = DEFAULT_IS04_VERSION,
+    is05_version: str = DEFAULT_IS05_VERSION,
+    node: dict | None = None
+) -> dict:
+    """
+    Async fetch_flow_snapshot: independent requests are issued together.
+    fetch_flow_snapshot の非同期版（独立したリクエストは並行に発行）。
+    """
+    base04 = normalize_base_url(is04_base_url)
+    node_prefix = f"node/{is04_version}/"
+    flow_endpoint = urljoin(base04, node_prefix + f"flows/{flow_id}")
+
+    async def fetch_sender():
+        if not sender_id:
+            return None
+        return await _fetch_optional_json_async(urljoin(base04, node_prefix + f"senders/{sender_id}"), timeout)
+
+    if node is not None:
+        flow_data = (node["flows"] or {}).get(flow_id) or await fetch_json_async(flow_endpoint, timeout)
+        node_info = node["self"]
+        sender = _cached_sender(node, flow_id, sender_id) or await fetch_sender()
+        senders_listed = node["senders_by_flow"] is not None
+    else:
+        flow_data, node_info, sender = await asyncio.gather(
+            fetch_json_async(flow_endpoint, timeout),
+            fetch_json_async(urljoin(base04, node_prefix + "self"), timeout),
+            fetch_sender()
+        )
+        senders_listed = False
+    if not sender and not senders_listed:
+        senders = await fetch_json_async(urljoin(base04, node_prefix + "senders"), timeout)
+        for entry in senders or []:
+            if entry.get("flow_id") == flow_id:
+                sender = entry
+                break
+
+    manifest_href = sender.get("manifest_href") if sender else None
+
+    async def fetch_params():
+        if sender and sender.get("id"):
+            return await fetch_connection_params_async(is05_base_url, is05_version, sender["id"], timeout)
+        return []
+
+    sdp_cache, connection_params = await asyncio.gather(fetch_text_async(manifest_href, timeout), fetch_params())
+    return _snapshot_entry(
+        flow_data, node_info, sender, sdp_cache, connection_params,
+        is04_base_url, is05_base_url, is04_version, is05_version
+    )
+
+
+async def shutdown():
+    """Close the shared session and the async client."""
+    close_session()
+    await close_async_client()
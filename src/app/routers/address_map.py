@@ -1,13 +1,23 @@
-from bisect import bisect_left
+import base64
+import json
+from bisect import bisect_right
 from ipaddress import ip_address, ip_network, IPv4Address, IPv4Network
 from typing import Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
 from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None
 
 from app.auth import require_roles
-from app.db import get_db_connection
+from app.db import db_connection
+from app import address_occupancy, bucket_cache
 
 STATE_FREE = "FREE"
 STATE_USED = "USED"
@@ -78,15 +88,18 @@ def _parse_center(center: Optional[str], window: Dict) -> Tuple[int, IPv4Address
     return center_index, addr
 
 
-def _count_used_between(sorted_indices: List[int], start_idx: int, end_idx: int) -> int:
+def _count_used_between(occupancy, base_int: int, start_idx: int, end_idx: int) -> int:
     if end_idx < start_idx:
         return 0
-    left = bisect_left(sorted_indices, start_idx)
-    right = bisect_left(sorted_indices, end_idx + 1)
-    return max(0, right - left)
+    return occupancy.count_used(base_int + start_idx, base_int + end_idx)
+
+
+def _window_used_indices(occupancy, window: Dict) -> List[int]:
+    base_int = window["start_int"]
+    return [addr - base_int for addr in occupancy.used_addresses(base_int, window["end_int"])]
 
 
-def _summarize_buckets(blocks: List[Dict], window: Dict, used_indices: List[int]):
+def _summarize_buckets(blocks: List[Dict], window: Dict, occupancy):
     base_int = window["start_int"]
     window_start = base_int
     window_end = window["end_int"]
@@ -103,7 +116,7 @@ def _summarize_buckets(blocks: List[Dict], window: Dict, used_indices: List[int]
         overlap_end = min(block_end, window_end)
         relative_start = overlap_start - base_int
         relative_end = overlap_end - base_int
-        used_count = _count_used_between(used_indices, relative_start, relative_end)
+        used_count = _count_used_between(occupancy, base_int, relative_start, relative_end)
         overlap_size = relative_end - relative_start + 1
         summary = {
             **block,
@@ -120,92 +133,83 @@ def _summarize_buckets(blocks: List[Dict], window: Dict, used_indices: List[int]
     return parents, children
 
 
-def _fetch_blocks():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, start_int, end_int, size, description, memo, color, cidr, is_reserved
-        FROM address_buckets
-        ORDER BY start_int ASC;
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    blocks = []
-    for row in rows:
-        blocks.append({
-            "id": row[0],
-            "kind": row[1],
-            "privilege_id": row[2],
-            "parent_id": row[3],
-            "start_ip": row[4],
-            "end_ip": row[5],
-            "start_int": row[6],
-            "end_int": row[7],
-            "size": row[8],
-            "description": row[9],
-            "memo": row[10],
-            "color": row[11],
-            "cidr": row[12],
-            "is_reserved": row[13]
-        })
-    return blocks
-
-
-def _fetch_flow_addresses(window: Dict):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            flow_id,
-            display_name,
-            alias1,
-            alias2,
-            alias3,
-            alias4,
-            multicast_addr_a,
-            multicast_addr_b,
-            flow_status,
-            availability,
-            nmos_node_label
-        FROM flows;
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    base_int = window["start_int"]
-    end_int = window["end_int"]
+def _fetch_blocks(window: Optional[Dict] = None):
+    """
+    Buckets from the cached snapshot, only those intersecting ``window`` when one is given.
+    キャッシュからバケットを取得する（window 指定時は交差するもののみ）。
+    """
+    return bucket_cache.blocks(window)
+
+
+def _buckets_changed():
+    """
+    Run after a committed bucket write (the NOTIFY went out with the commit).
+    バケット更新のコミット後に呼ぶ。
+    """
+    bucket_cache.invalidate()
+    address_occupancy.refresh_reserved()
+
+
+# One branch per leg so each is an index range scan on its *_int column
+FLOW_ADDRESS_WINDOW_SQL = """
+    SELECT flow_id, display_name, alias1, alias2, alias3, alias4,
+           flow_status, availability, nmos_node_label,
+           multicast_addr_a_int AS addr_int, 'A' AS path
+    FROM flows
+    WHERE multicast_addr_a_int BETWEEN %(start)s AND %(end)s
+    UNION ALL
+    SELECT flow_id, display_name, alias1, alias2, alias3, alias4,
+           flow_status, availability, nmos_node_label,
+           multicast_addr_b_int AS addr_int, 'B' AS path
+    FROM flows
+    WHERE multicast_addr_b_int BETWEEN %(start)s AND %(end)s
+    ORDER BY addr_int, path, flow_id;
+"""
+
+
+def _fetch_flows_by_address(ranges) -> Dict[int, List[Dict]]:
+    """
+    Map absolute address -> flows using it, for every (start, end) range.
+    アドレス（整数）→ 使用フロー一覧を返す（複数範囲を1接続で取得）。
+
+    Ranges are merged first and each merged range is one indexed window
+    query, so several map windows share a single round of reads.
+    """
     used: Dict[int, List[Dict]] = {}
+    merged = address_occupancy.merge_ranges(ranges)
+    if not merged:
+        return used
+    with db_connection() as conn, conn.cursor() as cur:
+        for start_int, end_int in merged:
+            cur.execute(FLOW_ADDRESS_WINDOW_SQL, {"start": start_int, "end": end_int})
+            for row in cur.fetchall():
+                alias = next((value for value in row[2:6] if value), None)
+                used.setdefault(row[9], []).append({
+                    "flow_id": row[0],
+                    "display_name": row[1],
+                    "alias": alias,
+                    "path": row[10],
+                    "flow_status": row[6],
+                    "availability": row[7],
+                    "nmos_node_label": row[8]
+                })
+    return used
 
-    def add_entry(address: Optional[str], path_label: str, row_data):
-        if not address:
-            return
-        try:
-            addr_obj = ip_address(address)
-        except ValueError:
-            return
-        addr_val = int(addr_obj)
-        if addr_obj.version != 4 or addr_val < window["start_int"] or addr_val > end_int:
-            return
-        idx = addr_val - base_int
-        alias = next((value for value in row_data[2:6] if value), None)
-        entry = {
-            "flow_id": row_data[0],
-            "display_name": row_data[1],
-            "alias": alias,
-            "path": path_label,
-            "flow_status": row_data[8],
-            "availability": row_data[9],
-            "nmos_node_label": row_data[10]
-        }
-        used.setdefault(idx, []).append(entry)
 
-    for row in rows:
-        add_entry(row[6], "A", row)
-        add_entry(row[7], "B", row)
+def _fetch_flow_addresses(window: Dict, start_int: Optional[int] = None, end_int: Optional[int] = None):
+    """
+    Map window-relative index -> flows using that multicast address.
+    ウィンドウ内のインデックス → 使用フロー一覧を返す。
 
-    return used
+    Only rows whose A/B address falls inside [start_int, end_int] (default:
+    the whole window) are read, so the cost follows the addresses in the
+    window, not the flow table size.
+    """
+    base_int = window["start_int"]
+    start_int = base_int if start_int is None else start_int
+    end_int = window["end_int"] if end_int is None else end_int
+    used = _fetch_flows_by_address([(start_int, end_int)])
+    return {addr - base_int: flows for addr, flows in used.items()}
 
 
 def _reserved_segments(blocks: List[Dict], window: Dict):
@@ -232,23 +236,8 @@ def _reserved_segments(blocks: List[Dict], window: Dict):
     return reserved
 
 
-def _build_segments(total: int, used_indices: List[int], reserved_segments: List[Dict]):
-    if total <= 0:
-        return [], 0
-
-    boundaries = {0, total}
-    for idx in used_indices:
-        boundaries.add(idx)
-        boundaries.add(idx + 1)
-    for seg in reserved_segments:
-        start = max(0, seg["start"])
-        end = min(total, seg["end"])
-        if start >= end:
-            continue
-        boundaries.add(start)
-        boundaries.add(end)
-    sorted_boundaries = sorted(boundaries)
-
+def _reserved_events(total: int, reserved_segments: List[Dict]):
+    """Begin/end block ids per boundary, and the sorted boundaries including 0 and total."""
     events: Dict[int, Dict[str, List[int]]] = {}
     for seg in reserved_segments:
         start = max(0, seg["start"])
@@ -257,15 +246,45 @@ def _build_segments(total: int, used_indices: List[int], reserved_segments: List
             continue
         events.setdefault(start, {"begin": [], "end": []})["begin"].append(seg["block"]["id"])
         events.setdefault(end, {"begin": [], "end": []})["end"].append(seg["block"]["id"])
+    return events, sorted({0, total, *events})
+
+
+def _build_segments(total: int, used_indices: List[int], reserved_segments: List[Dict]):
+    """
+    Split [0, total) into FREE / USED / RESERVED segments.
+    ウィンドウを FREE / USED / RESERVED のセグメントに分割する。
+
+    ``used_indices`` must be sorted and distinct (as returned by the occupancy
+    index); the walk is linear in used addresses plus reserved boundaries.
+    """
+    if total <= 0:
+        return [], 0
+
+    events, boundaries = _reserved_events(total, reserved_segments)
 
-    used_sorted = sorted(used_indices)
-    used_pointer = 0
     segments = []
     reserved_count = 0
     active_blocks: Dict[int, None] = {}
 
-    for idx in range(len(sorted_boundaries) - 1):
-        start = sorted_boundaries[idx]
+    def add_gap(start: int, end: int):
+        nonlocal reserved_count
+        if start >= end:
+            return
+        if active_blocks:
+            reserved_count += end - start
+            segments.append({
+                "start": start,
+                "length": end - start,
+                "state": STATE_RESERVED,
+                "block_ids": list(active_blocks.keys())
+            })
+        else:
+            segments.append({"start": start, "length": end - start, "state": STATE_FREE})
+
+    used_iter = iter(used_indices)
+    next_used = next(used_iter, None)
+    for idx in range(len(boundaries) - 1):
+        start = boundaries[idx]
         # end events first to drop segments ending at this boundary
         for block_id in events.get(start, {}).get("end", []):
             active_blocks.pop(block_id, None)
@@ -273,30 +292,146 @@ def _build_segments(total: int, used_indices: List[int], reserved_segments: List
         for block_id in events.get(start, {}).get("begin", []):
             active_blocks[block_id] = None
 
-        end = sorted_boundaries[idx + 1]
-        if start >= end:
-            continue
+        end = boundaries[idx + 1]
+        cursor = start
+        while next_used is not None and next_used < end:
+            if next_used >= cursor:
+                add_gap(cursor, next_used)
+                segments.append({"start": next_used, "length": 1, "state": STATE_USED})
+                cursor = next_used + 1
+            next_used = next(used_iter, None)
+        add_gap(cursor, end)
 
-        used_pointer = bisect_left(used_sorted, start, used_pointer)
-        interval_has_used = used_pointer < len(used_sorted) and used_sorted[used_pointer] < end
-        if interval_has_used:
-            state = STATE_USED
-        elif active_blocks:
-            state = STATE_RESERVED
-            reserved_count += end - start
-        else:
-            state = STATE_FREE
+    return segments, reserved_count
 
-        segment = {
-            "start": start,
-            "length": end - start,
-            "state": state
+
+# --------------------------------------------------------
+# Columnar segment runs and compact encodings
+# 列指向のセグメント表現とコンパクトエンコーディング
+# --------------------------------------------------------
+SEGMENT_STATE_CODES = {STATE_FREE: 0, STATE_USED: 1, STATE_RESERVED: 2}
+SEGMENT_RLE_MEDIA_TYPE = "application/octet-stream"
+
+# Below this many used addresses the plain walk beats array setup
+SEGMENT_NUMPY_MIN_USED = 2048
+
+
+def _segments_as_runs(segments: List[Dict]):
+    """Parallel start / length / state-code lists; block ids keyed by run position (RESERVED only)."""
+    return {
+        "start": [segment["start"] for segment in segments],
+        "length": [segment["length"] for segment in segments],
+        "state": [SEGMENT_STATE_CODES[segment["state"]] for segment in segments],
+        "block_ids": {
+            str(position): segment["block_ids"]
+            for position, segment in enumerate(segments)
+            if "block_ids" in segment
         }
-        if state == STATE_RESERVED:
-            segment["block_ids"] = list(active_blocks.keys())
-        segments.append(segment)
+    }
 
-    return segments, reserved_count
+
+def _segment_runs_numpy(total: int, used_indices: List[int], reserved_segments: List[Dict]):
+    """
+    Same runs as ``_segments_as_runs(_build_segments(...))``, computed with
+    array operations: every cut point (reserved boundaries, each used index
+    and the address after it) is merged in one sorted array and each piece
+    is classified by a lookup into the reserved intervals.
+    """
+    events, boundaries = _reserved_events(total, reserved_segments)
+
+    # Active block ids per reserved interval [boundaries[i], boundaries[i + 1])
+    interval_blocks: List[Optional[List[int]]] = []
+    active_blocks: Dict[int, None] = {}
+    for boundary in boundaries[:-1]:
+        for block_id in events.get(boundary, {}).get("end", []):
+            active_blocks.pop(block_id, None)
+        for block_id in events.get(boundary, {}).get("begin", []):
+            active_blocks[block_id] = None
+        interval_blocks.append(list(active_blocks.keys()) if active_blocks else None)
+
+    used = np.asarray(used_indices, dtype=np.int64)
+    used = used[(used >= 0) & (used < total)]
+    bounds = np.asarray(boundaries, dtype=np.int64)
+    cuts = np.sort(np.concatenate((bounds, used, used + 1)))
+    cuts = cuts[np.concatenate(([True], cuts[1:] != cuts[:-1]))]
+    starts = cuts[:-1]
+    lengths = np.diff(cuts)
+
+    codes = np.full(len(starts), SEGMENT_STATE_CODES[STATE_FREE], dtype=np.int8)
+    interval = np.searchsorted(bounds, starts, side="right") - 1
+    reserved_interval = np.fromiter((ids is not None for ids in interval_blocks), dtype=bool, count=len(interval_blocks))
+    codes[reserved_interval[interval]] = SEGMENT_STATE_CODES[STATE_RESERVED]
+    codes[np.searchsorted(starts, used)] = SEGMENT_STATE_CODES[STATE_USED]
+    reserved = np.flatnonzero(codes == SEGMENT_STATE_CODES[STATE_RESERVED])
+
+    runs = {
+        "start": starts.tolist(),
+        "length": lengths.tolist(),
+        "state": codes.tolist(),
+        "block_ids": {
+            str(position): list(interval_blocks[block_interval])
+            for position, block_interval in zip(reserved.tolist(), interval[reserved].tolist())
+        }
+    }
+    return runs, int(lengths[reserved].sum())
+
+
+def _segment_runs(total: int, used_indices: List[int], reserved_segments: List[Dict]):
+    """
+    Columnar segments for the arrays / rle encodings, plus the reserved count.
+    arrays / rle 用の列指向セグメントと予約数を返す。
+
+    Dense windows take the NumPy path when it is installed and never build
+    per-segment dicts; otherwise the runs are read off ``_build_segments``.
+    """
+    if total > 0 and np is not None and len(used_indices) >= SEGMENT_NUMPY_MIN_USED:
+        block_ids = [seg["block"]["id"] for seg in reserved_segments]
+        # Repeated block ids change the walk's active-set bookkeeping; keep those on the reference path
+        if len(set(block_ids)) == len(block_ids):
+            return _segment_runs_numpy(total, used_indices, reserved_segments)
+    segments, reserved_count = _build_segments(total, used_indices, reserved_segments)
+    return _segments_as_runs(segments), reserved_count
+
+
+def _runs_as_rle(runs: Dict) -> bytes:
+    """
+    One unsigned LEB128 varint per run holding ``length << 2 | state code``.
+    1 セグメント = 可変長整数（length << 2 | 状態コード）。
+
+    Runs are contiguous from index 0, so starts are implied; a run shorter
+    than 32 addresses is a single byte. Reserved block ids are not encoded,
+    use reserved_segments for those.
+    """
+    out = bytearray()
+    for length, state in zip(runs["length"], runs["state"]):
+        value = (length << 2) | state
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def _resolve_segment_encoding(encoding: Optional[str], request: Optional[Request]) -> Tuple[str, bool]:
+    """
+    (encoding, binary): ``Accept: application/octet-stream`` selects the raw
+    RLE body unless another encoding was asked for explicitly.
+    """
+    accept = request.headers.get("accept", "") if request is not None else ""
+    binary = SEGMENT_RLE_MEDIA_TYPE in accept and encoding in (None, "rle")
+    if binary:
+        return "rle", True
+    return encoding or "objects", False
+
+
+def _encode_segments(map_payload: Dict, encoding: str):
+    """Format ``segments`` (dicts for objects, runs otherwise) for a JSON map payload."""
+    if encoding == "arrays":
+        map_payload["segments"] = {"states": SEGMENT_STATE_CODES, **map_payload["segments"]}
+    elif encoding == "rle":
+        map_payload["segments"] = base64.b64encode(_runs_as_rle(map_payload["segments"])).decode("ascii")
+    map_payload["segments_encoding"] = encoding
+    return map_payload
 
 
 @router.get("/address/buckets/overview")
@@ -307,10 +442,8 @@ def bucket_overview(
     user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
 ):
     window = _build_window(None if (range_start and range_end) else scope, range_start, range_end)
-    blocks = _fetch_blocks()
-    used_map = _fetch_flow_addresses(window)
-    used_indices = sorted(used_map.keys())
-    parents, children = _summarize_buckets(blocks, window, used_indices)
+    blocks = _fetch_blocks(window)
+    parents, children = _summarize_buckets(blocks, window, address_occupancy.get_index())
     return {
         "window": {
             "label": window["label"],
@@ -324,74 +457,333 @@ def bucket_overview(
     }
 
 
-@router.get("/address-map")
-def address_map(
-    scope: Optional[str] = Query("232.0.0.0/8", description="CIDR scope to inspect"),
-    range_start: Optional[str] = Query(None, description="Optional start IP when not using CIDR"),
-    range_end: Optional[str] = Query(None, description="Optional end IP when not using CIDR"),
-    center: Optional[str] = Query(None, description="Optional center address for UI hints"),
-    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
-):
-    window = _build_window(None if (range_start and range_end) else scope, range_start, range_end)
-    center_index, center_addr = _parse_center(center, window)
+# used_details page size for the NDJSON stream
+ADDRESS_MAP_STREAM_PAGE = 1000
 
-    blocks = _fetch_blocks()
-    used_map = _fetch_flow_addresses(window)
-    reserved_segments = _reserved_segments(blocks, window)
 
-    total = window["total"]
-    used_indices = list(used_map.keys())
-    segments, reserved_count = _build_segments(total, used_indices, reserved_segments)
-    used_count = len(used_indices)
-    free_count = max(0, total - used_count - reserved_count)
+def _details_page(used_indices: List[int], after: Optional[int], limit: Optional[int]):
+    """Used indices after ``after`` (exclusive), at most ``limit``, plus the next cursor."""
+    position = bisect_right(used_indices, after) if after is not None else 0
+    stop = len(used_indices) if limit is None else min(len(used_indices), position + limit)
+    page = used_indices[position:stop]
+    if not page:
+        return [], None
+    next_cursor = page[-1] if stop < len(used_indices) else None
+    return page, next_cursor
 
+
+def _details_for(window: Dict, page: List[int], flows_by_address: Dict[int, List[Dict]]):
     base_int = window["start_int"]
-    used_details = []
-    for index, flows in sorted(used_map.items()):
-        addr = IPv4Address(base_int + index)
-        used_details.append({
+    return [
+        {
             "index": index,
-            "address": str(addr),
+            "address": str(IPv4Address(base_int + index)),
             "state": STATE_USED,
-            "flows": flows
-        })
+            "flows": flows_by_address[base_int + index]
+        }
+        for index in page
+        if base_int + index in flows_by_address
+    ]
+
+
+def _used_details_page(window: Dict, used_indices: List[int], after: Optional[int], limit: Optional[int]):
+    """
+    One page of used_details after index ``after`` (exclusive), plus the next cursor.
+    used_details の1ページ分と次のカーソルを返す。
+    """
+    page, next_cursor = _details_page(used_indices, after, limit)
+    if not page:
+        return [], None
+    base_int = window["start_int"]
+    flows_by_address = _fetch_flows_by_address([(base_int + page[0], base_int + page[-1])])
+    return _details_for(window, page, flows_by_address), next_cursor
+
 
-    reserved_details = []
+def _reserved_details(reserved_segments: List[Dict], window: Dict):
+    base_int = window["start_int"]
+    total = window["total"]
+    details = []
     for seg in reserved_segments:
         start = max(0, seg["start"])
         end = min(total, seg["end"])
         if start >= end:
             continue
-        reserved_details.append({
+        details.append({
             "start": start,
             "length": end - start,
             "address": str(IPv4Address(base_int + start)),
             "end_address": str(IPv4Address(base_int + end - 1)),
             "block": seg["block"]
         })
+    return details
+
+
+def _stream_address_map(header: Dict, segments: List[Dict], window: Dict, used_indices: List[int],
+                        details: bool, details_cursor: Optional[int], reserved_details: List[Dict], blocks: List[Dict]):
+    """
+    NDJSON lines: scope/counts first, then segments, used details (paged from
+    the database), reserved segments and blocks, one object per line.
+    """
+    yield json.dumps({"type": "scope", **header}) + "\n"
+    for segment in segments:
+        yield json.dumps({"type": "segment", **segment}) + "\n"
+    if details:
+        cursor = details_cursor
+        while True:
+            page, cursor = _used_details_page(window, used_indices, cursor, ADDRESS_MAP_STREAM_PAGE)
+            for detail in page:
+                yield json.dumps({"type": "used", **detail}) + "\n"
+            if cursor is None:
+                break
+    for detail in reserved_details:
+        yield json.dumps({"type": "reserved", **detail}) + "\n"
+    for block in blocks:
+        yield json.dumps({"type": "block", **block}) + "\n"
+
 
+def _scope_info(window: Dict):
     return {
-        "scope": {
+        "label": window["label"],
+        "start": str(window["start_ip"]),
+        "end": str(window["end_ip"]),
+        "prefix": window["prefix"],
+        "total": window["total"],
+        "start_int": window["start_int"]
+    }
+
+
+def _window_segments(window: Dict, blocks: List[Dict], occupancy, encoding: str = "objects"):
+    """
+    Segments and counts for one window from already loaded buckets and occupancy.
+    読込済みのバケット・使用状況から1ウィンドウ分のセグメントと集計を作る。
+
+    Segments are dicts for the objects encoding and columnar runs otherwise.
+    """
+    total = window["total"]
+    reserved_segments = _reserved_segments(blocks, window)
+    used_indices = _window_used_indices(occupancy, window)
+    build = _build_segments if encoding == "objects" else _segment_runs
+    segments, reserved_count = build(total, used_indices, reserved_segments)
+    used_count = len(used_indices)
+    counts = {
+        "total": total,
+        "used": used_count,
+        "reserved": reserved_count,
+        "free": max(0, total - used_count - reserved_count)
+    }
+    return segments, used_indices, reserved_segments, counts
+
+
+@router.get("/address-map")
+def address_map(
+    request: Request,
+    scope: Optional[str] = Query("232.0.0.0/8", description="CIDR scope to inspect"),
+    range_start: Optional[str] = Query(None, description="Optional start IP when not using CIDR"),
+    range_end: Optional[str] = Query(None, description="Optional end IP when not using CIDR"),
+    center: Optional[str] = Query(None, description="Optional center address for UI hints"),
+    details: bool = Query(True, description="Include used_details (flows per used address)"),
+    details_limit: Optional[int] = Query(None, ge=1, le=10000, description="Page size for used_details (default: all)"),
+    details_cursor: Optional[int] = Query(None, ge=0, description="next_details_cursor from the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json or ndjson (streamed, one object per line)"),
+    encoding: Optional[str] = Query(None, pattern="^(objects|arrays|rle)$", description="segments as objects (default), parallel arrays or base64 RLE"),
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
+):
+    window = _build_window(None if (range_start and range_end) else scope, range_start, range_end)
+    center_index, center_addr = _parse_center(center, window)
+    encoding, binary = _resolve_segment_encoding(encoding, request if format == "json" else None)
+    if format == "ndjson" and encoding != "objects":
+        raise HTTPException(status_code=400, detail="encoding applies to format=json only")
+
+    blocks = _fetch_blocks(window)
+    segments, used_indices, reserved_segments, counts = _window_segments(
+        window, blocks, address_occupancy.get_index(), encoding
+    )
+    header = {
+        "scope": _scope_info(window),
+        "center_index": center_index,
+        "center_address": str(center_addr),
+        "counts": counts
+    }
+    if binary:
+        # Raw RLE body, scope and counts travel in headers
+        return Response(
+            content=_runs_as_rle(segments),
+            media_type=SEGMENT_RLE_MEDIA_TYPE,
+            headers={
+                "X-Address-Map-Scope": window["label"],
+                "X-Address-Map-Start": str(window["start_ip"]),
+                "X-Address-Map-Counts": json.dumps(counts, separators=(",", ":"))
+            }
+        )
+    reserved_details = _reserved_details(reserved_segments, window)
+
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_address_map(header, segments, window, used_indices, details, details_cursor, reserved_details, blocks),
+            media_type="application/x-ndjson"
+        )
+
+    used_details: List[Dict] = []
+    next_details_cursor = None
+    if details:
+        used_details, next_details_cursor = _used_details_page(window, used_indices, details_cursor, details_limit)
+
+    return _encode_segments({
+        **header,
+        "segments": segments,
+        "used_details": used_details,
+        "next_details_cursor": next_details_cursor,
+        "reserved_segments": reserved_details,
+        "blocks": blocks
+    }, encoding)
+
+
+MAX_BATCH_WINDOWS = 64
+
+
+class AddressMapWindow(BaseModel):
+    scope: Optional[str] = None
+    range_start: Optional[str] = None
+    range_end: Optional[str] = None
+
+
+class AddressMapBatchPayload(BaseModel):
+    windows: List[AddressMapWindow]
+    details: bool = False
+    details_limit: Optional[int] = Field(None, ge=1, le=10000)
+    encoding: str = Field("objects", pattern="^(objects|arrays|rle)$")
+
+
+@router.post("/address-map/batch")
+def address_map_batch(
+    payload: AddressMapBatchPayload,
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
+):
+    """
+    Address maps for several scopes/ranges in one request, keyed by scope label.
+    複数スコープ／範囲のアドレスマップを一括で返す（キーはスコープ表記）。
+
+    Buckets come from one snapshot, occupancy from one index, and flow details
+    (when requested) from a single pass over the merged used ranges.
+    """
+    if not payload.windows:
+        raise HTTPException(status_code=400, detail="windows must not be empty")
+    if len(payload.windows) > MAX_BATCH_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_WINDOWS} windows per request")
+
+    windows: Dict[str, Dict] = {}
+    for item in payload.windows:
+        use_range = bool(item.range_start and item.range_end)
+        window = _build_window(None if use_range else item.scope, item.range_start, item.range_end)
+        windows.setdefault(window["label"], window)
+
+    snapshot = bucket_cache.snapshot()
+    occupancy = address_occupancy.get_index()
+
+    maps: Dict[str, Dict] = {}
+    pages: Dict[str, Tuple[List[int], Optional[int]]] = {}
+    for label, window in windows.items():
+        blocks = snapshot.intersecting(window["start_int"], window["end_int"])
+        segments, used_indices, reserved_segments, counts = _window_segments(window, blocks, occupancy, payload.encoding)
+        maps[label] = _encode_segments({
+            "scope": _scope_info(window),
+            "counts": counts,
+            "segments": segments,
+            "reserved_segments": _reserved_details(reserved_segments, window),
+            "blocks": blocks
+        }, payload.encoding)
+        if payload.details:
+            pages[label] = _details_page(used_indices, None, payload.details_limit)
+
+    if payload.details:
+        spans = [
+            (windows[label]["start_int"] + page[0], windows[label]["start_int"] + page[-1])
+            for label, (page, _) in pages.items()
+            if page
+        ]
+        flows_by_address = _fetch_flows_by_address(spans)
+        for label, (page, next_cursor) in pages.items():
+            maps[label]["used_details"] = _details_for(windows[label], page, flows_by_address)
+            maps[label]["next_details_cursor"] = next_cursor
+
+    return {"maps": maps}
+
+
+# Cells per tile are capped so a response never exceeds 4096 entries
+MAX_TILE_CELLS = 4096
+
+
+@router.get("/address-map/tiles")
+def address_map_tile(
+    tile: str = Query(..., description="Tile CIDR, e.g. 239.0.0.0/8 or 239.1.0.0/16"),
+    zoom: Optional[int] = Query(None, ge=8, le=32, description="Cell prefix length (default: tile prefix + 8, 32 = per address)"),
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
+):
+    """
+    Occupancy histogram for one tile: used / reserved / free per cell.
+    タイル内のセルごとの使用・予約・空き数を返す。
+
+    Counts come from the in-memory occupancy index. Flow details are only
+    attached at the deepest zoom (/32 cells, one address each).
+    """
+    window = _build_window(tile, None, None)
+    cell_prefix = zoom if zoom is not None else min(32, window["prefix"] + 8)
+    if cell_prefix < window["prefix"]:
+        raise HTTPException(status_code=400, detail="zoom must be >= the tile prefix length")
+    cells = 1 << (cell_prefix - window["prefix"])
+    if cells > MAX_TILE_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"zoom /{cell_prefix} splits /{window['prefix']} into more than {MAX_TILE_CELLS} cells"
+        )
+    cell_size = 1 << (32 - cell_prefix)
+    base_int = window["start_int"]
+
+    histogram = address_occupancy.get_index().histogram(base_int, cell_size, cells)
+    cell_entries = []
+    used_total = 0
+    reserved_total = 0
+    for index, (used, reserved) in enumerate(histogram):
+        used_total += used
+        reserved_total += reserved
+        cell_entries.append({
+            "index": index,
+            "address": str(IPv4Address(base_int + index * cell_size)),
+            "used": used,
+            "reserved": reserved,
+            "free": cell_size - used - reserved
+        })
+
+    response = {
+        "tile": {
             "label": window["label"],
             "start": str(window["start_ip"]),
             "end": str(window["end_ip"]),
             "prefix": window["prefix"],
-            "total": total,
+            "total": window["total"],
             "start_int": base_int
         },
-        "center_index": center_index,
-        "center_address": str(center_addr),
+        "zoom": cell_prefix,
+        "cell_size": cell_size,
         "counts": {
-            "total": total,
-            "used": used_count,
-            "reserved": reserved_count,
-            "free": free_count
+            "total": window["total"],
+            "used": used_total,
+            "reserved": reserved_total,
+            "free": window["total"] - used_total - reserved_total
         },
-        "segments": segments,
-        "used_details": used_details,
-        "reserved_segments": reserved_details,
-        "blocks": blocks
+        "cells": cell_entries
     }
+    if cell_size == 1:
+        response["details"] = [
+            {
+                "index": index,
+                "address": str(IPv4Address(base_int + index)),
+                "state": STATE_USED,
+                "flows": flows
+            }
+            for index, flows in sorted(_fetch_flow_addresses(window).items())
+        ]
+    return response
 
 
 class ParentBucketPayload(BaseModel):
@@ -483,16 +875,13 @@ def _bucket_to_dict(row):
 
 
 def _fetch_bucket(bucket_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved, start_int, end_int
-        FROM address_buckets
-        WHERE id=%s;
-    """, (bucket_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved, start_int, end_int
+            FROM address_buckets
+            WHERE id=%s;
+        """, (bucket_id,))
+        row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Bucket not found")
     return {
@@ -515,16 +904,13 @@ def _fetch_bucket(bucket_id: int):
 
 def _determine_privilege_id(start_int: int):
     first_octet = (start_int >> 24) & 0xFF
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, start_int, end_int FROM address_buckets
-        WHERE kind='tier0' AND %s BETWEEN start_int AND end_int
-        LIMIT 1;
-    """, (start_int,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, start_int, end_int FROM address_buckets
+            WHERE kind='tier0' AND int_range @> %s::INT8
+            LIMIT 1;
+        """, (start_int,))
+        row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=400, detail=f"No privileged bucket for /8 starting with {first_octet}")
     return row[0], row[1], row[2]
@@ -535,64 +921,217 @@ def _ensure_range_within(start_int: int, end_int: int, limit_start: int, limit_e
         raise HTTPException(status_code=400, detail=f"Range must stay within {label}")
 
 
+def _find_sibling_overlap(cur, parent_id: int, kind: str, start_int: int, end_int: int, exclude_id: Optional[int] = None):
+    cur.execute("""
+        SELECT id, start_ip::TEXT, end_ip::TEXT FROM address_buckets
+        WHERE parent_id = %s
+          AND kind = %s
+          AND int_range && int8range(%s, %s, '[]')
+          AND id IS DISTINCT FROM %s
+        ORDER BY start_int
+        LIMIT 1;
+    """, (parent_id, kind, start_int, end_int, exclude_id))
+    return cur.fetchone()
+
+
+def _sibling_overlap_error(row) -> HTTPException:
+    if row is None:
+        return HTTPException(status_code=400, detail="Range overlaps a sibling bucket")
+    return HTTPException(
+        status_code=400,
+        detail=f"Range overlaps sibling bucket {row[0]} ({row[1]} - {row[2]})"
+    )
+
+
+def _ensure_no_sibling_overlap(cur, parent_id: int, kind: str, start_int: int, end_int: int,
+                               exclude_id: Optional[int] = None):
+    """
+    Reject a range that overlaps another bucket of the same kind under the same parent.
+    同じ親・同じ種別のバケットと範囲が重なれば拒否する。
+
+    Parent folders and child views under one parent may overlap each other
+    (as before); only same-kind siblings are exclusive. Locks the parent row
+    first so concurrent creates under one parent are checked one after
+    another; the lookup is a GiST range scan.
+    """
+    cur.execute("SELECT id FROM address_buckets WHERE id=%s FOR UPDATE;", (parent_id,))
+    row = _find_sibling_overlap(cur, parent_id, kind, start_int, end_int, exclude_id)
+    if row:
+        raise _sibling_overlap_error(row)
+
+
+def _raise_sibling_overlap(conn, cur, parent_id: int, kind: str, start_int: int, end_int: int,
+                           exclude_id: Optional[int] = None):
+    """After the exclusion constraint fired: roll back and report like the pre-check does."""
+    conn.rollback()
+    raise _sibling_overlap_error(_find_sibling_overlap(cur, parent_id, kind, start_int, end_int, exclude_id))
+
+
 @router.get("/address/buckets/privileged")
 def list_privileged_buckets(user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved
-        FROM address_buckets
-        WHERE kind='tier0'
-        ORDER BY start_int;
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved
+            FROM address_buckets
+            WHERE kind='tier0'
+            ORDER BY start_int;
+        """)
+        rows = cur.fetchall()
     return [_bucket_to_dict(row) for row in rows]
 
 
+BUCKET_TREE_SQL = """
+    WITH RECURSIVE tree AS (
+        SELECT id, kind, privilege_id, parent_id, start_ip, end_ip, size, description, memo, color, cidr, is_reserved,
+               start_int, end_int, 0 AS depth
+        FROM address_buckets
+        WHERE kind = 'tier0' AND (%(root)s::INTEGER IS NULL OR id = %(root)s::INTEGER)
+        UNION ALL
+        SELECT b.id, b.kind, b.privilege_id, b.parent_id, b.start_ip, b.end_ip, b.size, b.description, b.memo, b.color, b.cidr, b.is_reserved,
+               b.start_int, b.end_int, t.depth + 1
+        FROM address_buckets b
+        JOIN tree t ON b.parent_id = t.id
+        WHERE %(max_depth)s::INTEGER IS NULL OR t.depth < %(max_depth)s::INTEGER
+    )
+    SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved,
+           start_int, end_int, depth
+    FROM tree
+    ORDER BY depth, kind, start_int;
+"""
+
+
+@router.get("/address/buckets/tree")
+def bucket_tree(
+    privilege_id: Optional[int] = Query(None, description="Limit to one tier0 (privileged) bucket"),
+    depth: Optional[int] = Query(None, ge=0, le=32, description="Maximum depth below tier0 (0 = tier0 only)"),
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
+):
+    """
+    Whole tier0 -> parent -> child hierarchy in one recursive query.
+    tier0 → parent → child の階層を1回の再帰クエリで返す。
+
+    Every node carries used / reserved / free counts from the occupancy index.
+    """
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(BUCKET_TREE_SQL, {"root": privilege_id, "max_depth": depth})
+        rows = cur.fetchall()
+    if privilege_id is not None and not rows:
+        raise HTTPException(status_code=404, detail="Privileged bucket not found")
+
+    occupancy = address_occupancy.get_index()
+    nodes: Dict[int, Dict] = {}
+    roots: List[Dict] = []
+    for row in rows:
+        start_int, end_int, node_depth = row[12], row[13], row[14]
+        size = end_int - start_int + 1
+        used, reserved = occupancy.histogram(start_int, size, 1)[0]
+        node = {
+            **_bucket_to_dict(row),
+            "depth": node_depth,
+            "used": used,
+            "reserved": reserved,
+            "free": size - used - reserved,
+            "children": []
+        }
+        nodes[node["id"]] = node
+        parent = nodes.get(node["parent_id"]) if node_depth else None
+        if parent is not None:
+            parent["children"].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+
 @router.get("/address/buckets/{bucket_id}/children")
 def list_bucket_children(
     bucket_id: int,
     user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
 ):
     bucket = _fetch_bucket(bucket_id)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved
-        FROM address_buckets
-        WHERE parent_id=%s
-        ORDER BY kind ASC, start_int ASC;
-    """, (bucket["id"],))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved
+            FROM address_buckets
+            WHERE parent_id=%s
+            ORDER BY kind ASC, start_int ASC;
+        """, (bucket["id"],))
+        rows = cur.fetchall()
     return [_bucket_to_dict(row) for row in rows]
 
 
-def _bucket_kind_weight(kind: str) -> int:
-    if kind == "tier0":
-        return 0
-    if kind == "parent":
-        return 1
-    return 2
+MAX_FREE_BLOCKS = 256
+# Searches retried when the database shows a proposed block was just taken
+FREE_BLOCK_ATTEMPTS = 3
+
+
+def _cidr_for_block(start_int: int, size: int) -> Optional[str]:
+    if size & (size - 1) or start_int % size:
+        return None
+    return f"{IPv4Address(start_int)}/{32 - (size.bit_length() - 1)}"
+
+
+@router.get("/address/buckets/{bucket_id}/free-blocks")
+def find_free_blocks(
+    bucket_id: int,
+    size: int = Query(1, ge=1, le=65536, description="Addresses per block"),
+    align_prefix: Optional[int] = Query(None, ge=8, le=32, description="Align blocks to this prefix boundary, e.g. 28 for /28"),
+    count: int = Query(1, ge=1, le=MAX_FREE_BLOCKS, description="Number of blocks to return"),
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
+):
+    """
+    First free blocks inside a parent or child bucket (no used or reserved address).
+    親/子バケット内の空きブロック（使用・予約なし）を先頭から返す。
+
+    Reservations of the bucket itself do not block, so a reserved child view
+    can be filled. Runs come from the occupancy index, not an address scan;
+    the chosen blocks are then re-checked against the flows table, since
+    another worker may have assigned them moments ago.
+    """
+    bucket = bucket_cache.snapshot().by_id.get(bucket_id)
+    if bucket is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    if bucket["kind"] not in ("parent", "child"):
+        raise HTTPException(status_code=400, detail="Free blocks can only be searched in parent or child buckets")
+    align = 1 << (32 - align_prefix) if align_prefix is not None else 1
+
+    for _ in range(FREE_BLOCK_ATTEMPTS):
+        proposed = address_occupancy.get_index().free_blocks(
+            bucket["start_int"], bucket["end_int"], size, align, count, ignore_reserved={bucket_id}
+        )
+        starts = address_occupancy.confirm_free_blocks(proposed, size)
+        # Conflicts were re-counted into the index, so a retry finds replacements
+        if len(starts) == len(proposed):
+            break
+    return {
+        "bucket": {key: bucket[key] for key in ("id", "kind", "start_ip", "end_ip", "size", "cidr")},
+        "size": size,
+        "align": align,
+        "requested": count,
+        "found": len(starts),
+        "blocks": [
+            {
+                "start_ip": str(IPv4Address(start)),
+                "end_ip": str(IPv4Address(start + size - 1)),
+                "start_int": start,
+                "size": size,
+                "cidr": _cidr_for_block(start, size)
+            }
+            for start in starts
+        ]
+    }
 
 
 @router.get("/address/buckets/export")
 def export_address_buckets(
     user=Depends(require_roles("editor", "admin"))
 ):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, kind, privilege_id, parent_id, host(start_ip)::TEXT, host(end_ip)::TEXT, description, memo, color, cidr, is_reserved
-        FROM address_buckets
-        ORDER BY CASE kind WHEN 'tier0' THEN 0 WHEN 'parent' THEN 1 ELSE 2 END, start_int ASC;
-    """)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, kind, privilege_id, parent_id, host(start_ip)::TEXT, host(end_ip)::TEXT, description, memo, color, cidr, is_reserved
+            FROM address_buckets
+            ORDER BY CASE kind WHEN 'tier0' THEN 0 WHEN 'parent' THEN 1 ELSE 2 END, start_int ASC;
+        """)
+        rows = cur.fetchall()
     buckets = []
     for row in rows:
         buckets.append({
@@ -611,77 +1150,132 @@ def export_address_buckets(
     return {"buckets": buckets, "count": len(buckets)}
 
 
+BUCKET_KINDS = ("tier0", "parent", "child")
+BUCKET_IMPORT_PAGE_SIZE = 1000
+
+
+def _plan_bucket_import(buckets: List[AddressBucketBackupEntry]):
+    """
+    Validate a backup and order it so every bucket follows its parent and privilege bucket.
+    バックアップを検証し、親・特権バケットが先に来る順序に並べる。
+
+    Linear in the number of entries (Kahn's algorithm over parent/privilege
+    references). Returns (rows in insert order, per-entry errors).
+    """
+    problems: List[Dict] = []
+    rows: Dict[int, tuple] = {}
+    for index, entry in enumerate(buckets):
+        error = None
+        start_int = end_int = None
+        if entry.id in rows:
+            error = "Duplicate bucket id"
+        elif entry.kind not in BUCKET_KINDS:
+            error = f"Unknown kind '{entry.kind}'"
+        else:
+            try:
+                start = ip_address(entry.start_ip)
+                end = ip_address(entry.end_ip)
+            except ValueError:
+                start = end = None
+            if start is None or start.version != 4 or end.version != 4:
+                error = "Invalid IPv4 address in start_ip/end_ip"
+            else:
+                start_int = int(start)
+                end_int = int(end)
+                if start_int > end_int:
+                    error = "start_ip must be <= end_ip"
+        if error:
+            problems.append({"index": index, "id": entry.id, "error": error})
+            continue
+        rows[entry.id] = (
+            entry.id,
+            entry.kind,
+            entry.privilege_id,
+            entry.parent_id,
+            entry.start_ip,
+            entry.end_ip,
+            start_int,
+            end_int,
+            end_int - start_int + 1,
+            entry.description,
+            entry.memo,
+            entry.color,
+            entry.cidr,
+            entry.is_reserved or False
+        )
+
+    dependents: Dict[int, List[int]] = {}
+    waiting: Dict[int, int] = {}
+    ready: List[int] = []
+    index_of = {entry.id: index for index, entry in enumerate(buckets)}
+    for bucket_id, row in rows.items():
+        references = {ref for ref in (row[2], row[3]) if ref and ref != bucket_id}
+        missing = sorted(ref for ref in references if ref not in rows)
+        if missing:
+            problems.append({"index": index_of[bucket_id], "id": bucket_id, "error": f"Missing parent/privilege buckets {missing}"})
+        waiting[bucket_id] = len(references)
+        for ref in references:
+            dependents.setdefault(ref, []).append(bucket_id)
+        if not references:
+            ready.append(bucket_id)
+
+    ordered: List[tuple] = []
+    while ready:
+        bucket_id = ready.pop()
+        ordered.append(rows[bucket_id])
+        for dependent in dependents.get(bucket_id, ()):
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+    if len(ordered) < len(rows):
+        flagged = {problem["id"] for problem in problems}
+        for bucket_id, count in waiting.items():
+            if count and bucket_id not in flagged:
+                problems.append({
+                    "index": index_of[bucket_id],
+                    "id": bucket_id,
+                    "error": "Parent references form a cycle or lead to an invalid bucket"
+                })
+    problems.sort(key=lambda item: item["index"])
+    return ordered, problems
+
+
 @router.post("/address/buckets/import")
 def import_address_buckets(
     payload: AddressBucketBackupPayload,
     user=Depends(require_roles("admin"))
 ):
     buckets = payload.buckets or []
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("TRUNCATE address_buckets RESTART IDENTITY CASCADE;")
-        pending = sorted(
-            buckets,
-            key=lambda b: (_bucket_kind_weight(b.kind), b.id)
+    ordered, problems = _plan_bucket_import(buckets)
+    if problems:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"Import failed: {len(problems)} invalid bucket(s)", "errors": problems}
         )
-        inserted_ids: set[int] = set()
-        while pending:
-            progress = False
-            remaining = []
-            for entry in pending:
-                if entry.parent_id and entry.parent_id not in inserted_ids:
-                    remaining.append(entry)
-                    continue
-                start_int = _ip_to_int(entry.start_ip)
-                end_int = _ip_to_int(entry.end_ip)
-                if start_int > end_int:
-                    raise HTTPException(status_code=400, detail=f"Invalid range for bucket {entry.id}")
-                size = end_int - start_int + 1
-                cur.execute("""
-                    INSERT INTO address_buckets
-                        (id, kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
-                    VALUES
-                        (%s, %s, %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW());
-                """, (
-                    entry.id,
-                    entry.kind,
-                    entry.privilege_id,
-                    entry.parent_id,
-                    entry.start_ip,
-                    entry.end_ip,
-                    start_int,
-                    end_int,
-                    size,
-                    entry.description,
-                    entry.memo,
-                    entry.color,
-                    entry.cidr,
-                    entry.is_reserved or False
-                ))
-                inserted_ids.add(entry.id)
-                progress = True
-            if not progress:
-                missing_parents = sorted({entry.parent_id for entry in remaining if entry.parent_id and entry.parent_id not in inserted_ids})
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Import failed: missing parent buckets {missing_parents}"
-                )
-            pending = remaining
-        cur.execute("SELECT setval('address_buckets_id_seq', (SELECT COALESCE(MAX(id), 0) FROM address_buckets));")
-        conn.commit()
-    except HTTPException:
-        conn.rollback()
-        cur.close()
-        conn.close()
-        raise
-    except Exception as exc:
-        conn.rollback()
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=500, detail=f"Import failed: {exc}")
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        try:
+            cur.execute("TRUNCATE address_buckets RESTART IDENTITY CASCADE;")
+            execute_values(cur, """
+                INSERT INTO address_buckets
+                    (id, kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
+                VALUES %s;
+            """, ordered,
+                template="(%s, %s, %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())",
+                page_size=BUCKET_IMPORT_PAGE_SIZE)
+            cur.execute("SELECT setval('address_buckets_id_seq', (SELECT COALESCE(MAX(id), 0) FROM address_buckets));")
+            bucket_cache.notify_change(cur)
+            conn.commit()
+        except errors.ExclusionViolation as exc:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=f"Import failed: overlapping sibling buckets ({exc.diag.message_detail})")
+        except errors.UniqueViolation as exc:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=f"Import failed: duplicate bucket range ({exc.diag.message_detail})")
+        except Exception as exc:
+            conn.rollback()
+            raise HTTPException(status_code=500, detail=f"Import failed: {exc}")
+    _buckets_changed()
     return {"result": "ok", "imported": len(buckets)}
 
 
@@ -732,36 +1326,37 @@ def create_parent_bucket(
         parent_id = privilege_id  # attach directly under the privileged /8 bucket
     _ensure_range_within(start_int, end_int, limit_start, limit_end, "/8 range")
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            INSERT INTO address_buckets
-                (kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
-            VALUES
-                ('parent', %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, FALSE, NOW(), NOW())
-            RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
-        """, (
-            privilege_id,
-            parent_id,
-            start_ip,
-            end_ip,
-            start_int,
-            end_int,
-            size,
-            payload.description,
-            payload.memo,
-            payload.color,
-            canonical_cidr
-        ))
-        row = cur.fetchone()
-        conn.commit()
-    except errors.UniqueViolation:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail="A parent bucket with the same range already exists")
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        try:
+            _ensure_no_sibling_overlap(cur, parent_id, "parent", start_int, end_int)
+            cur.execute("""
+                INSERT INTO address_buckets
+                    (kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
+                VALUES
+                    ('parent', %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, FALSE, NOW(), NOW())
+                RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
+            """, (
+                privilege_id,
+                parent_id,
+                start_ip,
+                end_ip,
+                start_int,
+                end_int,
+                size,
+                payload.description,
+                payload.memo,
+                payload.color,
+                canonical_cidr
+            ))
+            row = cur.fetchone()
+            bucket_cache.notify_change(cur)
+            conn.commit()
+        except errors.UniqueViolation:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="A parent bucket with the same range already exists")
+        except errors.ExclusionViolation:
+            _raise_sibling_overlap(conn, cur, parent_id, "parent", start_int, end_int)
+    _buckets_changed()
     return _bucket_to_dict(row)
 
 
@@ -791,37 +1386,38 @@ def create_child_bucket(
         raise HTTPException(status_code=400, detail="Child bucket range must be <= 4096 addresses")
     privilege_id = parent_bucket["privilege_id"]
     _ensure_range_within(start_int, end_int, parent_bucket["start_int"], parent_bucket["end_int"], "parent bucket range")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            INSERT INTO address_buckets
-                (kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
-            VALUES
-                ('child', %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-            RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
-        """, (
-            privilege_id,
-            payload.parent_id,
-            start_ip,
-            end_ip,
-            start_int,
-            end_int,
-            size,
-            payload.description,
-            payload.memo,
-            payload.color,
-            canonical_cidr,
-            payload.is_reserved
-        ))
-        row = cur.fetchone()
-        conn.commit()
-    except errors.UniqueViolation:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail="A bucket with the same range already exists in this parent")
-    finally:
-        cur.close()
-        conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        try:
+            _ensure_no_sibling_overlap(cur, payload.parent_id, "child", start_int, end_int)
+            cur.execute("""
+                INSERT INTO address_buckets
+                    (kind, privilege_id, parent_id, start_ip, end_ip, start_int, end_int, size, description, memo, color, cidr, is_reserved, created_at, updated_at)
+                VALUES
+                    ('child', %s, %s, %s::INET, %s::INET, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
+            """, (
+                privilege_id,
+                payload.parent_id,
+                start_ip,
+                end_ip,
+                start_int,
+                end_int,
+                size,
+                payload.description,
+                payload.memo,
+                payload.color,
+                canonical_cidr,
+                payload.is_reserved
+            ))
+            row = cur.fetchone()
+            bucket_cache.notify_change(cur)
+            conn.commit()
+        except errors.UniqueViolation:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="A bucket with the same range already exists in this parent")
+        except errors.ExclusionViolation:
+            _raise_sibling_overlap(conn, cur, payload.parent_id, "child", start_int, end_int)
+    _buckets_changed()
     return _bucket_to_dict(row)
 
 
@@ -866,18 +1462,27 @@ def update_bucket(
     if not fields:
         raise HTTPException(status_code=400, detail="No updatable fields supplied")
     values.append(bucket_id)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(f"""
-        UPDATE address_buckets
-        SET {", ".join(fields)}, updated_at=NOW()
-        WHERE id=%s
-        RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
-    """, tuple(values))
-    row = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        moving = payload.parent_id is not None and payload.parent_id != bucket["parent_id"]
+        if moving:
+            _ensure_no_sibling_overlap(
+                cur, payload.parent_id, bucket["kind"], bucket["start_int"], bucket["end_int"], exclude_id=bucket_id
+            )
+        try:
+            cur.execute(f"""
+                UPDATE address_buckets
+                SET {", ".join(fields)}, updated_at=NOW()
+                WHERE id=%s
+                RETURNING id, kind, privilege_id, parent_id, start_ip::TEXT, end_ip::TEXT, size, description, memo, color, cidr, is_reserved;
+            """, tuple(values))
+        except errors.ExclusionViolation:
+            _raise_sibling_overlap(
+                conn, cur, payload.parent_id, bucket["kind"], bucket["start_int"], bucket["end_int"], exclude_id=bucket_id
+            )
+        row = cur.fetchone()
+        bucket_cache.notify_change(cur)
+        conn.commit()
+    _buckets_changed()
     return _bucket_to_dict(row)
 
 
@@ -889,16 +1494,13 @@ def delete_bucket(
     bucket = _fetch_bucket(bucket_id)
     if bucket["kind"] == "tier0":
         raise HTTPException(status_code=400, detail="Cannot delete privileged buckets")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM address_buckets WHERE id=%s RETURNING id;", (bucket_id,))
-    row = cur.fetchone()
-    if not row:
-        conn.rollback()
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Bucket not found")
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM address_buckets WHERE id=%s RETURNING id;", (bucket_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Bucket not found")
+        bucket_cache.notify_change(cur)
+        conn.commit()
+    # Deleting a parent cascades to its (possibly reserved) children
+    _buckets_changed()
     return {"result": "ok", "deleted": True}
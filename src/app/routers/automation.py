@@ -6,7 +6,7 @@ import logging
 import json
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from app.db import get_db_connection
+from app.db import db_connection
 from app.auth import require_roles
 from app import scheduler
 
@@ -31,20 +31,15 @@ def get_jobs(user=Depends(require_roles("editor", "admin"))):
     全スケジュールジョブとそのステータスを取得
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT job_id, job_type, enabled, schedule_type, schedule_value,
-                   last_run_at, last_run_status, last_run_result,
-                   created_at, updated_at
-            FROM scheduled_jobs
-            ORDER BY job_id
-        """)
-
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT job_id, job_type, enabled, schedule_type, schedule_value,
+                       last_run_at, last_run_status, last_run_result,
+                       created_at, updated_at
+                FROM scheduled_jobs
+                ORDER BY job_id
+            """)
+            rows = cur.fetchall()
 
         jobs = []
         for row in rows:
@@ -94,20 +89,15 @@ def get_job(job_id: str, user=Depends(require_roles("editor", "admin"))):
     特定のジョブ詳細を取得
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT job_id, job_type, enabled, schedule_type, schedule_value,
-                   last_run_at, last_run_status, last_run_result,
-                   created_at, updated_at
-            FROM scheduled_jobs
-            WHERE job_id = %s
-        """, (job_id,))
-
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT job_id, job_type, enabled, schedule_type, schedule_value,
+                       last_run_at, last_run_status, last_run_result,
+                       created_at, updated_at
+                FROM scheduled_jobs
+                WHERE job_id = %s
+            """, (job_id,))
+            row = cur.fetchone()
 
         if not row:
             raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
@@ -182,29 +172,23 @@ def update_job(job_id: str, config: JobConfig, user=Depends(require_roles("admin
                 raise HTTPException(status_code=400, detail=f"Invalid cron expression: {error_msg}")
 
         # Update database
-        conn = get_db_connection()
-        cur = conn.cursor()
-
         from datetime import datetime, timezone
         now = datetime.now(timezone.utc)
 
-        cur.execute("""
-            UPDATE scheduled_jobs
-            SET enabled = %s,
-                schedule_type = %s,
-                schedule_value = %s,
-                updated_at = %s
-            WHERE job_id = %s
-        """, (config.enabled, config.schedule_type, config.schedule_value, now, job_id))
-
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_jobs
+                SET enabled = %s,
+                    schedule_type = %s,
+                    schedule_value = %s,
+                    updated_at = %s
+                WHERE job_id = %s
+            """, (config.enabled, config.schedule_type, config.schedule_value, now, job_id))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+            conn.commit()
 
         # Reload job in scheduler
         scheduler.reload_job(job_id)
@@ -232,27 +216,21 @@ def enable_job(job_id: str, user=Depends(require_roles("admin"))):
     Requires admin role.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
         from datetime import datetime, timezone
         now = datetime.now(timezone.utc)
 
-        cur.execute("""
-            UPDATE scheduled_jobs
-            SET enabled = TRUE,
-                updated_at = %s
-            WHERE job_id = %s
-        """, (now, job_id))
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_jobs
+                SET enabled = TRUE,
+                    updated_at = %s
+                WHERE job_id = %s
+            """, (now, job_id))
 
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
 
         # Reload job in scheduler
         scheduler.reload_job(job_id)
@@ -280,27 +258,21 @@ def disable_job(job_id: str, user=Depends(require_roles("admin"))):
     Requires admin role.
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
         from datetime import datetime, timezone
         now = datetime.now(timezone.utc)
 
-        cur.execute("""
-            UPDATE scheduled_jobs
-            SET enabled = FALSE,
-                updated_at = %s
-            WHERE job_id = %s
-        """, (now, job_id))
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_jobs
+                SET enabled = FALSE,
+                    updated_at = %s
+                WHERE job_id = %s
+            """, (now, job_id))
 
-        if cur.rowcount == 0:
-            cur.close()
-            conn.close()
-            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
 
         # Reload job in scheduler (will remove from scheduler)
         scheduler.reload_job(job_id)
@@ -326,18 +298,13 @@ def get_summary(user=Depends(require_roles("viewer", "editor", "admin"))):
     ダッシュボード用の自動化サマリーを取得
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT job_id, last_run_result, last_run_at
-            FROM scheduled_jobs
-            WHERE job_id IN ('collision_check', 'nmos_check')
-        """)
-
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT job_id, last_run_result, last_run_at
+                FROM scheduled_jobs
+                WHERE job_id IN ('collision_check', 'nmos_check')
+            """)
+            rows = cur.fetchall()
 
         collision_count = 0
         nmos_difference_count = 0
@@ -1,15 +1,32 @@
+import base64
 import json
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from app.db import get_db_connection
-from app import nmos_client, settings_store, mqtt_client
+from app.db import db_connection
+from app.config import env_float, env_int
+from app import nmos_client, settings_store, mqtt_client, address_occupancy
+from app.flow_search import (
+    FTS_CONFIG,
+    SEARCH_VECTOR_COLUMN,
+    SEARCH_SNIPPET_DOCUMENT,
+    HIDDEN_FLOW_COLUMNS,
+    ADDRESS_INT_COLUMNS
+)
+from app.flow_filters import compile_flow_filters
 from app.auth import require_roles, decode_token
 import uuid
 from datetime import datetime, timezone
+from ipaddress import IPv4Address
 from typing import List, Iterable
+from psycopg2.extras import execute_values
 
 # --------------------------------------------------------
 # Define router instance
@@ -21,51 +38,6 @@ audit_logger = logging.getLogger("mmam.audit")
 
 CHECKER_KINDS = {"collisions", "nmos"}
 
-TEXT_FILTER_FIELDS = {
-    "flow_id", "display_name",
-    "source_addr_a", "multicast_addr_a",
-    "source_addr_b", "multicast_addr_b",
-    "transport_protocol",
-    "nmos_node_id",
-    "nmos_flow_id", "nmos_sender_id", "nmos_device_id",
-    "nmos_is04_host", "nmos_is05_host",
-    "sdp_url", "sdp_cache",
-    "nmos_label", "nmos_description", "management_url",
-    "media_type", "st2110_format", "redundancy_group",
-    "alias1", "alias2", "alias3", "alias4",
-    "alias5", "alias6", "alias7", "alias8",
-    "flow_status", "availability", "data_source",
-    "rds_address", "rds_api_url",
-    "user_field1", "user_field2", "user_field3", "user_field4",
-    "user_field5", "user_field6", "user_field7", "user_field8",
-    "note",
-    "nmos_is04_version", "nmos_is05_version",
-    "nmos_is04_base_url", "nmos_is05_base_url"
-}
-
-INT_FILTER_FIELDS = {
-    "source_port_a", "group_port_a",
-    "source_port_b", "group_port_b",
-    "nmos_is04_port", "nmos_is05_port",
-    "group_port_a", "group_port_b"
-}
-
-FILTER_FIELDS = TEXT_FILTER_FIELDS | INT_FILTER_FIELDS
-
-KEYWORD_SEARCH_FIELDS = [
-    "flow_id", "nmos_node_id", "nmos_flow_id", "nmos_sender_id", "nmos_device_id",
-    "display_name",
-    "source_addr_a", "source_addr_b",
-    "multicast_addr_a", "multicast_addr_b",
-    "transport_protocol",
-    "nmos_label", "nmos_description",
-    "alias1", "alias2", "alias3", "alias4",
-    "alias5", "alias6", "alias7", "alias8",
-    "management_url", "note",
-    "media_type", "redundancy_group"
-]
-
-UUID_LIKE_FIELDS = {"flow_id", "nmos_node_id", "nmos_flow_id", "nmos_sender_id", "nmos_device_id"}
 LOCK_ROLE_SETTING_KEY = "flow_lock_role"
 
 COLLISION_FIELDS = [
@@ -108,7 +80,21 @@ FLOW_UPSERT_SQL = f"""
     VALUES ({FLOW_INSERT_PLACEHOLDERS_SQL})
     ON CONFLICT (flow_id) DO UPDATE SET
         {FLOW_UPDATE_ASSIGNMENTS},
-        updated_at = NOW();
+        updated_at = NOW()
+    RETURNING *;
+"""
+
+# Create path: only a logically deleted ('unused') row may be overwritten.
+# A conflicting live row makes the statement return nothing (-> 409); a
+# concurrent insert of the same id waits on the unique index and lands here too.
+FLOW_CREATE_SQL = f"""
+    INSERT INTO flows ({FLOW_INSERT_COLUMNS_SQL})
+    VALUES ({FLOW_INSERT_PLACEHOLDERS_SQL})
+    ON CONFLICT (flow_id) DO UPDATE SET
+        {FLOW_UPDATE_ASSIGNMENTS},
+        updated_at = NOW()
+    WHERE flows.flow_status = 'unused'
+    RETURNING *;
 """
 
 
@@ -116,47 +102,37 @@ def _record_checker_run(kind: str, payload: dict, status: str = "success", actor
     if kind not in CHECKER_KINDS:
         return
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO checker_runs (kind, status, result, created_by, created_at)
-            VALUES (%s, %s, %s::JSONB, %s, NOW())
-            ON CONFLICT (kind) DO UPDATE SET
-                status = EXCLUDED.status,
-                result = EXCLUDED.result,
-                created_by = EXCLUDED.created_by,
-                created_at = EXCLUDED.created_at;
-            """,
-            (kind, status, json.dumps(payload), actor)
-        )
-        conn.commit()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO checker_runs (kind, status, result, created_by, created_at)
+                VALUES (%s, %s, %s::JSONB, %s, NOW())
+                ON CONFLICT (kind) DO UPDATE SET
+                    status = EXCLUDED.status,
+                    result = EXCLUDED.result,
+                    created_by = EXCLUDED.created_by,
+                    created_at = EXCLUDED.created_at;
+                """,
+                (kind, status, json.dumps(payload), actor)
+            )
+            conn.commit()
     except Exception as exc:  # pragma: no cover - best effort logging
         logger.exception("Failed to record checker run (%s): %s", kind, exc)
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except Exception:
-            pass
 
 
 def _fetch_latest_checker_run(kind: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT kind, status, result, created_by, created_at
-        FROM checker_runs
-        WHERE kind=%s
-        ORDER BY created_at DESC
-        LIMIT 1;
-        """,
-        (kind,)
-    )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT kind, status, result, created_by, created_at
+            FROM checker_runs
+            WHERE kind=%s
+            ORDER BY created_at DESC
+            LIMIT 1;
+            """,
+            (kind,)
+        )
+        row = cur.fetchone()
     if not row:
         return None
     result_payload = row[2]
@@ -178,6 +154,55 @@ def _utcnow_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _encode_cursor(sort_field: str, sort_order: str, value, flow_id) -> str:
+    payload = {
+        "k": sort_field,
+        "o": sort_order,
+        "v": _serialize_value(value),
+        "t": "datetime" if isinstance(value, datetime) else None,
+        "id": str(flow_id)
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort_field: str, sort_order: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value = payload["v"]
+        if payload.get("t") == "datetime" and value is not None:
+            value = datetime.fromisoformat(value)
+        flow_id = str(uuid.UUID(payload["id"]))
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("k") != sort_field or payload.get("o") != sort_order:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort_by/sort_order")
+    return value, flow_id
+
+
+def _keyset_condition(sort_field: str, descending: bool, value, flow_id: str):
+    """
+    Seek predicate for (sort_field, flow_id) keyset pagination.
+    キーセットページング用のシーク条件を返す。
+
+    Mirrors PostgreSQL's default NULL placement (NULLS FIRST for DESC,
+    NULLS LAST for ASC) so the seek agrees with the ORDER BY.
+    """
+    op = "<" if descending else ">"
+    if sort_field == "flow_id":
+        return f"flow_id {op} %s::uuid", [flow_id]
+    if value is None:
+        clause = f"({sort_field} IS NULL AND flow_id {op} %s::uuid)"
+        if descending:
+            clause = f"({clause} OR {sort_field} IS NOT NULL)"
+        return clause, [flow_id]
+    clause = f"({sort_field}, flow_id) {op} (%s, %s::uuid)"
+    if not descending:
+        clause = f"({clause} OR {sort_field} IS NULL)"
+    return clause, [value, flow_id]
+
+
 def _parse_datetime(value: str, label: str) -> datetime:
     try:
         return datetime.fromisoformat(value)
@@ -336,9 +361,17 @@ def _build_flow_values(flow_id: str, flow: Flow):
     ]
 
 
-def _upsert_flow(cur, flow_id: str, flow: Flow):
+def _upsert_flow(cur, flow_id: str, flow: Flow) -> dict:
     values = _build_flow_values(flow_id, flow)
     cur.execute(FLOW_UPSERT_SQL, values)
+    return _row_to_dict(cur, cur.fetchone())
+
+
+def _create_flow_row(cur, flow_id: str, flow: Flow) -> dict | None:
+    """Insert, or restore an 'unused' row; None when a live row already holds the id."""
+    cur.execute(FLOW_CREATE_SQL, _build_flow_values(flow_id, flow))
+    row = cur.fetchone()
+    return _row_to_dict(cur, row) if row else None
 
 
 NMOS_SYNC_FIELDS = [
@@ -357,30 +390,55 @@ NMOS_SYNC_FIELDS = [
 ]
 
 
+def _row_to_dict(cur, row) -> dict:
+    colnames = [desc[0] for desc in cur.description]
+    return {key: value for key, value in zip(colnames, row) if key not in HIDDEN_FLOW_COLUMNS}
+
+
 def _fetch_flow_record(flow_id: str) -> dict:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM flows WHERE flow_id = %s;", (flow_id,))
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM flows WHERE flow_id = %s;", (flow_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Flow not found")
+        return _row_to_dict(cur, row)
+
+
+def _lock_flow_record(cur, flow_id: str, not_found_detail: str = "Flow not found") -> dict:
+    """
+    Fetch and row-lock a flow inside the caller's transaction (SELECT ... FOR UPDATE).
+    呼び出し元トランザクション内でフロー行をロックして取得する。
+    """
+    cur.execute("SELECT * FROM flows WHERE flow_id = %s FOR UPDATE;", (flow_id,))
     row = cur.fetchone()
     if not row:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Flow not found")
-    colnames = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
-    return dict(zip(colnames, row))
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    return _row_to_dict(cur, row)
+
+
+def _update_flow_returning(cur, flow_id: str, updates: dict, not_found_detail: str = "Flow not found") -> dict:
+    """
+    Apply column updates and return the new row image (UPDATE ... RETURNING *).
+    列を更新し、更新後の行イメージを返す。
+    """
+    set_clause = ", ".join([f"{key} = %s" for key in updates])
+    values = list(updates.values())
+    values.append(flow_id)
+    cur.execute(
+        f"UPDATE flows SET {set_clause}, updated_at = NOW() WHERE flow_id = %s RETURNING *;",
+        values
+    )
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    return _row_to_dict(cur, row)
 
 
 def _fetch_all_flows() -> list[dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM flows ORDER BY updated_at DESC;")
-    rows = cur.fetchall()
-    colnames = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
-    return [dict(zip(colnames, row)) for row in rows]
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT * FROM flows ORDER BY updated_at DESC;")
+        rows = cur.fetchall()
+        return [_row_to_dict(cur, row) for row in rows]
 
 
 def _resolve_nmos_bases(flow: dict):
@@ -407,9 +465,23 @@ def _resolve_nmos_bases(flow: dict):
     return is04_base, is05_base, nmos_flow_id, sender_id, is04_version, is05_version
 
 
-def _fetch_nmos_snapshot(flow: dict, timeout: int = 5):
+def _fetch_nmos_snapshot(flow: dict, timeout: int = 5, node: dict | None = None):
     is04_base, is05_base, nmos_flow_id, sender_id, is04_version, is05_version = _resolve_nmos_bases(flow)
     return nmos_client.fetch_flow_snapshot(
+        flow_id=nmos_flow_id,
+        is04_base_url=is04_base,
+        is05_base_url=is05_base,
+        sender_id=sender_id,
+        timeout=timeout,
+        is04_version=is04_version,
+        is05_version=is05_version,
+        node=node
+    )
+
+
+async def _fetch_nmos_snapshot_async(flow: dict, timeout: int = 5):
+    is04_base, is05_base, nmos_flow_id, sender_id, is04_version, is05_version = _resolve_nmos_bases(flow)
+    return await nmos_client.fetch_flow_snapshot_async(
         flow_id=nmos_flow_id,
         is04_base_url=is04_base,
         is05_base_url=is05_base,
@@ -473,6 +545,15 @@ class NmosApplyRequest(BaseModel):
     timeout: int | None = None
 
 
+class MulticastAssignRequest(BaseModel):
+    flow_ids: list[str]
+    bucket_a: int
+    bucket_b: int | None = None
+    port_policy: str = "keep"
+    port: int | None = None
+    overwrite: bool = False
+
+
 def _serialize_value(value):
     if isinstance(value, datetime):
         return value.isoformat()
@@ -532,6 +613,8 @@ def list_flows(
     fields: str | None = Query(None, description="Comma-separated list of extra fields to include / 追加取得したいフィールド"),
     limit: int = Query(50, ge=1, le=500, description="Number of records to return"),
     offset: int = Query(0, ge=0, description="Offset for pagination"),
+    pagination: str = Query("offset", pattern="^(offset|cursor)$", description="offset (list response) or cursor (items + next_cursor)"),
+    cursor: str | None = Query(None, description="Opaque cursor from a previous next_cursor (implies pagination=cursor)"),
     sort_by: str = Query("updated_at", description="Field to sort by"),
     sort_order: str = Query("desc", pattern="^(asc|desc)$", description="Sort order (asc or desc)"),
     updated_at_min: str | None = Query(None, description="Return flows updated at or after this ISO timestamp"),
@@ -557,7 +640,8 @@ def list_flows(
     if fields:
         for f in fields.split(","):
             f = f.strip()
-            if f and f not in base_fields:
+            # Internal columns (search_vector, *_int shadows) are never projected
+            if f and f not in base_fields and f not in HIDDEN_FLOW_COLUMNS:
                 extra_fields.append(f)
 
     all_fields = base_fields + extra_fields
@@ -565,143 +649,202 @@ def list_flows(
 
     # ✅ SQL組み立て
     base_query = f"SELECT {field_sql} FROM flows"
-    conditions = []
-    values = []
-
-    if not include_unused:
-        conditions.append("flow_status = 'active'")
-
-    # ✅ 動的検索条件
-    skip_keys = {
-        "include_unused", "fields",
-        "updated_at_min", "updated_at_max",
-        "created_at_min", "created_at_max",
-        "q"
+    # ✅ 動的検索条件（型認識コンパイラ、形状ごとにキャッシュ）
+    timestamp_ranges = {
+        "updated_at": (
+            _parse_datetime(updated_at_min, "updated_at_min") if updated_at_min else None,
+            _parse_datetime(updated_at_max, "updated_at_max") if updated_at_max else None
+        ),
+        "created_at": (
+            _parse_datetime(created_at_min, "created_at_min") if created_at_min else None,
+            _parse_datetime(created_at_max, "created_at_max") if created_at_max else None
+        )
     }
-    filters = {}
-    for key, value in request.query_params.multi_items():
-        if key in skip_keys:
-            continue
-        if key not in FILTER_FIELDS:
-            continue
-        if value == "":
-            continue
-        filters.setdefault(key, []).append(value)
-
-    for key, vals in filters.items():
-        clauses = []
-        for val in vals:
-            if key in TEXT_FILTER_FIELDS:
-                if key in UUID_LIKE_FIELDS:
-                    clauses.append(f"CAST({key} AS TEXT) = %s")
-                    values.append(val)
-                else:
-                    clauses.append(f"{key} ILIKE %s")
-                    values.append(f"%{val}%")
-            elif key in INT_FILTER_FIELDS:
-                try:
-                    int_val = int(val)
-                except ValueError:
-                    raise HTTPException(status_code=400, detail=f"Invalid integer for {key}")
-                clauses.append(f"{key} = %s")
-                values.append(int_val)
-        if clauses:
-            if len(clauses) == 1:
-                conditions.append(clauses[0])
-            else:
-                grouped = " OR ".join(clauses)
-                conditions.append(f"({grouped})")
-
-    if updated_at_min:
-        dt = _parse_datetime(updated_at_min, "updated_at_min")
-        conditions.append("updated_at >= %s")
-        values.append(dt)
-    if updated_at_max:
-        dt = _parse_datetime(updated_at_max, "updated_at_max")
-        conditions.append("updated_at <= %s")
-        values.append(dt)
-    if created_at_min:
-        dt = _parse_datetime(created_at_min, "created_at_min")
-        conditions.append("created_at >= %s")
-        values.append(dt)
-    if created_at_max:
-        dt = _parse_datetime(created_at_max, "created_at_max")
-        conditions.append("created_at <= %s")
-        values.append(dt)
-
-    # Numeric range filters
-    for field in INT_FILTER_FIELDS:
-        min_key = f"{field}_min"
-        max_key = f"{field}_max"
-        min_val = request.query_params.get(min_key)
-        max_val = request.query_params.get(max_key)
-        if min_val not in (None, ""):
-            try:
-                values.append(int(min_val))
-            except ValueError:
-                raise HTTPException(status_code=400, detail=f"Invalid integer for {min_key}")
-            conditions.append(f"{field} >= %s")
-        if max_val not in (None, ""):
-            try:
-                values.append(int(max_val))
-            except ValueError:
-                raise HTTPException(status_code=400, detail=f"Invalid integer for {max_key}")
-            conditions.append(f"{field} <= %s")
-
-    if q:
-        keyword = f"%{q}%"
-        clauses = []
-        for field in KEYWORD_SEARCH_FIELDS:
-            if field in UUID_LIKE_FIELDS:
-                clauses.append(f"CAST({field} AS TEXT) ILIKE %s")
-            else:
-                clauses.append(f"{field} ILIKE %s")
-        conditions.append("(" + " OR ".join(clauses) + ")")
-        values.extend([keyword] * len(clauses))
+    conditions, values = compile_flow_filters(
+        request.query_params.multi_items(),
+        include_unused=include_unused,
+        q=q,
+        timestamp_ranges=timestamp_ranges
+    )
+
+    sort_field = sort_by if sort_by in all_fields else "updated_at"
+    order_clause = "ASC" if sort_order.lower() == "asc" else "DESC"
+    cursor_mode = pagination == "cursor" or bool(cursor)
+
+    # ✅ キーセットページング: (ソート値, flow_id) より後ろへシーク
+    if cursor_mode and cursor:
+        cursor_value, cursor_flow_id = _decode_cursor(cursor, sort_field, order_clause.lower())
+        seek_clause, seek_values = _keyset_condition(
+            sort_field, order_clause == "DESC", cursor_value, cursor_flow_id
+        )
+        conditions.append(seek_clause)
+        values.extend(seek_values)
 
     if conditions:
         where_clause = " WHERE " + " AND ".join(conditions)
     else:
         where_clause = ""
 
-    sort_field = sort_by if sort_by in all_fields else "updated_at"
-    order_clause = "ASC" if sort_order.lower() == "asc" else "DESC"
-    query = f"{base_query}{where_clause} ORDER BY {sort_field} {order_clause} LIMIT %s OFFSET %s;"
+    order_by = f"ORDER BY {sort_field} {order_clause}"
+    if sort_field != "flow_id":
+        order_by += f", flow_id {order_clause}"
+    if cursor_mode:
+        query = f"{base_query}{where_clause} {order_by} LIMIT %s;"
+        params = list(values) + [limit + 1]
+    else:
+        query = f"{base_query}{where_clause} {order_by} LIMIT %s OFFSET %s;"
+        params = list(values) + [limit, offset]
+
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(query, tuple(params))
+        rows = cur.fetchall()
+        # ✅ レスポンスをdict化
+        items = [_row_to_dict(cur, row) for row in rows]
+    if not cursor_mode:
+        return items
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = _encode_cursor(sort_field, order_clause.lower(), last.get(sort_field), last["flow_id"])
+    return {"items": items, "next_cursor": next_cursor, "limit": limit}
+
+
+def _prefix_tsquery(text: str) -> str | None:
+    terms = re.findall(r"\w+", text)
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    params = list(values) + [limit, offset]
-    cur.execute(query, tuple(params))
-    rows = cur.fetchall()
-    colnames = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
 
-    # ✅ レスポンスをdict化
-    return [dict(zip(colnames, row)) for row in rows]
+# --------------------------------------------------------
+# GET /api/flows/search
+# Ranked full-text search (best match first)
+# 全文検索（関連度順）
+# --------------------------------------------------------
+@router.get("/flows/search")
+def search_flows(
+    user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows")),
+    q: str = Query(..., min_length=1, description="Search words / 検索語"),
+    match: str = Query("prefix", pattern="^(prefix|websearch)$", description="prefix: every word as a prefix, websearch: quoted phrases, OR, -exclusion"),
+    include_unused: bool = Query(False, description="Include logically deleted flows / 論理削除済みも含める"),
+    limit: int = Query(50, ge=1, le=500, description="Number of records to return")
+):
+    """
+    Return flows ordered by ts_rank over the weighted search_vector with highlighted snippets.
+    重み付き search_vector の ts_rank 順にフローを返す（ハイライト付きスニペット）。
+    """
+    if match == "prefix":
+        tsquery = _prefix_tsquery(q)
+        if not tsquery:
+            raise HTTPException(status_code=400, detail="Search query contains no searchable words")
+        query_sql = f"to_tsquery('{FTS_CONFIG}', %s)"
+    else:
+        tsquery = q
+        query_sql = f"websearch_to_tsquery('{FTS_CONFIG}', %s)"
+
+    status_clause = "" if include_unused else "AND f.flow_status = 'active'"
+    # Rank and LIMIT first so ts_headline only runs on the returned rows
+    sql = f"""
+        SELECT
+            ranked.flow_id, ranked.display_name, ranked.nmos_node_label,
+            ranked.flow_status, ranked.availability, ranked.locked,
+            ranked.created_at, ranked.updated_at,
+            ranked.rank,
+            ts_headline('{FTS_CONFIG}', ranked.document, ranked.tsq,
+                        'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=12, MinWords=3') AS snippet
+        FROM (
+            SELECT
+                f.flow_id, f.display_name, f.nmos_node_label,
+                f.flow_status, f.availability, f.locked,
+                f.created_at, f.updated_at,
+                {SEARCH_SNIPPET_DOCUMENT} AS document,
+                query.tsq,
+                ts_rank(f.{SEARCH_VECTOR_COLUMN}, query.tsq) AS rank
+            FROM flows f, (SELECT {query_sql} AS tsq) AS query
+            WHERE f.{SEARCH_VECTOR_COLUMN} @@ query.tsq
+            {status_clause}
+            ORDER BY rank DESC, f.flow_id
+            LIMIT %s
+        ) AS ranked
+        ORDER BY ranked.rank DESC, ranked.flow_id;
+    """
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, (tsquery, limit))
+        rows = cur.fetchall()
+        colnames = [desc[0] for desc in cur.description]
+    return {
+        "query": q,
+        "match": match,
+        "items": [dict(zip(colnames, row)) for row in rows],
+        "limit": limit
+    }
 
 
 @router.get("/flows/summary")
 def flow_summary(
     user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
 ):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            COUNT(*) AS total,
-            COUNT(*) FILTER (WHERE flow_status = 'active') AS active
-        FROM flows;
-    """)
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                COUNT(*) AS total,
+                COUNT(*) FILTER (WHERE flow_status = 'active') AS active
+            FROM flows;
+        """)
+        row = cur.fetchone()
 
     total = row[0] if row else 0
     active = row[1] if row else 0
     return {"total": total, "active": active}
 
 
+@router.get("/flows/address-issues")
+def flow_address_issues(
+    user=Depends(require_roles("editor", "admin")),
+    limit: int = Query(500, ge=1, le=5000, description="Number of records to return")
+):
+    """
+    List flows whose address columns hold text that is not a plain IPv4 address.
+    IPv4 として解釈できないアドレス値を持つフローを一覧する。
+
+    Such values have a NULL integer shadow column, so CIDR/range filters and the
+    address map cannot see them until they are corrected.
+    """
+    invalid_checks = [
+        f"(NULLIF(btrim({column}), '') IS NOT NULL AND {int_column} IS NULL)"
+        for column, int_column in ADDRESS_INT_COLUMNS.items()
+    ]
+    columns = ", ".join(ADDRESS_INT_COLUMNS)
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT flow_id, display_name, flow_status, {columns},
+                   {", ".join(f"{check} AS {column}_invalid" for column, check in zip(ADDRESS_INT_COLUMNS, invalid_checks))}
+            FROM flows
+            WHERE {" OR ".join(invalid_checks)}
+            ORDER BY flow_id
+            LIMIT %s;
+        """, (limit,))
+        rows = cur.fetchall()
+        colnames = [desc[0] for desc in cur.description]
+
+    items = []
+    for row in rows:
+        record = dict(zip(colnames, row))
+        items.append({
+            "flow_id": record["flow_id"],
+            "display_name": record["display_name"],
+            "flow_status": record["flow_status"],
+            "invalid": {
+                column: record[column]
+                for column in ADDRESS_INT_COLUMNS
+                if record[f"{column}_invalid"]
+            }
+        })
+    return {"items": items, "count": len(items), "limit": limit}
+
+
 @router.get("/realtime/config")
 def realtime_config(
     user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
@@ -723,45 +866,38 @@ def import_flows(payload: List[Flow], user=Depends(require_roles("admin"))):
     if not payload:
         return {"result": "ok", "inserted": 0, "updated": 0, "skipped_locked": 0}
 
-    conn = get_db_connection()
-    cur = conn.cursor()
     inserted = 0
     updated = 0
     skipped_locked = 0
-    changed_updates: list[tuple[str, dict]] = []
-    try:
+    changed_updates: list[tuple[str, dict, dict]] = []
+    written: list[tuple[dict | None, dict]] = []
+    with db_connection() as conn, conn.cursor() as cur:
+        if any(_writes_multicast(flow.model_dump(exclude_none=True)) for flow in payload):
+            _lock_multicast_writes(cur)
         for flow in payload:
             flow_id = flow.flow_id or flow.nmos_flow_id or str(uuid.uuid4())
-            cur.execute("SELECT * FROM flows WHERE flow_id=%s;", (flow_id,))
+            cur.execute("SELECT * FROM flows WHERE flow_id=%s FOR UPDATE;", (flow_id,))
             existing_row = cur.fetchone()
             if existing_row:
-                colnames = [desc[0] for desc in cur.description]
-                existing = dict(zip(colnames, existing_row))
+                existing = _row_to_dict(cur, existing_row)
                 if existing.get("locked"):
                     skipped_locked += 1
                     continue
-                is_update = True
             else:
                 existing = None
-                is_update = False
 
-            _upsert_flow(cur, flow_id, flow)
-            if is_update:
+            flow_record = _upsert_flow(cur, flow_id, flow)
+            written.append((existing, flow_record))
+            if existing:
                 updated += 1
-                changed_updates.append((flow_id, existing))
+                changed_updates.append((flow_id, existing, flow_record))
             else:
                 inserted += 1
         conn.commit()
-    finally:
-        cur.close()
-        conn.close()
 
-    for flow_id, before in changed_updates:
-        try:
-            flow_record = _fetch_flow_record(flow_id)
-        except HTTPException:
-            flow_record = None
-        diff = _flow_diff(before, flow_record) if before and flow_record else {}
+    address_occupancy.apply_flow_changes(written)
+    for flow_id, before, flow_record in changed_updates:
+        diff = _flow_diff(before, flow_record)
         _publish_flow_event("updated", flow_record, flow_id, diff=diff)
 
     audit_logger.info(
@@ -780,6 +916,203 @@ def import_flows(payload: List[Flow], user=Depends(require_roles("admin"))):
     }
 
 
+# --------------------------------------------------------
+# POST /api/flows/assign-multicast
+# Allocate A/B multicast addresses for many flows at once
+# 複数フローへのマルチキャストアドレス一括割当
+# --------------------------------------------------------
+MULTICAST_ASSIGN_LOCK_KEY = 0x6D6D616D  # "mmam": serialises multicast address writes across workers
+MULTICAST_ASSIGN_MAX_FLOWS = 1000
+PORT_POLICIES = {"keep", "fixed", "increment"}
+
+
+def _lock_multicast_writes(cur):
+    """
+    Take the transaction-level lock every multicast address write holds.
+    マルチキャストアドレスを書き込む全経路で取得するトランザクションロック。
+
+    Must be taken before any flow row lock (assign-multicast locks rows
+    after it), otherwise the two orders can deadlock.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s);", (MULTICAST_ASSIGN_LOCK_KEY,))
+
+
+def _writes_multicast(fields) -> bool:
+    return any(column in fields for column in address_occupancy.OCCUPYING_COLUMNS)
+
+MULTICAST_ASSIGN_SQL = """
+    UPDATE flows AS f SET
+        multicast_addr_a = COALESCE(v.addr_a, f.multicast_addr_a),
+        multicast_addr_b = COALESCE(v.addr_b, f.multicast_addr_b),
+        group_port_a = COALESCE(v.port_a, f.group_port_a),
+        group_port_b = COALESCE(v.port_b, f.group_port_b),
+        updated_at = NOW()
+    FROM (VALUES %s) AS v(flow_id, addr_a, addr_b, port_a, port_b)
+    WHERE f.flow_id = v.flow_id
+    RETURNING f.*;
+"""
+
+
+def _lock_assign_bucket(cur, bucket_id: int) -> dict:
+    cur.execute(
+        "SELECT id, kind, start_int, end_int FROM address_buckets WHERE id=%s FOR SHARE;",
+        (bucket_id,)
+    )
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"Bucket {bucket_id} not found")
+    if row[1] not in ("parent", "child"):
+        raise HTTPException(status_code=400, detail="Multicast addresses can only be assigned from parent or child buckets")
+    return {"id": row[0], "kind": row[1], "start_int": row[2], "end_int": row[3]}
+
+
+def _free_addresses(cur, bucket: dict, needed: int) -> list[int]:
+    """
+    First ``needed`` free addresses in a bucket, read from PostgreSQL under the assignment lock.
+    割当ロック下で PostgreSQL から空きアドレスを先頭から取得する。
+    """
+    start_int, end_int = bucket["start_int"], bucket["end_int"]
+    cur.execute("""
+        SELECT multicast_addr_a_int FROM flows WHERE multicast_addr_a_int BETWEEN %(start)s AND %(end)s
+        UNION
+        SELECT multicast_addr_b_int FROM flows WHERE multicast_addr_b_int BETWEEN %(start)s AND %(end)s
+        ORDER BY 1;
+    """, {"start": start_int, "end": end_int})
+    used = [row[0] for row in cur.fetchall()]
+    cur.execute("""
+        SELECT start_int, end_int, id FROM address_buckets
+        WHERE kind = 'child' AND is_reserved AND id <> %s
+          AND int_range && int8range(%s, %s, '[]');
+    """, (bucket["id"], start_int, end_int))
+    reserved = cur.fetchall()
+    runs = address_occupancy.iter_free_runs(start_int, end_int, used, reserved)
+    return address_occupancy.fit_blocks(runs, 1, 1, needed)
+
+
+@router.post("/flows/assign-multicast")
+def assign_multicast(payload: MulticastAssignRequest, user=Depends(require_roles("editor", "admin"))):
+    """
+    Give many flows free A (and optionally B) multicast addresses in one transaction.
+    複数フローに空きマルチキャストアドレスを1トランザクションで割り当てる。
+
+    Every path that writes multicast_addr_a/b (create, update, NMOS apply,
+    import and this endpoint) takes the same transaction-level advisory
+    lock, and free addresses are computed from the database inside it, so
+    an address handed out here is never in use by another flow at commit.
+    Manual writes may still deliberately reuse an address (the collision
+    checker reports those). Flows that already have an address keep it
+    unless ``overwrite`` is set.
+
+    port_policy: keep (leave group ports), fixed (every flow gets ``port``),
+    increment (``port``, ``port``+1, ... in request order).
+    """
+    try:
+        # Canonical form, so "ABC..." and "abc..." name the same flow
+        flow_ids = list(dict.fromkeys(str(uuid.UUID(flow_id)) for flow_id in payload.flow_ids))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="flow_ids must be UUIDs")
+    if not flow_ids:
+        raise HTTPException(status_code=400, detail="No flow_ids supplied")
+    if len(flow_ids) > MULTICAST_ASSIGN_MAX_FLOWS:
+        raise HTTPException(status_code=400, detail=f"At most {MULTICAST_ASSIGN_MAX_FLOWS} flows per request")
+    if payload.port_policy not in PORT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"port_policy must be one of {sorted(PORT_POLICIES)}")
+    if payload.port_policy != "keep":
+        if payload.port is None or not 1 <= payload.port <= 65535:
+            raise HTTPException(status_code=400, detail="port (1-65535) is required for this port_policy")
+        if payload.port_policy == "increment" and payload.port + len(flow_ids) - 1 > 65535:
+            raise HTTPException(status_code=400, detail="Port range exceeds 65535")
+
+    legs = [("a", payload.bucket_a)] + ([("b", payload.bucket_b)] if payload.bucket_b is not None else [])
+    with db_connection() as conn, conn.cursor() as cur:
+        _lock_multicast_writes(cur)
+        cur.execute("SELECT * FROM flows WHERE flow_id = ANY(%s::uuid[]) ORDER BY flow_id FOR UPDATE;", (flow_ids,))
+        current = {str(record["flow_id"]): record for record in (_row_to_dict(cur, row) for row in cur.fetchall())}
+        missing = [flow_id for flow_id in flow_ids if flow_id not in current]
+        if missing:
+            raise HTTPException(status_code=404, detail={"message": "Flows not found", "flow_ids": missing})
+        locked = [flow_id for flow_id in flow_ids if current[flow_id].get("locked")]
+        if locked:
+            raise HTTPException(status_code=423, detail={"message": "Flows are locked", "flow_ids": locked})
+
+        # Legs sharing a bucket draw from one pool so A and B never collide
+        targets: dict[str, list[str]] = {}
+        needed: dict[int, int] = {}
+        for leg, bucket_id in legs:
+            column = f"multicast_addr_{leg}"
+            targets[leg] = [
+                flow_id for flow_id in flow_ids
+                if payload.overwrite or not (current[flow_id].get(column) or "").strip()
+            ]
+            needed[bucket_id] = needed.get(bucket_id, 0) + len(targets[leg])
+        pools: dict[int, list[int]] = {}
+        for bucket_id, count in needed.items():
+            bucket = _lock_assign_bucket(cur, bucket_id)
+            pools[bucket_id] = _free_addresses(cur, bucket, count) if count else []
+            if len(pools[bucket_id]) < count:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Bucket {bucket_id} has {len(pools[bucket_id])} free addresses, {count} needed"
+                )
+
+        assigned: dict[str, dict] = {flow_id: {} for flow_id in flow_ids}
+        free = {bucket_id: iter(pool) for bucket_id, pool in pools.items()}
+        for leg, bucket_id in legs:
+            for flow_id in targets[leg]:
+                assigned[flow_id][leg] = str(IPv4Address(next(free[bucket_id])))
+        rows = []
+        for position, flow_id in enumerate(flow_ids):
+            port = None
+            if payload.port_policy == "fixed":
+                port = payload.port
+            elif payload.port_policy == "increment":
+                port = payload.port + position
+            rows.append((
+                flow_id,
+                assigned[flow_id].get("a"),
+                assigned[flow_id].get("b"),
+                port,
+                port if payload.bucket_b is not None else None
+            ))
+        updated = execute_values(
+            cur, MULTICAST_ASSIGN_SQL, rows,
+            template="(%s::uuid, %s::TEXT, %s::TEXT, %s::INTEGER, %s::INTEGER)",
+            fetch=True
+        )
+        after = {str(record["flow_id"]): record for record in (_row_to_dict(cur, row) for row in updated)}
+        conn.commit()
+
+    address_occupancy.apply_flow_changes((current[flow_id], after[flow_id]) for flow_id in flow_ids)
+    for flow_id in flow_ids:
+        diff = _flow_diff(
+            current[flow_id], after[flow_id],
+            ["multicast_addr_a", "multicast_addr_b", "group_port_a", "group_port_b"]
+        )
+        if diff:
+            _publish_flow_event("updated", after[flow_id], flow_id, diff=diff)
+    audit_logger.info(
+        "flows multicast assigned | user=%s | flows=%s | bucket_a=%s | bucket_b=%s",
+        user["username"],
+        len(flow_ids),
+        payload.bucket_a,
+        payload.bucket_b
+    )
+    return {
+        "result": "ok",
+        "assignments": [
+            {
+                "flow_id": flow_id,
+                "multicast_addr_a": after[flow_id].get("multicast_addr_a"),
+                "group_port_a": after[flow_id].get("group_port_a"),
+                "multicast_addr_b": after[flow_id].get("multicast_addr_b"),
+                "group_port_b": after[flow_id].get("group_port_b"),
+                "assigned": sorted(assigned[flow_id])
+            }
+            for flow_id in flow_ids
+        ]
+    }
+
+
 def _collision_checker_core():
     """
     Core collision checker logic (without authentication).
@@ -788,10 +1121,8 @@ def _collision_checker_core():
     Returns:
         list: Collision check results
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
     results = []
-    try:
+    with db_connection() as conn, conn.cursor() as cur:
         for field, label in COLLISION_FIELDS:
             cur.execute(
                 f"""
@@ -821,12 +1152,7 @@ def _collision_checker_core():
                 "label": label,
                 "entries": entries
             })
-        return results
-    finally:
-        if not cur.closed:
-            cur.close()
-        if not conn.closed:
-            conn.close()
+    return results
 
 
 @router.get("/checker/collisions")
@@ -844,13 +1170,128 @@ def collision_checker(user=Depends(require_roles("editor", "admin"))):
         raise
 
 
-def _nmos_checker_core(timeout: int = 5):
+# --------------------------------------------------------
+# NMOS checker concurrency
+# NMOSチェッカーの並列実行設定
+# --------------------------------------------------------
+NMOS_CHECK_CONCURRENCY = max(1, env_int("NMOS_CHECK_CONCURRENCY", 16))
+NMOS_CHECK_PER_NODE = max(1, env_int("NMOS_CHECK_PER_NODE", 4))
+NMOS_CHECK_DEADLINE = env_float("NMOS_CHECK_DEADLINE", 300.0)
+
+# Outcome of a flow whose turn came after the deadline
+_NMOS_CHECK_EXPIRED = ("expired", None)
+
+
+def _nmos_node_key(flow: dict) -> str:
+    """host:port of the flow's IS-04 node, used for per-node limits and timing."""
+    try:
+        is04_base = _resolve_nmos_bases(flow)[0]
+    except HTTPException:
+        return "unknown"
+    host, port = nmos_client.parse_host_port(is04_base)
+    return f"{host}:{port}"
+
+
+def _nmos_document_key(flow: dict):
+    """(IS-04 base, version) whose node documents the flow's snapshot is built from."""
+    try:
+        is04_base, _, _, _, is04_version, _ = _resolve_nmos_bases(flow)
+    except HTTPException:
+        return None
+    return nmos_client.normalize_base_url(is04_base), is04_version
+
+
+class _NodeDocuments:
+    """
+    Node self/flows/senders fetched once per (IS-04 base, version) for a checker run.
+    チェッカー実行中、ノード文書を (IS-04 base, version) ごとに1回だけ取得する。
+    """
+
+    def __init__(self, timeout: int):
+        self.timeout = timeout
+        self._locks: dict[tuple, threading.Lock] = {}
+        self._results: dict[tuple, object] = {}
+        self._guard = threading.Lock()
+
+    def get(self, key: tuple | None):
+        if key is None:
+            return None
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._results:
+                try:
+                    self._results[key] = nmos_client.fetch_node_documents(key[0], self.timeout, key[1])
+                except HTTPException as exc:
+                    # Only an unreachable ``self`` gets here (flows / senders are optional),
+                    # so every flow of that node fails fast with the same reason
+                    self._results[key] = exc
+        result = self._results[key]
+        if isinstance(result, HTTPException):
+            raise result
+        return result
+
+
+def _check_nmos_flow(flow: dict, timeout: int, documents: _NodeDocuments | None = None):
+    """
+    Compare one flow against its NMOS node: ("difference", entry), ("error", entry) or None.
+    1フローをNMOSと比較する。
+    """
+    try:
+        node = documents.get(_nmos_document_key(flow)) if documents is not None else None
+        snapshot = _fetch_nmos_snapshot(flow, timeout=timeout, node=node)
+        diff = _diff_flow_fields(flow, snapshot)
+        if not diff:
+            return None
+        return "difference", {
+            "flow_id": flow.get("flow_id"),
+            "display_name": flow.get("display_name"),
+            "nmos_node_label": flow.get("nmos_node_label"),
+            "difference_count": len(diff),
+            "fields": list(diff.keys()),
+            "details": diff
+        }
+    except HTTPException as exc:
+        reason = exc.detail if isinstance(exc.detail, str) else str(exc.detail)
+    except Exception as exc:
+        reason = str(exc)
+    return "error", {
+        "flow_id": flow.get("flow_id"),
+        "display_name": flow.get("display_name"),
+        "reason": reason
+    }
+
+
+def _interleave_by_node(node_keys: list[str]) -> list[int]:
+    """Positions ordered round-robin across nodes, so one node's flows do not fill the pool."""
+    queues: dict[str, list[int]] = {}
+    for position, key in enumerate(node_keys):
+        queues.setdefault(key, []).append(position)
+    order = []
+    depth = 0
+    while len(order) < len(node_keys):
+        for positions in queues.values():
+            if depth < len(positions):
+                order.append(positions[depth])
+        depth += 1
+    return order
+
+
+def _nmos_checker_core(timeout: int = 5, deadline: float | None = None):
     """
     Core NMOS checker logic (without authentication).
     認証なしのNMOSチェッカーコアロジック
 
+    Flows are checked on a bounded thread pool (NMOS_CHECK_CONCURRENCY) with
+    at most NMOS_CHECK_PER_NODE requests in flight per IS-04 node. Each
+    node's self/flows/senders are fetched once and shared by its flows, so
+    per-flow work is the SDP and IS-05 lookups. Flows not finished within
+    the deadline are reported as errors. Results keep the flow order
+    regardless of completion order.
+
     Args:
         timeout: Timeout in seconds for NMOS requests
+        deadline: Overall time budget in seconds (default: NMOS_CHECK_DEADLINE)
 
     Returns:
         dict: NMOS check results
@@ -858,39 +1299,80 @@ def _nmos_checker_core(timeout: int = 5):
     all_flows = _fetch_all_flows()
     eligible = [flow for flow in all_flows if _flow_has_nmos_sources(flow)]
     skipped = len(all_flows) - len(eligible)
+    budget = deadline if deadline is not None else NMOS_CHECK_DEADLINE
+    started = time.monotonic()
+
+    node_keys = [_nmos_node_key(flow) for flow in eligible]
+    node_slots = {key: threading.BoundedSemaphore(NMOS_CHECK_PER_NODE) for key in set(node_keys)}
+    documents = _NodeDocuments(timeout)
+    outcomes: dict[int, tuple] = {}
+    elapsed: dict[int, float] = {}
+
+    def run(position: int):
+        with node_slots[node_keys[position]]:
+            # Waiting for a node slot may already have used up the budget
+            if time.monotonic() - started >= budget:
+                return position, _NMOS_CHECK_EXPIRED, 0.0
+            began = time.monotonic()
+            outcome = _check_nmos_flow(eligible[position], timeout, documents)
+            return position, outcome, time.monotonic() - began
+
+    expired: set[int] = set()
+    if eligible:
+        executor = ThreadPoolExecutor(
+            max_workers=min(NMOS_CHECK_CONCURRENCY, len(eligible)),
+            thread_name_prefix="nmos-check"
+        )
+        futures = [executor.submit(run, position) for position in _interleave_by_node(node_keys)]
+        try:
+            for future in as_completed(futures, timeout=max(0.0, budget - (time.monotonic() - started))):
+                position, outcome, seconds = future.result()
+                if outcome is _NMOS_CHECK_EXPIRED:
+                    continue
+                outcomes[position] = outcome
+                elapsed[position] = seconds
+        except FutureTimeoutError:
+            pass
+        finally:
+            # In-flight requests finish in the background (bounded by timeout)
+            executor.shutdown(wait=False, cancel_futures=True)
+        expired.update(position for position in range(len(eligible)) if position not in elapsed)
+
     differences = []
     errors = []
-    for flow in eligible:
-        try:
-            snapshot = _fetch_nmos_snapshot(flow, timeout=timeout)
-            diff = _diff_flow_fields(flow, snapshot)
-            if diff:
-                differences.append({
-                    "flow_id": flow.get("flow_id"),
-                    "display_name": flow.get("display_name"),
-                    "nmos_node_label": flow.get("nmos_node_label"),
-                    "difference_count": len(diff),
-                    "fields": list(diff.keys()),
-                    "details": diff
-                })
-        except HTTPException as exc:
-            reason = exc.detail if isinstance(exc.detail, str) else str(exc.detail)
-            errors.append({
-                "flow_id": flow.get("flow_id"),
-                "display_name": flow.get("display_name"),
-                "reason": reason
-            })
-        except Exception as exc:
+    nodes: dict[str, dict] = {}
+    for position, flow in enumerate(eligible):
+        node = nodes.setdefault(node_keys[position], {
+            "node": node_keys[position], "flows": 0, "errors": 0, "timed_out": 0, "elapsed_ms": 0.0, "max_ms": 0.0
+        })
+        node["flows"] += 1
+        if position in expired:
+            node["timed_out"] += 1
             errors.append({
                 "flow_id": flow.get("flow_id"),
                 "display_name": flow.get("display_name"),
-                "reason": str(exc)
+                "reason": f"NMOS checker deadline ({budget:g}s) exceeded"
             })
+            continue
+        milliseconds = round(elapsed[position] * 1000, 1)
+        node["elapsed_ms"] = round(node["elapsed_ms"] + milliseconds, 1)
+        node["max_ms"] = max(node["max_ms"], milliseconds)
+        outcome = outcomes[position]
+        if outcome is None:
+            continue
+        kind, entry = outcome
+        if kind == "difference":
+            differences.append(entry)
+        else:
+            node["errors"] += 1
+            errors.append(entry)
     return {
         "checked": len(eligible),
         "skipped": skipped,
         "differences": differences,
         "errors": errors,
+        "nodes": [nodes[key] for key in sorted(nodes)],
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
         "fetchedAt": _utcnow_iso()
     }
 
@@ -898,10 +1380,11 @@ def _nmos_checker_core(timeout: int = 5):
 @router.get("/checker/nmos")
 def nmos_checker(
     timeout: int = 5,
+    deadline: float | None = Query(None, gt=0, description="Overall time budget in seconds"),
     user=Depends(require_roles("editor", "admin"))
 ):
     try:
-        payload = _nmos_checker_core(timeout)
+        payload = _nmos_checker_core(timeout, deadline)
         _record_checker_run("nmos", payload, "success", user["username"])
         return payload
     except Exception as exc:
@@ -931,13 +1414,14 @@ def get_flow_detail(
 
 
 @router.get("/flows/{flow_id}/nmos/check")
-def check_flow_against_nmos(
+async def check_flow_against_nmos(
     flow_id: str,
     timeout: int = 5,
     user=Depends(require_roles("viewer", "editor", "admin", allow_anonymous_setting="allow_anonymous_flows"))
 ):
-    flow = _fetch_flow_record(flow_id)
-    snapshot = _fetch_nmos_snapshot(flow, timeout=timeout)
+    # The database read stays on the threadpool; the NMOS requests are awaited
+    flow = await run_in_threadpool(_fetch_flow_record, flow_id)
+    snapshot = await _fetch_nmos_snapshot_async(flow, timeout=timeout)
     differences = _diff_flow_fields(flow, snapshot)
     return {
         "flow_id": flow_id,
@@ -958,6 +1442,8 @@ def apply_nmos_updates(
         raise HTTPException(status_code=400, detail="No fields selected for NMOS apply")
     flow = _fetch_flow_record(flow_id)
     _ensure_flow_unlocked(flow)
+    # The NMOS round trips happen before the row lock is taken so a slow node
+    # never holds the flow row; the lock state is re-checked under the lock.
     snapshot = _fetch_nmos_snapshot(flow, timeout=payload.timeout or 5)
     updates = {}
     for field in payload.fields:
@@ -966,25 +1452,15 @@ def apply_nmos_updates(
     if not updates:
         raise HTTPException(status_code=400, detail="No matching fields found in NMOS data")
 
-    set_clause = ", ".join([f"{key} = %s" for key in updates])
-    values = list(updates.values())
-    values.append(flow_id)
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"UPDATE flows SET {set_clause}, updated_at = NOW() WHERE flow_id = %s;",
-        values
-    )
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Flow not found")
-    conn.commit()
-    cur.close()
-    conn.close()
-    updated_flow = _fetch_flow_record(flow_id)
-    diff = _flow_diff(flow, updated_flow, updates.keys())
+    with db_connection() as conn, conn.cursor() as cur:
+        if _writes_multicast(updates):
+            _lock_multicast_writes(cur)
+        current = _lock_flow_record(cur, flow_id)
+        _ensure_flow_unlocked(current)
+        updated_flow = _update_flow_returning(cur, flow_id, updates)
+        conn.commit()
+    address_occupancy.apply_flow_change(current, updated_flow)
+    diff = _flow_diff(current, updated_flow, updates.keys())
     _publish_flow_event("updated", updated_flow, flow_id, diff=diff)
     audit_logger.info(
         "flow nmos apply | user=%s | flow_id=%s | fields=%s",
@@ -1003,29 +1479,14 @@ def set_flow_lock(
 ):
     if not _user_can_toggle_lock(user):
         raise HTTPException(status_code=403, detail="Not allowed to change lock status")
-    flow = _fetch_flow_record(flow_id)
     new_state = bool(payload.locked)
-    if flow.get("locked") == new_state:
-        return {"result": "ok", "flow_id": flow_id, "locked": new_state}
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE flows
-        SET locked = %s, updated_at = NOW()
-        WHERE flow_id = %s;
-        """,
-        (new_state, flow_id)
-    )
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Flow not found")
-    conn.commit()
-    cur.close()
-    conn.close()
-    updated_flow = _fetch_flow_record(flow_id)
+    with db_connection() as conn, conn.cursor() as cur:
+        flow = _lock_flow_record(cur, flow_id)
+        if flow.get("locked") == new_state:
+            return {"result": "ok", "flow_id": flow_id, "locked": new_state}
+        updated_flow = _update_flow_returning(cur, flow_id, {"locked": new_state})
+        conn.commit()
     diff = _flow_diff(flow, updated_flow, ["locked"])
     _publish_flow_event("updated", updated_flow, flow_id, diff=diff)
     audit_logger.info(
@@ -1047,40 +1508,27 @@ def update_flow(
     if not updates:
         raise HTTPException(status_code=400, detail="No fields to update")
 
-    current = _fetch_flow_record(flow_id)
     lock_change = "locked" in updates
     if lock_change and not _user_can_toggle_lock(user):
         raise HTTPException(status_code=403, detail="Not allowed to change lock status")
 
-    non_lock_updates = {k: v for k, v in updates.items() if k != "locked"}
-    if current.get("locked") and non_lock_updates:
-        raise HTTPException(status_code=423, detail="Flow is locked. Unlock before editing.")
-
-    if lock_change and updates["locked"] == current.get("locked"):
-        updates.pop("locked")
-        lock_change = False
-    if not updates:
-        raise HTTPException(status_code=400, detail="No fields to update")
-
-    set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
-    values = list(updates.values())
-    values.append(flow_id)
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        f"UPDATE flows SET {set_clause}, updated_at = NOW() WHERE flow_id = %s;",
-        values
-    )
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Flow not found")
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    updated_flow = _fetch_flow_record(flow_id)
+    with db_connection() as conn, conn.cursor() as cur:
+        if _writes_multicast(updates):
+            _lock_multicast_writes(cur)
+        current = _lock_flow_record(cur, flow_id)
+        non_lock_updates = {k: v for k, v in updates.items() if k != "locked"}
+        if current.get("locked") and non_lock_updates:
+            raise HTTPException(status_code=423, detail="Flow is locked. Unlock before editing.")
+
+        if lock_change and updates["locked"] == current.get("locked"):
+            updates.pop("locked")
+            lock_change = False
+        if not updates:
+            raise HTTPException(status_code=400, detail="No fields to update")
+
+        updated_flow = _update_flow_returning(cur, flow_id, updates)
+        conn.commit()
+    address_occupancy.apply_flow_change(current, updated_flow)
     diff = _flow_diff(current, updated_flow, updates.keys())
     _publish_flow_event("updated", updated_flow, flow_id, diff=diff)
     audit_logger.info(
@@ -1102,23 +1550,25 @@ def update_flow(
 def create_flow(flow: Flow, user=Depends(require_roles("editor", "admin"))):
     flow_id = flow.flow_id or flow.nmos_flow_id or str(uuid.uuid4())
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT flow_status FROM flows WHERE flow_id=%s;", (flow_id,))
-    existing = cur.fetchone()
-    if existing and existing[0] != "unused":
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=409, detail="Flow ID already exists")
-    restored = bool(existing)
-    try:
-        _upsert_flow(cur, flow_id, flow)
+    with db_connection() as conn, conn.cursor() as cur:
+        if _writes_multicast(flow.model_dump(exclude_none=True)):
+            _lock_multicast_writes(cur)
+        cur.execute(
+            "SELECT flow_status, multicast_addr_a, multicast_addr_b FROM flows WHERE flow_id=%s FOR UPDATE;",
+            (flow_id,)
+        )
+        existing = cur.fetchone()
+        if existing and existing[0] != "unused":
+            raise HTTPException(status_code=409, detail="Flow ID already exists")
+        restored = bool(existing)
+        new_flow = _create_flow_row(cur, flow_id, flow)
+        if new_flow is None:
+            conn.rollback()
+            raise HTTPException(status_code=409, detail="Flow ID already exists")
         conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+    previous = {"multicast_addr_a": existing[1], "multicast_addr_b": existing[2]} if existing else None
+    address_occupancy.apply_flow_change(previous, new_flow)
 
-    new_flow = _fetch_flow_record(flow_id)
     _publish_flow_event("updated" if restored else "created", new_flow, flow_id)
     audit_logger.info(
         "flow created | user=%s | flow_id=%s | restored=%s",
@@ -1136,21 +1586,14 @@ def create_flow(flow: Flow, user=Depends(require_roles("editor", "admin"))):
 # --------------------------------------------------------
 @router.delete("/flows/{flow_id}")
 def delete_flow(flow_id: str, user=Depends(require_roles("admin"))):
-    flow = _fetch_flow_record(flow_id)
-    _ensure_flow_unlocked(flow)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        UPDATE flows
-        SET flow_status='unused', availability='lost', updated_at=NOW()
-        WHERE flow_id=%s;
-    """, (flow_id,))
-    if cur.rowcount == 0:
-        raise HTTPException(status_code=404, detail="Flow not found / 該当フローなし")
-    conn.commit()
-    cur.close()
-    conn.close()
-    updated_flow = _fetch_flow_record(flow_id)
+    not_found = "Flow not found / 該当フローなし"
+    with db_connection() as conn, conn.cursor() as cur:
+        flow = _lock_flow_record(cur, flow_id, not_found)
+        _ensure_flow_unlocked(flow)
+        updated_flow = _update_flow_returning(
+            cur, flow_id, {"flow_status": "unused", "availability": "lost"}, not_found
+        )
+        conn.commit()
     _publish_flow_event("deleted", updated_flow, flow_id)
     audit_logger.info("flow deleted | user=%s | flow_id=%s", user["username"], flow_id)
     return {"result": "ok", "flow_id": flow_id, "deleted": True}
@@ -1162,18 +1605,12 @@ def hard_delete_flow(flow_id: str, user=Depends(require_roles("admin"))):
     Permanently remove a flow record from the database.
     フローの行を完全削除する危険操作（管理者のみ）。
     """
-    flow = _fetch_flow_record(flow_id)
-    _ensure_flow_unlocked(flow)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM flows WHERE flow_id=%s;", (flow_id,))
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Flow not found / 該当フローなし")
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        flow = _lock_flow_record(cur, flow_id)
+        _ensure_flow_unlocked(flow)
+        cur.execute("DELETE FROM flows WHERE flow_id=%s;", (flow_id,))
+        conn.commit()
+    address_occupancy.apply_flow_change(flow, None)
     _publish_flow_event("hard_deleted", flow, flow_id)
     audit_logger.info("flow hard deleted | user=%s | flow_id=%s", user["username"], flow_id)
     return {"result": "ok", "flow_id": flow_id, "hard_deleted": True}
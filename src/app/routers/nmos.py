@@ -1,19 +1,34 @@
+import asyncio
+import json
+import logging
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from urllib.parse import urljoin, urlsplit, urlunsplit
 from app.auth import require_roles
+from app.config import env_int
 from app.nmos_client import (
     normalize_base_url,
-    fetch_json,
-    fetch_text,
+    fetch_json_async,
+    fetch_text_async,
     parse_sdp_details,
-    fetch_connection_params,
+    fetch_connection_params_async,
     parse_host_port,
     DEFAULT_IS04_VERSION,
-    DEFAULT_IS05_VERSION
+    DEFAULT_IS05_VERSION,
+    NMOS_HTTP_MAX_CONNECTIONS
 )
 
 router = APIRouter()
+logger = logging.getLogger("mmam.nmos")
+
+
+# Per-flow SDP / IS-05 lookups in flight at once during /nmos/discover.
+# Each flow issues up to three requests (SDP, IS-05 active and staged), which
+# share the async client's NMOS_HTTP_MAX_CONNECTIONS connections; flows beyond
+# what the pool can serve just wait for a connection.
+NMOS_DISCOVER_CONCURRENCY = max(1, env_int("NMOS_DISCOVER_CONCURRENCY", 16))
 
 
 def ensure_x_nmos_segment(url: str) -> str:
@@ -44,6 +59,13 @@ class DiscoverRequest(BaseModel):
     is04_version: str = DEFAULT_IS04_VERSION
     is05_version: str = DEFAULT_IS05_VERSION
     timeout: int = 5
+    concurrency: int | None = Field(
+        None, ge=1, le=256,
+        description="Flows looked up at once (default NMOS_DISCOVER_CONCURRENCY). "
+                    f"Requests share {NMOS_HTTP_MAX_CONNECTIONS} pooled connections (NMOS_HTTP_MAX_CONNECTIONS), "
+                    "so values above about a third of that only queue."
+    )
+    stream: bool = False
 
 
 class DetectIS05Request(BaseModel):
@@ -58,8 +80,75 @@ class DetectIS04FromRDSRequest(BaseModel):
     timeout: int = 5
 
 
+def _discover_entry(flow: dict, linked_senders: list, node_info, sdp_cache: str | None,
+                    connection_params: list, context: dict) -> dict:
+    flow_id = flow.get("id")
+    primary_sender = linked_senders[0] if linked_senders else None
+    manifest_href = primary_sender.get("manifest_href") if primary_sender else None
+    parsed = parse_sdp_details(sdp_cache) if sdp_cache else {}
+    path_a = connection_params[0] if len(connection_params) >= 1 else {}
+    path_b = connection_params[1] if len(connection_params) >= 2 else {}
+
+    def pick_path(path, key):
+        value = path.get(key)
+        return value
+
+    source_addr_a = pick_path(path_a, "source_ip") or parsed.get("source_addr_a")
+    source_addr_b = pick_path(path_b, "source_ip")
+    multicast_addr_a = pick_path(path_a, "destination_ip") or parsed.get("multicast_addr_a")
+    multicast_addr_b = pick_path(path_b, "destination_ip")
+    group_port_a = pick_path(path_a, "destination_port") or parsed.get("group_port_a")
+    group_port_b = pick_path(path_b, "destination_port")
+    source_port_a = pick_path(path_a, "source_port")
+    source_port_b = pick_path(path_b, "source_port")
+    media_type = pick_path(path_a, "media_type") or parsed.get("media_type") or flow.get("media_type")
+    redundancy_group = parsed.get("redundancy_group")
+    return {
+        "nmos_flow_id": flow_id,
+        "label": flow.get("label") or flow_id,
+        "description": flow.get("description"),
+        "node_label": node_info.get("label") if isinstance(node_info, dict) else None,
+        "node_description": node_info.get("description") if isinstance(node_info, dict) else None,
+        "nmos_node_label": node_info.get("label") if isinstance(node_info, dict) else None,
+        "nmos_node_description": node_info.get("description") if isinstance(node_info, dict) else None,
+        "format": flow.get("format"),
+        "tags": flow.get("tags"),
+        "source_id": flow.get("source_id"),
+        "parents": flow.get("parents"),
+        "version": flow.get("version"),
+        "nmos_device_id": flow.get("device_id"),
+        "nmos_node_id": node_info.get("id") if isinstance(node_info, dict) else None,
+        "nmos_sender_id": primary_sender.get("id") if primary_sender else None,
+        "sender_transport": primary_sender.get("transport") if primary_sender else None,
+        "sender_manifest": primary_sender.get("manifest_href") if primary_sender else None,
+        "source_addr_a": source_addr_a,
+        "source_addr_b": source_addr_b,
+        "source_port_a": source_port_a,
+        "source_port_b": source_port_b,
+        "multicast_addr_a": multicast_addr_a,
+        "multicast_addr_b": multicast_addr_b,
+        "group_port_a": group_port_a,
+        "group_port_b": group_port_b,
+        "media_type": media_type,
+        "st2110_format": flow.get("format"),
+        "redundancy_group": redundancy_group,
+        "sdp_url": manifest_href,
+        "sdp_cache": sdp_cache,
+        "nmos_is04_host": context["is04_host"],
+        "nmos_is04_port": context["is04_port"],
+        "nmos_is04_base_url": context["is04_base"],
+        "nmos_is05_host": context["is05_host"],
+        "nmos_is05_port": context["is05_port"],
+        "nmos_is05_base_url": context["is05_base"],
+        "nmos_is04_version": context["version"],
+        "nmos_is05_version": context["conn_version"],
+        "raw_flow": flow,
+        "raw_sender": linked_senders
+    }
+
+
 @router.post("/nmos/discover")
-def discover_nmos_flows(payload: DiscoverRequest, user=Depends(require_roles("editor", "admin"))):
+async def discover_nmos_flows(payload: DiscoverRequest, user=Depends(require_roles("editor", "admin"))):
     is04_base = normalize_base_url(payload.is04_base_url)
     is05_base = normalize_base_url(payload.is05_base_url)
     version = payload.is04_version.strip() or "v1.3"
@@ -69,11 +158,23 @@ def discover_nmos_flows(payload: DiscoverRequest, user=Depends(require_roles("ed
     senders_url = urljoin(is04_base, node_prefix + "senders")
     self_url = urljoin(is04_base, node_prefix + "self")
 
-    node_info = fetch_json(self_url, payload.timeout)
-    flows = fetch_json(flows_url, payload.timeout)
-    senders = fetch_json(senders_url, payload.timeout)
+    node_info, flows, senders = await asyncio.gather(
+        fetch_json_async(self_url, payload.timeout),
+        fetch_json_async(flows_url, payload.timeout),
+        fetch_json_async(senders_url, payload.timeout)
+    )
     is04_host, is04_port = parse_host_port(payload.is04_base_url)
     is05_host, is05_port = parse_host_port(payload.is05_base_url)
+    context = {
+        "is04_host": is04_host,
+        "is04_port": is04_port,
+        "is04_base": is04_base,
+        "is05_host": is05_host,
+        "is05_port": is05_port,
+        "is05_base": is05_base,
+        "version": version,
+        "conn_version": conn_version
+    }
 
     sender_map = {}
     for sender in senders or []:
@@ -81,95 +182,89 @@ def discover_nmos_flows(payload: DiscoverRequest, user=Depends(require_roles("ed
         if flow_id:
             sender_map.setdefault(flow_id, []).append(sender)
 
-    results = []
-    for flow in flows or []:
-        flow_id = flow.get("id")
-        linked_senders = sender_map.get(flow_id, [])
+    slots = asyncio.Semaphore(payload.concurrency or NMOS_DISCOVER_CONCURRENCY)
+
+    async def discover_flow(flow: dict) -> dict:
+        linked_senders = sender_map.get(flow.get("id"), [])
         primary_sender = linked_senders[0] if linked_senders else None
         manifest_href = primary_sender.get("manifest_href") if primary_sender else None
-        sdp_cache = fetch_text(manifest_href, payload.timeout)
-        parsed = parse_sdp_details(sdp_cache) if sdp_cache else {}
-        connection_params = []
-        if primary_sender and primary_sender.get("id"):
-            connection_params = fetch_connection_params(
-                payload.is05_base_url,
-                conn_version,
-                primary_sender["id"],
-                payload.timeout
-            )
 
-        path_a = connection_params[0] if len(connection_params) >= 1 else {}
-        path_b = connection_params[1] if len(connection_params) >= 2 else {}
-
-        def pick_path(path, key):
-            value = path.get(key)
-            return value
-
-        source_addr_a = pick_path(path_a, "source_ip") or parsed.get("source_addr_a")
-        source_addr_b = pick_path(path_b, "source_ip")
-        multicast_addr_a = pick_path(path_a, "destination_ip") or parsed.get("multicast_addr_a")
-        multicast_addr_b = pick_path(path_b, "destination_ip")
-        group_port_a = pick_path(path_a, "destination_port") or parsed.get("group_port_a")
-        group_port_b = pick_path(path_b, "destination_port")
-        source_port_a = pick_path(path_a, "source_port")
-        source_port_b = pick_path(path_b, "source_port")
-        media_type = pick_path(path_a, "media_type") or parsed.get("media_type") or flow.get("media_type")
-        redundancy_group = parsed.get("redundancy_group")
-        results.append({
-            "nmos_flow_id": flow_id,
-            "label": flow.get("label") or flow_id,
-            "description": flow.get("description"),
-            "node_label": node_info.get("label") if isinstance(node_info, dict) else None,
-            "node_description": node_info.get("description") if isinstance(node_info, dict) else None,
-            "nmos_node_label": node_info.get("label") if isinstance(node_info, dict) else None,
-            "nmos_node_description": node_info.get("description") if isinstance(node_info, dict) else None,
-            "format": flow.get("format"),
-            "tags": flow.get("tags"),
-            "source_id": flow.get("source_id"),
-            "parents": flow.get("parents"),
-            "version": flow.get("version"),
-            "nmos_device_id": flow.get("device_id"),
-            "nmos_node_id": node_info.get("id") if isinstance(node_info, dict) else None,
-            "nmos_sender_id": primary_sender.get("id") if primary_sender else None,
-            "sender_transport": primary_sender.get("transport") if primary_sender else None,
-            "sender_manifest": primary_sender.get("manifest_href") if primary_sender else None,
-            "source_addr_a": source_addr_a,
-            "source_addr_b": source_addr_b,
-            "source_port_a": source_port_a,
-            "source_port_b": source_port_b,
-            "multicast_addr_a": multicast_addr_a,
-            "multicast_addr_b": multicast_addr_b,
-            "group_port_a": group_port_a,
-            "group_port_b": group_port_b,
-            "media_type": media_type,
-            "st2110_format": flow.get("format"),
-            "redundancy_group": redundancy_group,
-            "sdp_url": manifest_href,
-            "sdp_cache": sdp_cache,
-            "nmos_is04_host": is04_host,
-            "nmos_is04_port": is04_port,
-            "nmos_is04_base_url": is04_base,
-            "nmos_is05_host": is05_host,
-            "nmos_is05_port": is05_port,
-            "nmos_is05_base_url": is05_base,
-            "nmos_is04_version": version,
-            "nmos_is05_version": conn_version,
-            "raw_flow": flow,
-            "raw_sender": linked_senders
-        })
+        async def fetch_params():
+            if primary_sender and primary_sender.get("id"):
+                return await fetch_connection_params_async(
+                    payload.is05_base_url,
+                    conn_version,
+                    primary_sender["id"],
+                    payload.timeout
+                )
+            return []
+
+        async with slots:
+            sdp_cache, connection_params = await asyncio.gather(
+                fetch_text_async(manifest_href, payload.timeout),
+                fetch_params()
+            )
+        return _discover_entry(flow, linked_senders, node_info, sdp_cache, connection_params, context)
 
-    return {
+    summary = {
         "is04_base_url": payload.is04_base_url,
         "is05_base_url": payload.is05_base_url,
         "is04_version": version,
         "is05_version": conn_version,
-        "node": node_info,
-        "flows": results
+        "node": node_info
     }
+    flows = [flow for flow in flows or [] if isinstance(flow, dict)]
+
+    if payload.stream:
+        return StreamingResponse(_stream_discovery(summary, flows, discover_flow), media_type="application/x-ndjson")
+
+    tasks = [asyncio.ensure_future(discover_flow(flow)) for flow in flows]
+    try:
+        results = await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+    return {**summary, "flows": results}
+
+
+async def _stream_discovery(summary: dict, flows: list, discover_flow):
+    """
+    NDJSON: a "node" line, one "flow" (or "error") line per flow as soon as it
+    is ready, then "done". ``index`` is the flow's position in the node list.
+    """
+    yield json.dumps({"type": "node", "count": len(flows), **jsonable_encoder(summary)}) + "\n"
+
+    async def indexed(index: int, flow: dict):
+        try:
+            return index, await discover_flow(flow), None
+        except HTTPException as exc:
+            return index, None, exc.detail if isinstance(exc.detail, str) else str(exc.detail)
+        except Exception as exc:
+            # One malformed node document must not cut the stream short of "done"
+            logger.exception("NMOS discovery failed for flow %s", flow.get("id"))
+            return index, None, f"{type(exc).__name__}: {exc}"
+
+    tasks = [asyncio.ensure_future(indexed(index, flow)) for index, flow in enumerate(flows)]
+    errors = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, entry, reason = await next_done
+            if entry is None:
+                errors += 1
+                line = {"type": "error", "index": index, "nmos_flow_id": flows[index].get("id"), "reason": reason}
+            else:
+                line = {"type": "flow", "index": index, "flow": entry}
+            yield json.dumps(jsonable_encoder(line)) + "\n"
+    finally:
+        # Client went away: stop the remaining lookups
+        for task in tasks:
+            task.cancel()
+    yield json.dumps({"type": "done", "count": len(flows), "errors": errors}) + "\n"
 
 
 @router.post("/nmos/detect-is05")
-def detect_is05_endpoints(payload: DetectIS05Request, user=Depends(require_roles("editor", "admin"))):
+async def detect_is05_endpoints(payload: DetectIS05Request, user=Depends(require_roles("editor", "admin"))):
     """
     Detect IS-05 Connection API endpoints from IS-04 devices.
     Returns a list of available IS-05 endpoints with device information.
@@ -180,7 +275,7 @@ def detect_is05_endpoints(payload: DetectIS05Request, user=Depends(require_roles
     devices_url = urljoin(is04_base, node_prefix + "devices")
 
     try:
-        devices = fetch_json(devices_url, payload.timeout)
+        devices = await fetch_json_async(devices_url, payload.timeout)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to fetch devices from IS-04: {str(e)}")
 
@@ -273,7 +368,7 @@ def detect_is05_endpoints(payload: DetectIS05Request, user=Depends(require_roles
 
 
 @router.post("/nmos/detect-is04-from-rds")
-def detect_is04_from_rds(payload: DetectIS04FromRDSRequest, user=Depends(require_roles("editor", "admin"))):
+async def detect_is04_from_rds(payload: DetectIS04FromRDSRequest, user=Depends(require_roles("editor", "admin"))):
     """
     Detect IS-04 Node API endpoints from RDS (IS-04 Query API).
     Returns a list of nodes with their IS-04 Registration API URLs.
@@ -284,7 +379,7 @@ def detect_is04_from_rds(payload: DetectIS04FromRDSRequest, user=Depends(require
     nodes_url = urljoin(rds_base, query_prefix + "nodes")
 
     try:
-        nodes = fetch_json(nodes_url, payload.timeout)
+        nodes = await fetch_json_async(nodes_url, payload.timeout)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to fetch nodes from RDS: {str(e)}")
 
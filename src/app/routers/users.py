@@ -2,7 +2,7 @@ import logging
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel, constr
-from app.db import get_db_connection
+from app.db import db_connection
 from app.auth import create_token, decode_token, require_roles
 import bcrypt
 
@@ -37,12 +37,9 @@ class UserUpdate(BaseModel):
 # --------------------------------------------------------
 @router.post("/login")
 def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT username, password_hash, role FROM users WHERE username=%s", (form_data.username,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT username, password_hash, role FROM users WHERE username=%s", (form_data.username,))
+        row = cur.fetchone()
 
     if not row or not bcrypt.checkpw(form_data.password.encode(), row[1].encode()):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials / 認証失敗")
@@ -69,12 +66,9 @@ def me(user=Depends(decode_token)):
 # --------------------------------------------------------
 @router.get("/users")
 def list_users(user=Depends(require_roles("admin"))):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT username, role, created_at FROM users ORDER BY username;")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT username, role, created_at FROM users ORDER BY username;")
+        rows = cur.fetchall()
     return [{"username": r[0], "role": r[1], "created_at": r[2]} for r in rows]
 
 
@@ -85,25 +79,20 @@ def list_users(user=Depends(require_roles("admin"))):
 @router.post("/users", status_code=201)
 def create_user(payload: UserCreate, user=Depends(require_roles("admin"))):
     payload.ensure_valid()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM users WHERE username=%s;", (payload.username,))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=409, detail="User already exists")
-
-    hashed = bcrypt.hashpw(payload.password.encode(), bcrypt.gensalt()).decode()
-    cur.execute(
-        """
-        INSERT INTO users (username, password_hash, role)
-        VALUES (%s, %s, %s);
-        """,
-        (payload.username, hashed, payload.role)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM users WHERE username=%s;", (payload.username,))
+        if cur.fetchone():
+            raise HTTPException(status_code=409, detail="User already exists")
+
+        hashed = bcrypt.hashpw(payload.password.encode(), bcrypt.gensalt()).decode()
+        cur.execute(
+            """
+            INSERT INTO users (username, password_hash, role)
+            VALUES (%s, %s, %s);
+            """,
+            (payload.username, hashed, payload.role)
+        )
+        conn.commit()
     audit_logger.info("user created | actor=%s | target=%s | role=%s", user["username"], payload.username, payload.role)
     return {"result": "ok", "username": payload.username}
 
@@ -134,17 +123,11 @@ def update_user(username: str, payload: UserUpdate, user=Depends(require_roles("
         raise HTTPException(status_code=400, detail="No fields to update")
 
     values.append(username)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE username=%s;", values)
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"UPDATE users SET {', '.join(updates)} WHERE username=%s;", values)
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+        conn.commit()
     audit_logger.info(
         "user updated | actor=%s | target=%s | fields=%s",
         user["username"],
@@ -162,16 +145,10 @@ def update_user(username: str, payload: UserUpdate, user=Depends(require_roles("
 def delete_user(username: str, user=Depends(require_roles("admin"))):
     if user["username"] == username:
         raise HTTPException(status_code=400, detail="Cannot delete current user")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE username=%s;", (username,))
-    if cur.rowcount == 0:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM users WHERE username=%s;", (username,))
+        if cur.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+        conn.commit()
     audit_logger.info("user deleted | actor=%s | target=%s", user["username"], username)
     return {"result": "ok", "username": username, "deleted": True}
@@ -6,7 +6,7 @@ import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
-from app.db import get_db_connection
+from app.db import db_connection
 
 logger = logging.getLogger("mmam.scheduler")
 
@@ -23,15 +23,12 @@ def init_scheduler():
 
     try:
         # Load all jobs from database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT job_id, job_type, enabled, schedule_type, schedule_value
-            FROM scheduled_jobs
-        """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT job_id, job_type, enabled, schedule_type, schedule_value
+                FROM scheduled_jobs
+            """)
+            rows = cur.fetchall()
 
         # Register enabled jobs
         for job_id, job_type, enabled, schedule_type, schedule_value in rows:
@@ -88,16 +85,13 @@ def reload_job(job_id: str):
             logger.info(f"Removed existing job: {job_id}")
 
         # Load job config from database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT job_id, job_type, enabled, schedule_type, schedule_value
-            FROM scheduled_jobs
-            WHERE job_id = %s
-        """, (job_id,))
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT job_id, job_type, enabled, schedule_type, schedule_value
+                FROM scheduled_jobs
+                WHERE job_id = %s
+            """, (job_id,))
+            row = cur.fetchone()
 
         if not row:
             logger.warning(f"Job not found in database: {job_id}")
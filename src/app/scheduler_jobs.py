@@ -5,7 +5,7 @@ Scheduled job implementations for automation.
 import logging
 import json
 from datetime import datetime, timezone
-from app.db import get_db_connection
+from app.db import db_connection
 
 logger = logging.getLogger("mmam.scheduler.jobs")
 
@@ -79,23 +79,18 @@ def _update_job_result(job_id: str, status: str, result: dict):
         result: Result data (dict)
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
         now = datetime.now(timezone.utc)
 
-        cur.execute("""
-            UPDATE scheduled_jobs
-            SET last_run_at = %s,
-                last_run_status = %s,
-                last_run_result = %s::JSONB,
-                updated_at = %s
-            WHERE job_id = %s
-        """, (now, status, json.dumps(result), now, job_id))
-
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE scheduled_jobs
+                SET last_run_at = %s,
+                    last_run_status = %s,
+                    last_run_result = %s::JSONB,
+                    updated_at = %s
+                WHERE job_id = %s
+            """, (now, status, json.dumps(result), now, job_id))
+            conn.commit()
 
         logger.debug(f"Updated job result for {job_id}: {status}")
 
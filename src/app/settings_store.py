@@ -1,5 +1,5 @@
 from typing import Dict, Any
-from app.db import get_db_connection
+from app.db import db_connection
 
 SETTINGS_SCHEMA: Dict[str, Dict[str, Any]] = {
     "allow_anonymous_flows": {
@@ -55,12 +55,9 @@ def _convert_output(key: str, raw_value: str) -> Any:
 
 
 def list_settings() -> Dict[str, Any]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT key, value FROM settings;")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT key, value FROM settings;")
+        rows = cur.fetchall()
 
     result = {key: SETTINGS_SCHEMA[key]["default"] for key in SETTINGS_SCHEMA}
     for key, value in rows:
@@ -74,12 +71,9 @@ def get_setting(key: str) -> Any:
     if not definition:
         raise KeyError(key)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key=%s;", (key,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT value FROM settings WHERE key=%s;", (key,))
+        row = cur.fetchone()
     if not row:
         return definition["default"]
     return _convert_output(key, row[0])
@@ -87,17 +81,14 @@ def get_setting(key: str) -> Any:
 
 def update_setting(key: str, value: Any) -> Any:
     normalized = _normalize_input(key, value)
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (key, value, updated_at)
-        VALUES (%s, %s, CURRENT_TIMESTAMP)
-        ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value, updated_at=CURRENT_TIMESTAMP;
-        """,
-        (key, normalized)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO settings (key, value, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value, updated_at=CURRENT_TIMESTAMP;
+            """,
+            (key, normalized)
+        )
+        conn.commit()
     return _convert_output(key, normalized)
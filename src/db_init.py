@@ -4,6 +4,13 @@ import time
 import bcrypt
 import uuid
 from ipaddress import ip_address
+from app.flow_search import (
+    TRIGRAM_INDEXES,
+    SEARCH_VECTOR_COLUMN,
+    SEARCH_VECTOR_EXPR,
+    IPV4_INT_FUNCTION,
+    ADDRESS_INT_COLUMNS
+)
 
 # Database connection settings
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -191,6 +198,8 @@ def init_db(max_retries: int = 10, wait_sec: int = 3):
     cur.execute("ALTER TABLE flows ADD COLUMN IF NOT EXISTS locked BOOLEAN NOT NULL DEFAULT FALSE;")
     cur.execute("ALTER TABLE flows ADD COLUMN IF NOT EXISTS rds_version TEXT;")
     conn.commit()
+    ensure_search_vector(cur, conn)
+    ensure_address_int_columns(cur, conn)
 
     # --------------------------------------------------------
     # Checker run history
@@ -237,6 +246,7 @@ def init_db(max_retries: int = 10, wait_sec: int = 3):
     cur.execute("CREATE INDEX IF NOT EXISTS address_buckets_parent_idx ON address_buckets(parent_id);")
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS address_buckets_range_idx ON address_buckets(kind, start_int, end_int);")
     conn.commit()
+    ensure_bucket_ranges(cur, conn)
     ensure_privilege_buckets(cur, conn)
 
     insert_sample_flow(cur, conn)
@@ -352,6 +362,99 @@ def insert_sample_flow(cur, conn):
     print(f"Inserted sample flow {sample_flow_id}.")
 
 
+def ensure_search_vector(cur, conn):
+    """
+    Weighted full-text vector maintained by PostgreSQL as a stored generated column.
+    """
+    cur.execute(f"""
+        ALTER TABLE flows ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector
+        GENERATED ALWAYS AS ({SEARCH_VECTOR_EXPR}) STORED;
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS flows_search_vector_idx ON flows USING GIN ({SEARCH_VECTOR_COLUMN});")
+    conn.commit()
+
+
+def ensure_address_int_columns(cur, conn):
+    """
+    Integer shadows of the TEXT address columns, generated by PostgreSQL.
+    Values that are not plain IPv4 text become NULL instead of failing the write.
+    """
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION {IPV4_INT_FUNCTION}(value TEXT) RETURNS BIGINT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE
+                WHEN btrim(value) ~ '^(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])(\\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])){{3}}$'
+                THEN btrim(value)::inet - '0.0.0.0'::inet
+            END
+        $$;
+    """)
+    for column, int_column in ADDRESS_INT_COLUMNS.items():
+        cur.execute(f"""
+            ALTER TABLE flows ADD COLUMN IF NOT EXISTS {int_column} BIGINT
+            GENERATED ALWAYS AS ({IPV4_INT_FUNCTION}({column})) STORED;
+        """)
+        cur.execute(f"CREATE INDEX IF NOT EXISTS flows_{int_column}_idx ON flows({int_column});")
+    conn.commit()
+
+    checks = " OR ".join(
+        f"(NULLIF(btrim({column}), '') IS NOT NULL AND {int_column} IS NULL)"
+        for column, int_column in ADDRESS_INT_COLUMNS.items()
+    )
+    cur.execute(f"SELECT COUNT(*) FROM flows WHERE {checks};")
+    invalid = cur.fetchone()[0]
+    if invalid:
+        print(f"[init_db] {invalid} flow(s) have address values that are not valid IPv4 (see /api/flows/address-issues)")
+
+
+def ensure_bucket_ranges(cur, conn):
+    """
+    GiST-indexed int8range over each bucket for overlap / containment lookups,
+    plus an exclusion constraint so buckets of one kind under the same parent
+    (top-level tier0 buckets included) cannot overlap.
+    """
+    cur.execute("""
+        ALTER TABLE address_buckets ADD COLUMN IF NOT EXISTS int_range INT8RANGE
+        GENERATED ALWAYS AS (int8range(start_int, end_int, '[]')) STORED;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS address_buckets_int_range_idx ON address_buckets USING gist (int_range);")
+    # Earlier form: NULL parent_id never compared equal and kinds were mixed
+    cur.execute("ALTER TABLE address_buckets DROP CONSTRAINT IF EXISTS address_buckets_sibling_overlap_excl;")
+    conn.commit()
+
+    cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'address_buckets_sibling_kind_overlap_excl';")
+    if cur.fetchone():
+        return
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+        cur.execute("""
+            ALTER TABLE address_buckets ADD CONSTRAINT address_buckets_sibling_kind_overlap_excl
+            EXCLUDE USING gist (COALESCE(parent_id, 0) WITH =, kind WITH =, int_range WITH &&);
+        """)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"[init_db] ERROR: bucket overlap constraint could not be created, "
+              f"only the API check guards against overlaps: {e}")
+        _report_bucket_overlaps(cur)
+
+
+def _report_bucket_overlaps(cur):
+    cur.execute("""
+        SELECT a.id, a.start_ip::TEXT, a.end_ip::TEXT, b.id, b.start_ip::TEXT, b.end_ip::TEXT, a.kind
+        FROM address_buckets a
+        JOIN address_buckets b
+          ON COALESCE(a.parent_id, 0) = COALESCE(b.parent_id, 0)
+         AND a.kind = b.kind
+         AND a.id < b.id
+         AND a.int_range && b.int_range
+        ORDER BY a.id, b.id
+        LIMIT 50;
+    """)
+    for a_id, a_start, a_end, b_id, b_start, b_end, kind in cur.fetchall():
+        print(f"[init_db] ERROR: overlapping {kind} buckets {a_id} ({a_start} - {a_end}) "
+              f"and {b_id} ({b_start} - {b_end}); resolve them and restart to add the constraint")
+
+
 def ensure_indexes(cur, conn):
     indexes = [
         "CREATE INDEX IF NOT EXISTS flows_updated_at_idx ON flows(updated_at DESC);",
@@ -364,8 +467,31 @@ def ensure_indexes(cur, conn):
         "CREATE INDEX IF NOT EXISTS flows_group_port_a_idx ON flows(group_port_a);",
         "CREATE INDEX IF NOT EXISTS flows_group_port_b_idx ON flows(group_port_b);",
         "CREATE INDEX IF NOT EXISTS flows_nmos_flow_id_idx ON flows(nmos_flow_id);",
-        "CREATE INDEX IF NOT EXISTS flows_nmos_sender_id_idx ON flows(nmos_sender_id);"
+        "CREATE INDEX IF NOT EXISTS flows_nmos_sender_id_idx ON flows(nmos_sender_id);",
+        # Keyset pagination: (sort key, flow_id) composites for the common sort_by values
+        "CREATE INDEX IF NOT EXISTS flows_updated_at_flow_id_idx ON flows(updated_at, flow_id);",
+        "CREATE INDEX IF NOT EXISTS flows_created_at_flow_id_idx ON flows(created_at, flow_id);",
+        "CREATE INDEX IF NOT EXISTS flows_display_name_flow_id_idx ON flows(display_name, flow_id);",
+        "CREATE INDEX IF NOT EXISTS flows_nmos_node_label_flow_id_idx ON flows(nmos_node_label, flow_id);"
     ]
     for statement in indexes:
         cur.execute(statement)
     conn.commit()
+    ensure_trigram_indexes(cur, conn)
+
+
+def ensure_trigram_indexes(cur, conn):
+    """
+    Enable pg_trgm and index the concatenated search expressions used by list_flows.
+    Skips (with a warning) when the extension cannot be created, e.g. without privileges.
+    """
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"[init_db] pg_trgm unavailable, keyword search stays unindexed: {e}")
+        return
+    for name, expression in TRIGRAM_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON flows USING GIN ({expression} gin_trgm_ops);")
+    conn.commit()
@@ -0,0 +1,76 @@
+"""
+Bucket backup import planning and the binary RLE segment encoding.
+バケットバックアップの取り込み順序と RLE バイナリ形式を確認する。
+"""
+import random
+
+from app.routers.address_map import AddressBucketBackupEntry, _plan_bucket_import, _runs_as_rle
+
+
+def _entry(bucket_id, kind, parent_id=None, privilege_id=None, start="239.0.0.0", end="239.0.0.255"):
+    return AddressBucketBackupEntry(
+        id=bucket_id, kind=kind, parent_id=parent_id, privilege_id=privilege_id, start_ip=start, end_ip=end
+    )
+
+
+def test_parents_are_inserted_before_children():
+    rng = random.Random(1)
+    for _ in range(50):
+        entries = [_entry(1, "tier0")]
+        for bucket_id in range(2, 40):
+            parent = rng.choice([entry.id for entry in entries])
+            privilege = rng.choice([None] + [entry.id for entry in entries])
+            entries.append(_entry(bucket_id, rng.choice(["parent", "child"]), parent, privilege))
+        rng.shuffle(entries)
+        rows, problems = _plan_bucket_import(entries)
+        assert problems == []
+        position = {row[0]: index for index, row in enumerate(rows)}
+        assert len(position) == len(entries)
+        for entry in entries:
+            for ref in (entry.parent_id, entry.privilege_id):
+                if ref is not None:
+                    assert position[ref] < position[entry.id]
+
+
+def test_cycles_and_invalid_entries_are_reported():
+    rows, problems = _plan_bucket_import([
+        _entry(1, "parent", 2),
+        _entry(2, "parent", 1),
+        _entry(3, "parent"),
+        _entry(4, "child", 99),
+        _entry(3, "child", 3),
+        _entry(5, "unknown"),
+        _entry(6, "child", 3, start="239.0.0.9", end="239.0.0.1"),
+        _entry(7, "child", 3, start="not-an-ip"),
+    ])
+    assert [row[0] for row in rows] == [3]
+    errors = {(problem["index"], problem["id"]): problem["error"] for problem in problems}
+    assert errors[(0, 1)].startswith("Parent references form a cycle")
+    assert errors[(1, 2)].startswith("Parent references form a cycle")
+    assert errors[(3, 4)] == "Missing parent/privilege buckets [99]"
+    assert errors[(4, 3)] == "Duplicate bucket id"
+    assert errors[(5, 5)].startswith("Unknown kind")
+    assert errors[(6, 6)] == "start_ip must be <= end_ip"
+    assert errors[(7, 7)].startswith("Invalid IPv4")
+    assert [problem["index"] for problem in problems] == sorted(problem["index"] for problem in problems)
+
+
+def _decode_rle(data):
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value)
+            value, shift = 0, 0
+    assert shift == 0
+    return [value >> 2 for value in values], [value & 3 for value in values]
+
+
+def test_rle_varints_round_trip():
+    rng = random.Random(2)
+    lengths = [1, 31, 32, 127, 128, 1 << 20, 1 << 28] + [rng.randint(1, 1 << 24) for _ in range(200)]
+    states = [rng.randint(0, 3) for _ in lengths]
+    data = _runs_as_rle({"length": lengths, "state": states})
+    assert _decode_rle(data) == (lengths, states)
+    assert len(_runs_as_rle({"length": [31], "state": [3]})) == 1
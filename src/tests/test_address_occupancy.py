@@ -0,0 +1,155 @@
+"""
+Occupancy index, free-run search and block re-check against brute force.
+使用状況インデックスと空き範囲探索を総当たりと比較する。
+"""
+import random
+from contextlib import contextmanager
+
+from app import address_occupancy
+from app.address_occupancy import OccupancyIndex, fit_blocks, iter_free_runs
+
+BASE = 0xEF000000  # 239.0.0.0
+
+
+def _free_runs_brute(start, end, used, blocked):
+    taken = set(used)
+    for lo, hi, *_ in blocked:
+        taken.update(range(lo, hi + 1))
+    runs, run_start = [], None
+    for addr in range(start, end + 1):
+        if addr in taken:
+            if run_start is not None:
+                runs.append((run_start, addr - 1))
+                run_start = None
+        elif run_start is None:
+            run_start = addr
+    if run_start is not None:
+        runs.append((run_start, end))
+    return runs
+
+
+def _fit_brute(runs, size, align, count):
+    free = {addr for lo, hi in runs for addr in range(lo, hi + 1)}
+    starts, candidate = [], -(-min(free, default=0) // align) * align
+    limit = max(free, default=-1)
+    while candidate <= limit and len(starts) < count:
+        if all(addr in free for addr in range(candidate, candidate + size)):
+            starts.append(candidate)
+            candidate += -(-size // align) * align
+        else:
+            candidate += align
+    return starts
+
+
+def test_free_runs_and_fit_blocks_match_brute_force():
+    rng = random.Random(3)
+    for _ in range(300):
+        start = rng.randint(0, 20)
+        end = start + rng.randint(0, 80)
+        used = sorted(rng.sample(range(0, 110), rng.randint(0, 12)))
+        blocked = []
+        for _ in range(rng.randint(0, 4)):
+            lo = rng.randint(0, 100)
+            blocked.append((lo, lo + rng.randint(0, 10), rng.randint(1, 9)))
+        runs = list(iter_free_runs(start, end, used, blocked))
+        assert runs == _free_runs_brute(start, end, used, blocked)
+        size, align, count = rng.randint(1, 8), rng.choice([1, 2, 4, 8]), rng.randint(1, 5)
+        assert fit_blocks(runs, size, align, count) == _fit_brute(runs, size, align, count)
+
+
+def test_index_tracks_counts_like_a_dict():
+    rng = random.Random(5)
+    pool = [BASE + offset for offset in range(64)] + [0x0A000001, 0x0A000002, 0xC0A80001]
+    model = {}
+    for addr in rng.choices(pool, k=40):
+        model[addr] = model.get(addr, 0) + 1
+    index = OccupancyIndex()
+    index.load([addr for addr, count in model.items() for _ in range(count)], [])
+    for _ in range(400):
+        addr = rng.choice(pool)
+        action = rng.random()
+        if action < 0.4:
+            index.add(addr)
+            model[addr] = model.get(addr, 0) + 1
+        elif action < 0.8:
+            index.remove(addr)
+            if model.get(addr):
+                model[addr] -= 1
+        else:
+            count = rng.randint(0, 3)
+            index.set_count(addr, count)
+            model[addr] = count
+        lo, hi = sorted(rng.choice(pool) for _ in range(2))
+        expected = sorted(a for a, c in model.items() if c and lo <= a <= hi)
+        assert index.used_addresses(lo, hi) == expected
+        assert index.count_used(lo, hi) == len(expected)
+    assert set(index.stats()["octets"]) <= set(address_occupancy.BITMAP_OCTETS)
+
+
+def test_histogram_matches_brute_force():
+    rng = random.Random(9)
+    used = set(rng.sample(range(BASE, BASE + 256), 40))
+    reserved = [(BASE + 20, BASE + 59, 1), (BASE + 50, BASE + 70, 2), (BASE + 200, BASE + 255, 3)]
+    index = OccupancyIndex()
+    index.load(sorted(used), reserved)
+    reserved_addrs = {addr for lo, hi, _ in reserved for addr in range(lo, hi + 1)}
+    cell_size = 16
+    for cell, (cell_used, cell_reserved) in enumerate(index.histogram(BASE, cell_size, 16)):
+        cell_range = range(BASE + cell * cell_size, BASE + (cell + 1) * cell_size)
+        assert cell_used == sum(addr in used for addr in cell_range)
+        assert cell_reserved == sum(addr in reserved_addrs and addr not in used for addr in cell_range)
+    assert index.free_blocks(BASE, BASE + 255, 4, 4, 100) == _fit_brute(
+        _free_runs_brute(BASE, BASE + 255, sorted(used), reserved), 4, 4, 100
+    )
+
+
+class _FakeCursor:
+    def __init__(self, flow_addresses):
+        self.flow_addresses = flow_addresses
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params):
+        if "GROUP BY" in sql:
+            wanted = set(params["addresses"])
+            self.rows = [(addr, self.flow_addresses.count(addr)) for addr in sorted(wanted)
+                         if addr in self.flow_addresses]
+        else:
+            self.rows = [(addr,) for addr in self.flow_addresses
+                         if any(start <= addr <= start + params["last"] for start in params["starts"])]
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_confirm_free_blocks_drops_taken_blocks_and_recounts(monkeypatch):
+    index = OccupancyIndex()
+    index.load([], [])
+    flow_addresses = [BASE + 5, BASE + 5, BASE + 17]
+
+    @contextmanager
+    def fake_connection():
+        cursor = _FakeCursor(flow_addresses)
+
+        class _Conn:
+            def cursor(self):
+                return cursor
+        yield _Conn()
+
+    monkeypatch.setattr(address_occupancy, "db_connection", fake_connection)
+    monkeypatch.setattr(address_occupancy, "_index", index)
+
+    starts = index.free_blocks(BASE, BASE + 31, 4, 4, 8)
+    assert starts == [BASE + offset for offset in range(0, 32, 4)]
+    assert address_occupancy.confirm_free_blocks(starts, 4) == [
+        start for start in starts if start not in (BASE + 4, BASE + 16)
+    ]
+    assert index.used_addresses(BASE, BASE + 31) == [BASE + 5, BASE + 17]
+    index.remove(BASE + 5)
+    assert index.count_used(BASE + 5, BASE + 5) == 1
+    assert address_occupancy.confirm_free_blocks([], 4) == []
@@ -0,0 +1,43 @@
+"""
+Bucket snapshot interval queries against brute force.
+バケットスナップショットの範囲検索を総当たりと比較する。
+"""
+import random
+
+from app.bucket_cache import BucketSnapshot
+
+
+def _random_blocks(rng, count):
+    blocks = []
+    for bucket_id in range(count):
+        start = rng.randint(0, 1000)
+        blocks.append({"id": bucket_id, "start_int": start, "end_int": start + rng.choice([0, 3, 50, 400])})
+    return blocks
+
+
+def test_intersecting_matches_brute_force():
+    rng = random.Random(4)
+    for _ in range(40):
+        blocks = _random_blocks(rng, rng.randint(0, 80))
+        snapshot = BucketSnapshot(blocks)
+        for _ in range(50):
+            lo = rng.randint(-10, 1400)
+            hi = lo + rng.randint(0, 200)
+            found = snapshot.intersecting(lo, hi)
+            expected = [block for block in blocks if block["start_int"] <= hi and block["end_int"] >= lo]
+            assert sorted(block["id"] for block in found) == sorted(block["id"] for block in expected)
+            assert [block["start_int"] for block in found] == sorted(block["start_int"] for block in found)
+
+
+def test_nested_ranges():
+    blocks = [
+        {"id": 1, "start_int": 0, "end_int": 255},
+        {"id": 2, "start_int": 0, "end_int": 127},
+        {"id": 3, "start_int": 16, "end_int": 31},
+        {"id": 4, "start_int": 128, "end_int": 255},
+        {"id": 5, "start_int": 300, "end_int": 310},
+    ]
+    snapshot = BucketSnapshot(blocks)
+    assert [block["id"] for block in snapshot.intersecting(20, 20)] in ([1, 2, 3], [2, 1, 3])
+    assert {block["id"] for block in snapshot.intersecting(127, 128)} == {1, 2, 4}
+    assert snapshot.intersecting(256, 299) == []
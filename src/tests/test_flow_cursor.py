@@ -0,0 +1,63 @@
+"""
+Keyset pagination: cursor round-trip and the seek predicate's NULL ordering.
+キーセットページングのカーソルとシーク条件（NULL の並び）を確認する。
+"""
+import random
+import sqlite3
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.routers.flows import _decode_cursor, _encode_cursor, _keyset_condition
+
+
+def test_cursor_round_trip():
+    flow_id = str(uuid.uuid4())
+    stamp = datetime(2026, 1, 2, 3, 4, 5)
+    for value in (stamp, "Camera 1", 42, None):
+        cursor = _encode_cursor("updated_at", "desc", value, flow_id)
+        assert _decode_cursor(cursor, "updated_at", "desc") == (value, flow_id)
+
+
+def test_cursor_rejects_other_sort_and_garbage():
+    cursor = _encode_cursor("display_name", "asc", "a", str(uuid.uuid4()))
+    with pytest.raises(HTTPException) as exc:
+        _decode_cursor(cursor, "display_name", "desc")
+    assert exc.value.status_code == 400
+    with pytest.raises(HTTPException):
+        _decode_cursor("not-a-cursor", "display_name", "asc")
+
+
+def _sort_key(descending: bool):
+    # PostgreSQL defaults: NULLS LAST for ASC, NULLS FIRST for DESC
+    def key(row):
+        value, flow_id = row
+        return (value is None, value if value is not None else 0, flow_id)
+    if not descending:
+        return key
+    return lambda row: (row[0] is not None, -(row[0] or 0), [-ord(ch) for ch in row[1]])
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_seek_matches_order_with_nulls(descending):
+    rng = random.Random(7)
+    rows = [(rng.choice([None, 1, 2, 3, 4]), str(uuid.UUID(int=rng.getrandbits(128)))) for _ in range(60)]
+    ordered = sorted(rows, key=_sort_key(descending))
+
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE flows (sort_value INTEGER, flow_id TEXT)")
+    db.executemany("INSERT INTO flows VALUES (?, ?)", rows)
+    direction = "DESC NULLS FIRST" if descending else "ASC NULLS LAST"
+    flow_direction = "DESC" if descending else "ASC"
+
+    for position, (value, flow_id) in enumerate(ordered):
+        clause, params = _keyset_condition("sort_value", descending, value, flow_id)
+        sql = clause.replace("%s::uuid", "?").replace("%s", "?")
+        found = db.execute(
+            f"SELECT sort_value, flow_id FROM flows WHERE {sql} "
+            f"ORDER BY sort_value {direction}, flow_id {flow_direction}",
+            params
+        ).fetchall()
+        assert found == ordered[position + 1:]
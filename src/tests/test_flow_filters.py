@@ -0,0 +1,88 @@
+"""
+Typed filter compilation for GET /api/flows.
+GET /api/flows のフィルタコンパイルを確認する。
+"""
+import random
+import uuid
+from ipaddress import IPv4Network
+
+import pytest
+from fastapi import HTTPException
+
+from app.flow_filters import compile_flow_filters, compile_shape
+
+
+def test_active_only_by_default():
+    conditions, values = compile_flow_filters([])
+    assert conditions == ["flow_status = 'active'"]
+    assert values == []
+    assert compile_flow_filters([], include_unused=True) == ([], [])
+
+
+def test_address_exact_cidr_and_text_fallback():
+    conditions, values = compile_flow_filters([("multicast_addr_a", "239.1.1.1")], include_unused=True)
+    assert conditions == ["multicast_addr_a_int = %s"]
+    assert values == [0xEF010101]
+
+    conditions, values = compile_flow_filters([("multicast_addr_a", "239.1.1.0/24")], include_unused=True)
+    assert conditions == ["multicast_addr_a_int BETWEEN %s AND %s"]
+    assert values == [0xEF010100, 0xEF0101FF]
+
+    conditions, values = compile_flow_filters([("multicast_addr_a", "239.1.1")], include_unused=True)
+    assert "ILIKE" in conditions[0]
+    assert values == ["%239.1.1%", "%239.1.1%"]
+
+
+def test_cidr_bounds_match_ipaddress():
+    rng = random.Random(11)
+    for _ in range(200):
+        prefix = rng.randint(8, 32)
+        network = IPv4Network((rng.getrandbits(32), prefix), strict=False)
+        _, values = compile_flow_filters([("multicast_cidr", str(network))], include_unused=True)
+        low, high = int(network.network_address), int(network.broadcast_address)
+        assert values == [low, high, low, high]
+
+
+def test_group_filter_ors_both_legs():
+    conditions, values = compile_flow_filters(
+        [("multicast_range", "239.0.0.9-239.0.0.1"), ("multicast_cidr", "239.2.0.0/16")],
+        include_unused=True
+    )
+    assert len(conditions) == 1
+    assert conditions[0].count("multicast_addr_a_int BETWEEN") == 2
+    assert conditions[0].count("multicast_addr_b_int BETWEEN") == 2
+    assert values[:4] == [0xEF000001, 0xEF000009, 0xEF000001, 0xEF000009]
+
+
+def test_uuid_exact_and_prefix():
+    flow_id = uuid.uuid4()
+    conditions, values = compile_flow_filters([("flow_id", str(flow_id).upper())], include_unused=True)
+    assert conditions == ["flow_id = %s::uuid"]
+    assert values == [str(flow_id)]
+
+    conditions, values = compile_flow_filters([("flow_id", "ABCD-12")], include_unused=True)
+    assert conditions == ["flow_id BETWEEN %s::uuid AND %s::uuid"]
+    assert values == ["abcd1200-0000-0000-0000-000000000000", "abcd12ff-ffff-ffff-ffff-ffffffffffff"]
+
+    conditions, values = compile_flow_filters([("flow_id", "xyz")], include_unused=True)
+    assert conditions == ["FALSE"]
+
+
+def test_repeated_values_or_and_int_bounds():
+    conditions, values = compile_flow_filters(
+        [("group_port_a", "5004"), ("group_port_a", "5010-5000"), ("group_port_a_min", "10")],
+        include_unused=True
+    )
+    assert conditions == ["(group_port_a = %s OR group_port_a BETWEEN %s AND %s)", "group_port_a >= %s"]
+    assert values == [5004, 5000, 5010, 10]
+    with pytest.raises(HTTPException) as exc:
+        compile_flow_filters([("group_port_a", "abc")])
+    assert exc.value.status_code == 400
+
+
+def test_same_shape_reuses_compiled_sql():
+    compile_flow_filters([("multicast_addr_b", "239.9.9.9")])
+    hits = compile_shape.cache_info().hits
+    conditions, values = compile_flow_filters([("multicast_addr_b", "239.8.8.8")])
+    assert compile_shape.cache_info().hits == hits + 1
+    assert values == [0xEF080808]
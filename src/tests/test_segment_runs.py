@@ -0,0 +1,59 @@
+"""
+The NumPy segment builder must match the reference walk on any input.
+NumPy 版セグメント生成が基準実装と一致することを乱数入力で確認する。
+"""
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from app.routers.address_map import (  # noqa: E402
+    _build_segments,
+    _runs_as_rle,
+    _segment_runs_numpy,
+    _segments_as_runs,
+)
+
+
+def _random_window(rng: random.Random):
+    total = rng.randint(1, 400)
+    used = sorted(rng.sample(range(-5, total + 5), rng.randint(0, total + 10)))
+    reserved = []
+    for block_id in range(1, rng.randint(0, 6) + 1):
+        start = rng.randint(-10, total + 10)
+        end = start + rng.randint(0, total)
+        reserved.append({"start": start, "end": end, "block": {"id": block_id}})
+    return total, used, reserved
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_numpy_runs_match_reference_walk(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        total, used, reserved = _random_window(rng)
+        segments, reserved_count = _build_segments(total, used, reserved)
+        expected = _segments_as_runs(segments)
+
+        runs, numpy_reserved_count = _segment_runs_numpy(total, used, reserved)
+
+        assert runs == expected, (total, used, reserved)
+        assert numpy_reserved_count == reserved_count
+        assert _runs_as_rle(runs) == _runs_as_rle(expected)
+
+
+def test_numpy_runs_dense_window():
+    rng = random.Random(1234)
+    total = 65536
+    used = sorted(rng.sample(range(total), 20000))
+    reserved = [
+        {"start": 1000, "end": 5000, "block": {"id": 1}},
+        {"start": 4000, "end": 4096, "block": {"id": 2}},
+        {"start": 60000, "end": 70000, "block": {"id": 3}},
+    ]
+    segments, reserved_count = _build_segments(total, used, reserved)
+
+    runs, numpy_reserved_count = _segment_runs_numpy(total, used, reserved)
+
+    assert runs == _segments_as_runs(segments)
+    assert numpy_reserved_count == reserved_count